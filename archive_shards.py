@@ -0,0 +1,98 @@
+from threading import Event, Lock
+from typing import Dict, Optional, Tuple
+from internet_archive_client import create_item
+import json
+import os
+
+SHARD_SIZE = int(os.environ.get('ARCHIVE_SHARD_SIZE', 1000))
+SHARD_INDEX_PATH = os.environ.get('ARCHIVE_SHARD_INDEX', 'archive_shards.json')
+
+# The collection and title each entity type's shard items are created with
+SHARD_COLLECTIONS = {
+    'piece': ('piece_mp3s', 'Piece MP3s'),
+    'artist': ('artist_mp3s', 'Artist MP3s'),
+}
+
+
+class ArchiveShards:
+    def __init__(self, index_path: str = SHARD_INDEX_PATH, shard_size: int = SHARD_SIZE):
+        """
+        Spreads mp3 files over a family of Internet Archive items, one per range of `shard_size`
+        entity ids, so that no single item grows large enough to slow down metadata fetches,
+        derives and uploads.
+
+        Shard items are created on demand and remembered in a local JSON index, so routing an
+        upload never needs a lookup. Deletes go by the audio's link, which names its item.
+
+        Args:
+            index_path (str): The JSON file the shard index is stored in.
+            shard_size (int): The number of entity ids per shard. Changing it for an existing
+                index would route entities to the wrong shards.
+        """
+        self.index_path = index_path
+        self.shard_size = shard_size
+        self._lock = Lock()
+        self._index: Dict[str, Dict[str, str]] = {}
+        # Set when the shard being created is in the index, or its creation failed
+        self._creating: Dict[Tuple[str, str], Event] = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self._index = json.load(f)
+
+    def _save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def shard_key(self, entity_id: int) -> str:
+        """Returns the key of the shard holding the entity id."""
+        return str(entity_id // self.shard_size)
+
+    def identifier_for(self, entity_type: str, entity_id: int, create: bool = True) -> Optional[str]:
+        """
+        Returns the identifier of the item holding the entity's mp3.
+
+        Args:
+            entity_type (str): 'piece' or 'artist'.
+            entity_id (int): The id of the piece or artist.
+            create (bool): Whether to create the shard item if it doesn't exist yet.
+
+        Returns:
+            str: The item identifier, or None if the shard doesn't exist and create is False.
+
+        Raises:
+            Exception: If the shard item could not be created.
+        """
+        key = self.shard_key(entity_id)
+        while True:
+            with self._lock:
+                identifier = self._index.get(entity_type, {}).get(key)
+                if identifier or not create:
+                    return identifier
+                creating = self._creating.get((entity_type, key))
+                if creating is None:
+                    creating = self._creating[(entity_type, key)] = Event()
+                    break
+            # Another worker is creating this shard; other shards' lookups aren't held up
+            creating.wait()
+
+        try:
+            collection, title = SHARD_COLLECTIONS[entity_type]
+            first_id = int(key) * self.shard_size
+            identifier = create_item(
+                collection,
+                '{} {}-{}'.format(title, first_id, first_id + self.shard_size - 1),
+                'The mp3 files for {} ids {} to {}.'.format(entity_type, first_id, first_id + self.shard_size - 1)
+            )
+            if not identifier:
+                raise Exception('Could not create shard {} for {} {}'.format(key, entity_type, entity_id))
+            with self._lock:
+                self._index.setdefault(entity_type, {})[key] = identifier
+                self._save()
+            return identifier
+        finally:
+            # Waiters re-check the index; if creation failed, the next one tries again
+            with self._lock:
+                del self._creating[(entity_type, key)]
+            creating.set()
@@ -1,4 +1,6 @@
 class Artist:
+    __slots__ = ('id', 'artist_name', 'nationality', 'lifespan', 'biography')
+
     def __init__(self, id: int, artist_name: str, nationality: str, lifespan: int, biography: str):
         self.id = id
         self.artist_name = artist_name
@@ -1,4 +1,6 @@
 class Audio:
+    __slots__ = ('id', 'created_at', 'entity_type', 'entity_id', 'link')
+
     def __init__(self, id: int, created_at: str, entity_type: str, entity_id: int, link: str):
         self.id = id
         self.created_at = created_at
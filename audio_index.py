@@ -0,0 +1,49 @@
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+from audio import Audio
+
+
+class AudioIndex:
+    def __init__(self, audios: Iterable[Audio] = ()):
+        """
+        An in-memory index of audio records keyed by (entity_type, entity_id), used to
+        answer existence checks without a query per entity.
+        """
+        self._lock = Lock()
+        self._by_entity: Dict[Tuple[str, int], List[Audio]] = {}
+        self._by_id: Dict[int, Audio] = {}
+        for audio in audios:
+            self.add(audio)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def add(self, audio: Audio):
+        """Adds an audio record to the index."""
+        with self._lock:
+            audios = self._by_entity.setdefault((audio.entity_type, audio.entity_id), [])
+            audios.append(audio)
+            # Kept oldest first, so a re-added (e.g. updated) record doesn't change which one get returns
+            audios.sort(key=lambda a: (a.id is None, a.id or 0))
+            if audio.id is not None:
+                self._by_id[audio.id] = audio
+
+    def remove(self, audio_id: int) -> Optional[Audio]:
+        """Removes the audio record with the given id and returns it, if it was indexed."""
+        with self._lock:
+            audio = self._by_id.pop(audio_id, None)
+            if not audio:
+                return None
+            key = (audio.entity_type, audio.entity_id)
+            remaining = [a for a in self._by_entity.get(key, []) if a.id != audio_id]
+            if remaining:
+                self._by_entity[key] = remaining
+            else:
+                self._by_entity.pop(key, None)
+            return audio
+
+    def get(self, entity_type: str, entity_id: int) -> Optional[Audio]:
+        """Returns the first audio record for the entity, or None."""
+        with self._lock:
+            audios = self._by_entity.get((entity_type, entity_id))
+            return audios[0] if audios else None
@@ -1,4 +1,6 @@
 class Audit:
+    __slots__ = ('audit_id', 'auditor', 'content', 'start_time', 'publish_time', 'flagged', 'art_id', 'chatgpt_time', 'skipped', 'gpt_output', 'gpt_model')
+
     def __init__(self, audit_id: int, auditor: str, content: str, start_time: str, publish_time: str, flagged: bool, art_id: int, chatgpt_time: str, skipped: bool, gpt_output: str, gpt_model: str):
         """Represents an audit from the database."""
         self.audit_id = audit_id
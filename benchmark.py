@@ -0,0 +1,241 @@
+"""
+Measures the throughput of the main workflows against local stand-ins for Supabase,
+ElevenLabs, Azure batch synthesis and the Internet Archive (see fake_services.py), so no real
+quota is spent. The stand-ins are seeded from auditing_rows.csv.
+
+    python benchmark.py --sizes 1000,10000,100000 --tts-latency 0.2
+
+Each catalog size runs in a fresh process so its peak RSS isn't inflated by the previous one.
+Only the workflow calls themselves (main.select_pieces, main.map_audits,
+main.run_audio_pipeline, ...) are timed.
+"""
+
+from contextlib import redirect_stdout
+from typing import Callable, List, Optional
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+
+from fake_services import percentiles, serve
+
+
+def _admin(base_url: str, path: str, body: dict = None) -> dict:
+    request = urllib.request.Request(
+        base_url + path,
+        method='POST' if body is not None else 'GET',
+        data=json.dumps(body).encode('utf-8') if body is not None else None,
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def configure_environment(base_url: str, workdir: str):
+    """Points every client at the stand-ins and keeps all local state in workdir."""
+    os.environ.update({
+        'SUPABASE_URL': base_url,
+        'SUPABASE_ANON_KEY': 'bench.bench.bench',
+        'TIMON_SUPABASE_URL': base_url,
+        'TIMON_SUPABASE_ANON_KEY': 'bench.bench.bench',
+        'ELEVEN_LABS_API_URL': base_url,
+        'ELEVEN_LABS_API_KEY': 'bench',
+        'IA_BASE_URL': base_url,
+        'IA_S3_URL': base_url + '/s3',
+        'IA_EMAIL': 'bench@example.com',
+        'IA_PASSWORD': 'bench',
+        'S3_ACCESS_KEY': 'bench',
+        'S3_SECRET': 'bench',
+        # Left empty so the pipeline uses ElevenLabs only; batch synthesis doesn't need it
+        'AZURE_SUBSCRIPTION_KEY': '',
+        'AZURE_SPEECH_ENDPOINT': base_url,
+        'AZURE_BATCH_POLL_SECONDS': '0.2',
+        'TTS_CACHE_DIR': os.path.join(workdir, 'tts_cache'),
+        'JOB_JOURNAL': os.path.join(workdir, 'jobs.sqlite3'),
+        'ARCHIVE_SHARD_INDEX': os.path.join(workdir, 'archive_shards.json'),
+    })
+    # The stand-ins have no quota, so the rate limiters shouldn't be what is measured
+    for provider in ('ELEVENLABS', 'AZURE', 'ARCHIVE', 'SUPABASE'):
+        os.environ[provider + '_RATE'] = '1000000'
+        os.environ[provider + '_BURST'] = '1000000'
+        os.environ[provider + '_CONCURRENCY'] = '64'
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def measure(base_url: str, name: str, run: Callable[[], Optional[int]], count: Callable[[], int] = None) -> dict:
+    """
+    Runs one workflow and returns its timing, its metrics, the stand-ins' request stats and
+    peak RSS. Only run is timed; count, if given, is called afterwards for the number of
+    entities handled, otherwise run's return value is used.
+    """
+    from metrics import metrics
+    metrics.reset()
+    _admin(base_url, '/_admin/reset', {})
+    error = None
+    start = time.monotonic()
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            entities = run()
+    except Exception as e:
+        entities = None
+        error = repr(e)
+    seconds = time.monotonic() - start
+    if count is not None and error is None:
+        entities = count()
+    entities = entities or 0
+
+    result = {
+        'workflow': name,
+        'entities': entities,
+        'seconds': round(seconds, 3),
+        'throughput_per_s': round(entities / seconds, 1) if seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'requests': _admin(base_url, '/_admin/stats')['requests'],
+        'metrics': metrics.summary(),
+    }
+    if error:
+        result['error'] = error
+    return result
+
+
+def run_size(size: int, options: dict, base_url: str, results):
+    """Seeds the stand-ins with `size` pieces and runs every workflow against them."""
+    workdir = tempfile.mkdtemp(prefix='audio-uploader-bench-')
+    configure_environment(base_url, workdir)
+    os.chdir(workdir)
+    _admin(base_url, '/_admin/seed', {'pieces': size})
+    audits = _admin(base_url, '/_admin/stats')['rows']['auditing']
+
+    # Imported only now, since the clients read their configuration at import time
+    try:
+        import main
+    except Exception as e:
+        results.put({'size': size, 'workflows': [], 'error': repr(e)})
+        return
+
+    report = []
+    selected = []
+
+    report.append(measure(base_url, 'select_pieces', lambda: selected.extend(main.select_pieces()), count=lambda: len(selected)))
+    report.append(measure(base_url, 'select_artists', lambda: len(main.select_artists())))
+    report.append(measure(base_url, 'map_audits', main.map_audits, count=lambda: audits))
+
+    limit = options['create_limit']
+    report.append(measure(base_url, 'run_audio_pipeline', lambda: len(main.run_audio_pipeline(
+        (main.piece_job(piece) for piece in selected[:limit]),
+        synthesize_workers=options['synthesize_workers'],
+        upload_workers=options['upload_workers'],
+    ))))
+    if main.batch_text_to_speech is not None:
+        # Different pieces, since the ones above are now recorded and would be skipped
+        report.append(measure(base_url, 'run_azure_batch', lambda: len(main.run_azure_batch(
+            (main.piece_job(piece) for piece in selected[limit:2 * limit]),
+            upload_workers=options['upload_workers'],
+        ))))
+
+    def deleted_audios() -> int:
+        with open('deleted_audios.txt') as f:
+            return sum(1 for _ in f)
+
+    report.append(measure(base_url, 'remove_tainted_audios', main.remove_tainted_audios, count=deleted_audios))
+    results.put({'size': size, 'workflows': report})
+
+
+def collect(worker, results, size: int, timeout: float) -> dict:
+    """Waits for a size's report, giving up if its worker dies or takes longer than timeout."""
+    deadline = time.monotonic() + timeout
+    report = None
+    while report is None:
+        try:
+            report = results.get(timeout=1)
+        except queue.Empty:
+            if not worker.is_alive():
+                # A report put just before exiting may still be in the pipe
+                try:
+                    report = results.get(timeout=1)
+                except queue.Empty:
+                    report = {'size': size, 'workflows': [], 'error': 'worker exited with code {}'.format(worker.exitcode)}
+            elif time.monotonic() > deadline:
+                worker.terminate()
+                report = {'size': size, 'workflows': [], 'error': 'timed out after {} seconds'.format(timeout)}
+    worker.join()
+    if worker.exitcode and 'error' not in report:
+        report['error'] = 'worker exited with code {}'.format(worker.exitcode)
+    return report
+
+
+def print_report(reports: List[dict]):
+    print('{:>8}  {:<24} {:>9} {:>10} {:>12} {:>10}'.format('size', 'workflow', 'entities', 'seconds', 'per second', 'peak MB'))
+    for report in reports:
+        if 'error' in report:
+            print('{:>8}  ERROR {}'.format(report['size'], report['error']))
+        for workflow in report['workflows']:
+            print('{:>8}  {:<24} {:>9} {:>10} {:>12} {:>10}{}'.format(
+                report['size'],
+                workflow['workflow'],
+                workflow['entities'],
+                workflow['seconds'],
+                workflow['throughput_per_s'] or '-',
+                workflow['peak_rss_mb'],
+                '  ERROR ' + workflow['error'] if 'error' in workflow else ''
+            ))
+            # Per-call latency of each timed stage, e.g. elevenlabs/tts or archive/upload
+            for stage, entry in sorted(workflow['metrics'].items()):
+                if 'p95_s' in entry and not stage.startswith('workflow/'):
+                    print('{:>10}{:<32} p50 {:>7}s  p95 {:>7}s  p99 {:>7}s'.format('', stage, entry['p50_s'], entry['p95_s'], entry['p99_s']))
+
+
+def main():
+    """
+    The main function of the program.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the audio workflows against local stand-in services.')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated catalog sizes (number of pieces)')
+    parser.add_argument('--tts-latency', type=float, default=0.2, help='seconds each text-to-speech request takes')
+    parser.add_argument('--upload-latency', type=float, default=0.1, help='seconds each archive upload takes')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='extra seconds each database request takes')
+    parser.add_argument('--create-limit', type=int, default=500, help='how many pieces run_audio_pipeline (and run_azure_batch) run for')
+    parser.add_argument('--synthesize-workers', type=int, default=4)
+    parser.add_argument('--upload-workers', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds to wait for each catalog size before giving up')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    port_queue = context.Queue()
+    server = context.Process(target=serve, args=(port_queue, args.tts_latency, args.upload_latency, args.db_latency), daemon=True)
+    server.start()
+    base_url = 'http://127.0.0.1:{}'.format(port_queue.get(timeout=30))
+
+    options = {
+        'create_limit': args.create_limit,
+        'synthesize_workers': args.synthesize_workers,
+        'upload_workers': args.upload_workers,
+    }
+    reports = []
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            results = context.Queue()
+            worker = context.Process(target=run_size, args=(size, options, base_url, results))
+            worker.start()
+            reports.append(collect(worker, results, size, args.timeout))
+    finally:
+        server.terminate()
+
+    print_report(reports)
+    with open(args.output, 'w') as f:
+        json.dump(reports, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -4,21 +4,115 @@ from urllib.parse import quote
 import requests
 import os
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO
+from tts_cache import TTSCache
+from http_session import get_http_session, timeout
+from scheduler import RetryableError, get_scheduler, raise_for_retryable
+from tts_chunking import split_text, join_mp3
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
 load_dotenv()
 
 elevenLabsApiKey = os.environ.get('ELEVEN_LABS_API_KEY')
 voice_id = "IHMMqNaUtMooU2Q3wLVK"
+# Overridable so the client can be pointed at a local stand-in, e.g. for benchmarks
+elevenLabsApiUrl = os.environ.get('ELEVEN_LABS_API_URL', 'https://api.elevenlabs.io').rstrip('/')
+voice_settings = {"stability": 0, "similarity_boost": 0}
+model_id = None # None uses the API's default model
 
-def text_to_speech(text: str) -> BytesIO:
+# Streamed audio is kept in memory up to this size and spills to a temporary file beyond it
+SPOOL_MAX_BYTES = 1024 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Long texts can be split at sentence boundaries and synthesized in parallel
+CHUNK_MAX_CHARS = 2500
+CHUNK_WORKERS = 4
+
+tts_cache = TTSCache(
+    os.environ.get('TTS_CACHE_DIR', '.tts_cache'),
+    int(os.environ.get('TTS_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+)
+
+def _post(url: str, headers: dict, data: dict, stream: bool = False) -> requests.Response:
+    """
+    Sends a request to ElevenLabs within its rate limits, retrying 429s, 5xx responses and
+    connection errors. Returns the final response, or None if every retry failed.
+    """
+    def send():
+        try:
+            response = get_http_session().post(url, headers=headers, json=data, stream=stream, timeout=timeout())
+        except (requests.ConnectionError, requests.Timeout) as error:
+            raise RetryableError(str(error)) from error
+        try:
+            raise_for_retryable(response)
+        except RetryableError:
+            response.close()
+            raise
+        return response
+
+    metrics.inc('characters_total', len(data['text']), stage='tts', provider='elevenlabs')
+    try:
+        with metrics.timer('tts_request', 'elevenlabs'):
+            return get_scheduler('elevenlabs').call(send)
+    except RetryableError as error:
+        metrics.log('tts_failed', provider='elevenlabs', error='giving up after retries: {}'.format(error))
+        return None
+
+def _store_in_cache(store, *args):
+    """
+    Writes to the TTS cache on a best-effort basis. The audio has already been paid for, so a
+    failed write (e.g. a full disk) is logged and the audio is still returned.
+    """
+    try:
+        store(*args)
+    except Exception as error:
+        metrics.log('tts_cache_failed', provider='elevenlabs', error=str(error))
+        metrics.inc('errors_total', stage='tts_cache', provider='elevenlabs')
+
+def _synthesize_chunked(synthesize, text: str, chunk_chars: int, use_cache: bool, out: BinaryIO) -> BinaryIO:
+    chunks = split_text(text, chunk_chars)
+    metrics.log('tts_chunked', provider='elevenlabs', chunks=len(chunks), characters=len(text))
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+        futures = [executor.submit(synthesize, chunk, use_cache) for chunk in chunks]
+
+    # Every chunk has finished here, so the parts that succeeded can be collected for closing
+    # before the first error, if any, is raised
+    parts = [future.result() for future in futures if future.exception() is None]
+    try:
+        for future in futures:
+            future.result()
+        if any(part is None for part in parts):
+            metrics.log('tts_failed', provider='elevenlabs', error='failed to synthesize every chunk')
+            out.close()
+            return None
+        return join_mp3(parts, out)
+    except Exception:
+        out.close()
+        raise
+    finally:
+        for part in parts:
+            if part is not None:
+                part.close()
+
+def text_to_speech(text: str, use_cache: bool = True, chunk_chars: int = None) -> BytesIO:
     """
     This function sends a POST request to the Eleven Labs Text-to-Speech API
     to convert the given text to speech using the specified voice settings.
-    The resulting audio file is saved as 'output.mp3' in the current directory.
+    Audio already rendered for the same text and voice settings is served from
+    the local TTS cache without a network call.
+
+    Args:
+        text (str): The text to convert.
+        use_cache (bool): Whether to read from and write to the TTS cache.
+        chunk_chars (int): If set and the text is longer, the text is split at sentence
+            boundaries into chunks of at most this many characters, which are synthesized
+            concurrently and joined into one mp3.
 
     Returns:
-        None
+        BytesIO: The mp3 audio, or None if the request failed.
     """
-    url = "https://api.elevenlabs.io/v1/text-to-speech/{}".format(voice_id)
+    url = "{}/v1/text-to-speech/{}".format(elevenLabsApiUrl, voice_id)
     headers = {
         "accept": "audio/mpeg",
         "xi-api-key": elevenLabsApiKey,
@@ -26,24 +120,110 @@ def text_to_speech(text: str) -> BytesIO:
     }
     data = {
         "text": text,
-        "voice_settings": {"stability": 0, "similarity_boost": 0},
+        "voice_settings": voice_settings,
     }
+    if model_id:
+        data["model_id"] = model_id
     if not text or not text.strip():
         raise Exception('Error: cannot convert empty text to speech')
-    response = requests.post(url, headers=headers, json=data)
-    
+    if chunk_chars and len(text) > chunk_chars:
+        return _synthesize_chunked(text_to_speech, text, chunk_chars, use_cache, BytesIO())
+
+    cache_key = TTSCache.key(text, voice_id, voice_settings, model_id)
+    if use_cache:
+        cached = tts_cache.get(cache_key)
+        if cached is not None:
+            metrics.inc('cache_hits_total', stage='tts', provider='elevenlabs')
+            return BytesIO(cached)
+
+    response = _post(url, headers, data)
+    if response is None:
+        return None
+
     if response.status_code == 200:
         try:
             mp3 = BytesIO(response.content)
-            print("Created mp3 content")
-            return mp3
         except Exception as error:
-            print("An error occurred creating audio:", error)
+            metrics.log('tts_failed', provider='elevenlabs', error=str(error))
+        else:
+            metrics.inc('bytes_total', len(response.content), stage='tts', provider='elevenlabs')
+            if use_cache:
+                _store_in_cache(tts_cache.put, cache_key, response.content)
+            return mp3
     else:
-        print("Error:", response.status_code, response.text)
+        metrics.log('tts_failed', provider='elevenlabs', status=response.status_code, error=response.text)
+    metrics.inc('errors_total', stage='tts', provider='elevenlabs')
     
     return None
 
+def text_to_speech_stream(text: str, use_cache: bool = True, chunk_chars: int = None) -> BinaryIO:
+    """
+    Same as text_to_speech, but uses the streaming endpoint and writes the audio into a
+    spooled temporary file as it arrives. Only the first SPOOL_MAX_BYTES are held in memory,
+    so memory per request stays bounded no matter how long the text is.
+
+    Args:
+        text (str): The text to convert.
+        use_cache (bool): Whether to read from and write to the TTS cache.
+        chunk_chars (int): Same as for text_to_speech. Each chunk is streamed to its own
+            spooled file before they are joined.
+
+    Returns:
+        BinaryIO: A binary file positioned at the start of the mp3 audio, or None if the request
+        failed. The caller should close it once done.
+    """
+    url = "{}/v1/text-to-speech/{}/stream".format(elevenLabsApiUrl, voice_id)
+    headers = {
+        "accept": "audio/mpeg",
+        "xi-api-key": elevenLabsApiKey,
+        "Content-Type": "application/json",
+    }
+    data = {
+        "text": text,
+        "voice_settings": voice_settings,
+    }
+    if model_id:
+        data["model_id"] = model_id
+    if not text or not text.strip():
+        raise Exception('Error: cannot convert empty text to speech')
+    if chunk_chars and len(text) > chunk_chars:
+        return _synthesize_chunked(text_to_speech_stream, text, chunk_chars, use_cache, SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES))
+
+    cache_key = TTSCache.key(text, voice_id, voice_settings, model_id)
+    if use_cache:
+        cached = tts_cache.open(cache_key)
+        if cached is not None:
+            metrics.inc('cache_hits_total', stage='tts', provider='elevenlabs')
+            return cached
+
+    response = _post(url, headers, data, stream=True)
+    if response is None:
+        return None
+
+    with response:
+        if response.status_code != 200:
+            metrics.log('tts_failed', provider='elevenlabs', status=response.status_code, error=response.text)
+            metrics.inc('errors_total', stage='tts', provider='elevenlabs')
+            return None
+
+        mp3 = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            # The body streams in after _post returns, so it is timed separately
+            with metrics.timer('tts_stream', 'elevenlabs'):
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+                    mp3.write(chunk)
+            metrics.inc('bytes_total', mp3.tell(), stage='tts', provider='elevenlabs')
+            if use_cache:
+                mp3.seek(0)
+                _store_in_cache(tts_cache.put_file, cache_key, mp3)
+            mp3.seek(0)
+            return mp3
+        except Exception as error:
+            # Nothing is handed to the caller, so nothing else would close the spooled file
+            mp3.close()
+            metrics.log('tts_failed', provider='elevenlabs', error='streaming audio: {}'.format(error))
+            return None
+
 def main():
     """
     The main function of the program.
@@ -0,0 +1,548 @@
+"""
+Local stand-ins for Supabase (PostgREST), ElevenLabs, Azure batch synthesis and the Internet
+Archive, used by benchmark.py to measure the workflows without network access or spending TTS quota.
+
+Only the parts of each API the clients in this repo use are implemented.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, unquote, urlparse
+import bisect
+import csv
+import io
+import json
+import os
+import random
+import re
+import socket
+import time
+import zipfile
+
+# Found next to this file, so the stand-ins can be started from any directory
+AUDITING_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'auditing_rows.csv')
+PAYLOAD_MP3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output.mp3')
+
+PRIMARY_KEYS = {'pieces': 'id', 'artists': 'id', 'audios': 'id', 'auditing': 'audit_id'}
+
+
+class Table:
+    def __init__(self, key: str):
+        """The rows of one table, kept sorted by primary key."""
+        self.key = key
+        self.ids: List[int] = []
+        self.rows: Dict[int, dict] = {}
+
+    def insert(self, row: dict):
+        row_id = row[self.key]
+        if row_id not in self.rows:
+            bisect.insort(self.ids, row_id)
+        self.rows[row_id] = row
+
+    def delete(self, row_id: int):
+        if self.rows.pop(row_id, None) is not None:
+            self.ids.pop(bisect.bisect_left(self.ids, row_id))
+
+    def next_id(self) -> int:
+        return self.ids[-1] + 1 if self.ids else 1
+
+
+def _parse_bool(value: str) -> Optional[bool]:
+    return None if value == '' else value.lower() == 'true'
+
+
+def _parse_int(value: str) -> Optional[int]:
+    return int(value) if value else None
+
+
+def load_audits(path: str = AUDITING_CSV) -> List[dict]:
+    """Reads the audit rows exported from the production `auditing` table."""
+    with open(path, newline='') as f:
+        return [{
+            'audit_id': int(row['audit_id']),
+            'auditor': row['auditor'],
+            'content': row['content'],
+            'start_time': row['start_time'] or None,
+            'publish_time': row['publish_time'] or None,
+            'flagged': _parse_bool(row['flagged']),
+            'art_id': _parse_int(row['art_id']),
+            'chatgpt_time': row['chatgpt_time'] or None,
+            'skipped': _parse_bool(row['skipped']),
+            'gpt_output': row['gpt_output'],
+            'gpt_model': row['gpt_model'],
+        } for row in csv.DictReader(f)]
+
+
+def seed(pieces: int, audio_ratio: float = 0.2, seed_value: int = 0) -> Dict[str, Table]:
+    """
+    Builds a catalog of `pieces` pieces from auditing_rows.csv, so text lengths (and so TTS
+    chunking) and the audit workload match production:
+
+    - the audits are loaded as they are, and every audited piece exists under its real id,
+      with a 'Not found' overview where the audit has content for map_audits to copy in;
+    - the other pieces, and the artists, cycle through the real generated texts, and the
+      share of them with a 'Not found' overview is the share of skipped audits.
+
+    The CSV has no titles or artist names, so those are placeholders. `audio_ratio` of the
+    pieces get an audio.
+    """
+    rng = random.Random(seed_value)
+    tables = {name: Table(key) for name, key in PRIMARY_KEYS.items()}
+    audits = load_audits()
+    texts = [audit['gpt_output'] for audit in audits if audit['gpt_output'].strip()]
+    not_found_ratio = sum(1 for audit in audits if audit['skipped']) / len(audits)
+
+    for audit in audits:
+        tables['auditing'].insert(audit)
+
+    audited = {audit['art_id']: audit for audit in audits if audit['art_id'] is not None}
+    with_content = {audit['art_id'] for audit in audits if audit['content'] and audit['art_id'] is not None}
+    piece_ids = sorted(audited)[:pieces]
+    next_id = 1
+    while len(piece_ids) < pieces:
+        if next_id not in audited:
+            piece_ids.append(next_id)
+        next_id += 1
+
+    artist_count = max(1, pieces // 10)
+    for i in range(1, artist_count + 1):
+        tables['artists'].insert({
+            'id': i,
+            'artist_name': 'Artist {}'.format(i),
+            'nationality': None,
+            'lifespan': None,
+            'biography': 'Not found' if rng.random() < not_found_ratio else texts[i % len(texts)],
+        })
+
+    for i, piece_id in enumerate(piece_ids):
+        audit = audited.get(piece_id)
+        if audit is not None:
+            overview = 'Not found' if piece_id in with_content else audit['gpt_output']
+        else:
+            overview = 'Not found' if rng.random() < not_found_ratio else texts[i % len(texts)]
+        tables['pieces'].insert({
+            'id': piece_id,
+            'title': 'Piece {}'.format(piece_id),
+            'displaydate': None,
+            'artist': 'Artist {}'.format(rng.randint(1, artist_count)),
+            'location': None,
+            'overview': overview,
+            'description': None,
+        })
+
+    now = datetime.now(timezone.utc).isoformat()
+    for piece_id in rng.sample(piece_ids, int(pieces * audio_ratio)):
+        audio_id = tables['audios'].next_id()
+        tables['audios'].insert({
+            'id': audio_id,
+            'created_at': now,
+            'entity_type': 'piece',
+            'entity_id': piece_id,
+            'link': 'https://archive.org/download/seed/Piece%20{}.mp3'.format(piece_id),
+        })
+    return tables
+
+
+def _file_record(name: str, size: int) -> dict:
+    return {'name': name, 'source': 'original', 'format': 'VBR MP3', 'size': str(size), 'mtime': str(int(time.time()))}
+
+
+def seed_archive(audios: Table) -> Dict[str, Dict[str, dict]]:
+    """Builds the archive files the seeded audios link to."""
+    archive: Dict[str, Dict[str, dict]] = {}
+    for audio_id in audios.ids:
+        parts = urlparse(audios.rows[audio_id]['link']).path.split('/', 3)
+        name = unquote(parts[3])
+        archive.setdefault(parts[2], {})[name] = _file_record(name, 0)
+    return archive
+
+
+def percentiles(samples: List[float]) -> dict:
+    """Returns the p50, p95 and p99 of the samples in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        'p{}_ms'.format(p): round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 2)
+        for p in (50, 95, 99)
+    }
+
+
+def _split_list(value: str) -> List[str]:
+    # in.(a,"b,c") -> ['a', 'b,c']
+    return next(csv.reader([value[1:-1]], quotechar='"', escapechar='\\')) if value[1:-1] else []
+
+
+def _coerce(value: str, like):
+    if value == 'null':
+        return None
+    if isinstance(like, bool):
+        return value == 'true'
+    if isinstance(like, int):
+        return int(value)
+    return value
+
+
+def _matches(row: dict, column: str, op: str, value: str) -> bool:
+    field = row.get(column)
+    if op == 'is':
+        return field is None if value == 'null' else field == (value == 'true')
+    if op == 'in':
+        return field in [_coerce(v, field) for v in _split_list(value)]
+    if op in ('like', 'ilike'):
+        if field is None:
+            return False
+        pattern = '^' + '.*'.join(re.escape(part) for part in re.split(r'[%*]', value)) + '$'
+        return re.match(pattern, str(field), re.IGNORECASE if op == 'ilike' else 0) is not None
+    if field is None:
+        return False
+    target = _coerce(value, field)
+    return {
+        'eq': field == target,
+        'neq': field != target,
+        'gt': field > target,
+        'gte': field >= target,
+        'lt': field < target,
+        'lte': field <= target,
+    }[op]
+
+
+class FakeServices:
+    def __init__(self, tts_latency: float = 0.05, upload_latency: float = 0.02, db_latency: float = 0.0):
+        """
+        The shared state of the stand-in services.
+
+        Args:
+            tts_latency (float): Seconds each text-to-speech request takes.
+            upload_latency (float): Seconds each archive upload takes.
+            db_latency (float): Extra seconds each database request takes.
+        """
+        self.tts_latency = tts_latency
+        self.upload_latency = upload_latency
+        self.db_latency = db_latency
+        with open(PAYLOAD_MP3, 'rb') as f:
+            self.mp3 = f.read()
+        self.lock = Lock()
+        self.tables = {name: Table(key) for name, key in PRIMARY_KEYS.items()}
+        # The archive's items: identifier -> file name -> file record
+        self.archive: Dict[str, Dict[str, dict]] = {}
+        # Azure batch syntheses by id: (number of texts, when they are done)
+        self.syntheses: Dict[str, tuple] = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.durations: Dict[str, List[float]] = {}
+        self.bytes_uploaded = 0
+        self.items = 0
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            self.durations.setdefault(name, []).append(seconds)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'requests': {name: {'count': len(d), **percentiles(d)} for name, d in self.durations.items()},
+                'bytes_uploaded': self.bytes_uploaded,
+                'items': self.items,
+                'rows': {name: len(table.ids) for name, table in self.tables.items()},
+            }
+
+    # PostgREST
+
+    def select(self, table: Table, params: List[tuple]) -> List[dict]:
+        filters = [(k, v) for k, v in params if k not in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns')]
+        ids = table.ids
+        # Fast paths for the key lookups the clients make most
+        for column, expression in filters:
+            if column != table.key:
+                continue
+            op, _, value = expression.partition('.')
+            if op == 'eq':
+                ids = [int(value)] if int(value) in table.rows else []
+            elif op == 'in':
+                ids = sorted(int(v) for v in _split_list(value) if int(v) in table.rows)
+            elif op == 'gt':
+                ids = ids[bisect.bisect_right(ids, int(value)):]
+        rows = []
+        for row_id in ids:
+            row = table.rows[row_id]
+            if all(_matches(row, column, *expression.partition('.')[::2]) for column, expression in filters):
+                rows.append(row)
+
+        order = dict(params).get('order')
+        if order:
+            column, _, direction = order.partition('.')
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith('desc'))
+        return rows
+
+    def project(self, rows: List[dict], select: Optional[str]) -> List[dict]:
+        if not select or select == '*':
+            return rows
+        columns = [c.strip() for c in select.split(',')]
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+
+def _read_body(handler: BaseHTTPRequestHandler) -> bytes:
+    if handler.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        body = io.BytesIO()
+        while True:
+            size = int(handler.rfile.readline().split(b';')[0], 16)
+            if size == 0:
+                handler.rfile.readline()
+                return body.getvalue()
+            body.write(handler.rfile.read(size))
+            handler.rfile.readline()
+    return handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+
+
+def make_handler(services: FakeServices):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # Headers and body are written separately; without this each response waits on a delayed ACK
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status: int, body: bytes = b'', content_type: str = 'application/json', headers: dict = None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def send_json(self, status: int, data, headers: dict = None):
+            self.send(status, json.dumps(data).encode('utf-8'), headers=headers)
+
+        def route(self):
+            url = urlparse(self.path)
+            path = unquote(url.path)
+            params = parse_qsl(url.query, keep_blank_values=True)
+            # Clients write the body after the headers, and Nagle holds it back until the headers
+            # are acknowledged, so acknowledge them at once (Linux only)
+            if hasattr(socket, 'TCP_QUICKACK'):
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            # Always read, since PostgREST clients send a body with GET and DELETE too
+            body = _read_body(self)
+
+            if path.startswith('/rest/v1/'):
+                return self.postgrest(path[len('/rest/v1/'):], params, body)
+            if path.startswith('/v1/text-to-speech/'):
+                return self.text_to_speech()
+            if path == '/metadata/items' and self.command == 'POST':
+                return self.create_item()
+            if path.startswith('/metadata/') and path.endswith('/files'):
+                return self.item_files(path.split('/')[2])
+            if path.startswith('/metadata/'):
+                return self.item_metadata(path.split('/')[2])
+            if path == '/services/search/v1/scrape' and self.command == 'POST':
+                return self.scrape(dict(params))
+            if path.startswith('/texttospeech/batchsyntheses/'):
+                return self.batch_synthesis(path.rsplit('/', 1)[1], body)
+            if path.startswith('/_azure/results/'):
+                return self.batch_results(path.rsplit('/', 1)[1])
+            if path.startswith('/s3/'):
+                return self.s3(path[len('/s3/'):], dict(params), body)
+            if path == '/_admin/seed' and self.command == 'POST':
+                with services.lock:
+                    services.tables = seed(**json.loads(body))
+                    services.archive = seed_archive(services.tables['audios'])
+                    services.reset_stats()
+                return self.send_json(200, {'pieces': len(services.tables['pieces'].ids)})
+            if path == '/_admin/reset' and self.command == 'POST':
+                with services.lock:
+                    services.reset_stats()
+                return self.send_json(200, {})
+            if path == '/_admin/stats':
+                return self.send_json(200, services.stats())
+            self.send_json(404, {'message': 'Not found: {}'.format(path)})
+
+        def postgrest(self, table_name: str, params: List[tuple], body: bytes):
+            self.category = 'supabase {} {}'.format(self.command, table_name)
+            if services.db_latency:
+                time.sleep(services.db_latency)
+            table = services.tables.get(table_name)
+            if table is None:
+                return self.send_json(404, {'message': 'relation "{}" does not exist'.format(table_name), 'code': '42P01'})
+
+            prefer = self.headers.get('Prefer', '')
+            with services.lock:
+                if self.command in ('GET', 'HEAD'):
+                    rows = services.select(table, params)
+                    total = len(rows)
+                    query = dict(params)
+                    offset = int(query.get('offset', 0))
+                    limit = int(query['limit']) if 'limit' in query else None
+                    if self.headers.get('Range'):
+                        start, _, end = self.headers['Range'].partition('-')
+                        offset = int(start)
+                        limit = int(end) - offset + 1 if end else None
+                    rows = rows[offset:offset + limit if limit is not None else None]
+                    rows = services.project(rows, query.get('select'))
+                    end = offset + len(rows) - 1
+                    content_range = '{}-{}/{}'.format(offset, end, total if 'count=exact' in prefer else '*') if rows else '*/{}'.format(total)
+                    return self.send_json(200, rows, headers={'Content-Range': content_range})
+
+                if self.command == 'POST':
+                    data = json.loads(body)
+                    upsert = 'merge-duplicates' in prefer
+                    written = []
+                    for row in data if isinstance(data, list) else [data]:
+                        row = dict(row)
+                        existing = table.rows.get(row.get(table.key))
+                        if existing is not None and upsert:
+                            existing.update(row)
+                            written.append(existing)
+                            continue
+                        row.setdefault(table.key, table.next_id())
+                        if table_name == 'audios':
+                            row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+                        table.insert(row)
+                        written.append(row)
+                    return self.send_json(201, written)
+
+                if self.command == 'PATCH':
+                    patch = json.loads(body)
+                    rows = services.select(table, params)
+                    for row in rows:
+                        row.update(patch)
+                    return self.send_json(200, rows, headers={'Content-Range': '0-{}/*'.format(len(rows) - 1)})
+
+                if self.command == 'DELETE':
+                    rows = services.select(table, params)
+                    for row in rows:
+                        table.delete(row[table.key])
+                    return self.send_json(200, rows)
+
+            self.send_json(405, {'message': 'Method not allowed'})
+
+        def text_to_speech(self):
+            self.category = 'elevenlabs'
+            time.sleep(services.tts_latency)
+            self.send(200, services.mp3, content_type='audio/mpeg')
+
+        def batch_synthesis(self, synthesis_id: str, body: bytes):
+            self.category = 'azure batch {}'.format(self.command)
+            if self.command == 'PUT':
+                count = len(json.loads(body)['inputs'])
+                # A batch takes about as long as one real-time request per text, spread over 4 voices
+                with services.lock:
+                    services.syntheses[synthesis_id] = (count, time.monotonic() + services.tts_latency * count / 4)
+                return self.send_json(201, {'id': synthesis_id, 'status': 'NotStarted'})
+            with services.lock:
+                synthesis = services.syntheses.get(synthesis_id)
+                if synthesis and self.command == 'DELETE':
+                    del services.syntheses[synthesis_id]
+            if synthesis is None:
+                return self.send_json(404, {'code': 'NotFound'})
+            if self.command == 'DELETE':
+                return self.send(204, b'')
+            if time.monotonic() < synthesis[1]:
+                return self.send_json(200, {'id': synthesis_id, 'status': 'Running'})
+            return self.send_json(200, {
+                'id': synthesis_id,
+                'status': 'Succeeded',
+                'outputs': {'result': 'http://{}/_azure/results/{}'.format(self.headers['Host'], synthesis_id)},
+            })
+
+        def batch_results(self, synthesis_id: str):
+            self.category = 'azure batch results'
+            with services.lock:
+                synthesis = services.syntheses.get(synthesis_id)
+            if synthesis is None:
+                return self.send_json(404, {'code': 'NotFound'})
+            results = io.BytesIO()
+            with zipfile.ZipFile(results, 'w') as archive:
+                for i in range(synthesis[0]):
+                    archive.writestr('{:04d}.mp3'.format(i + 1), services.mp3)
+            self.send(200, results.getvalue(), content_type='application/zip')
+
+        def create_item(self):
+            self.category = 'archive create_item'
+            with services.lock:
+                services.items += 1
+                identifier = 'bench-item-{}'.format(services.items)
+                services.archive[identifier] = {}
+            self.send_json(200, {'uniq': identifier})
+
+        def item_metadata(self, identifier: str):
+            # What internetarchive's get_item reads
+            self.category = 'archive metadata'
+            with services.lock:
+                files = services.archive.get(identifier)
+                files = None if files is None else list(files.values())
+            if files is None:
+                return self.send_json(200, {})
+            self.send_json(200, {
+                'created': int(time.time()),
+                'dir': '/fake/{}'.format(identifier),
+                'files': files,
+                'files_count': len(files),
+                'item_size': sum(int(file['size']) for file in files),
+                'metadata': {'identifier': identifier, 'mediatype': 'audio'},
+                'server': self.headers['Host'],
+            })
+
+        def item_files(self, identifier: str):
+            self.category = 'archive files'
+            with services.lock:
+                files = list(services.archive.get(identifier, {}).values())
+            self.send_json(200, {'result': files})
+
+        def scrape(self, params: dict):
+            # Every item counts as uploaded by the benchmark's account; prefixes are honored
+            self.category = 'archive search'
+            match = re.search(r'identifier:(\S+)\*', params.get('q', ''))
+            with services.lock:
+                identifiers = sorted(i for i in services.archive if not match or i.startswith(match.group(1)))
+            if params.get('total_only') == 'true':
+                return self.send_json(200, {'total': len(identifiers)})
+            now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            items = [{'identifier': identifier, 'oai_updatedate': [now]} for identifier in identifiers]
+            self.send_json(200, {'items': items, 'count': len(items), 'total': len(items)})
+
+        def s3(self, key: str, params: dict, body: bytes):
+            self.category = 'archive {}'.format(self.command)
+            if self.command == 'GET' and 'check_limit' in params:
+                return self.send_json(200, {'over_limit': 0})
+            time.sleep(services.upload_latency)
+            identifier, _, name = key.partition('/')
+            if self.command == 'PUT':
+                with services.lock:
+                    services.bytes_uploaded += len(body)
+                    services.archive.setdefault(identifier, {})[name] = _file_record(name, len(body))
+                return self.send(200, b'', content_type='text/plain')
+            if self.command == 'DELETE':
+                with services.lock:
+                    services.archive.get(identifier, {}).pop(name, None)
+                return self.send(204, b'', content_type='text/plain')
+            self.send(405, b'', content_type='text/plain')
+
+        def do_GET(self):
+            self.category = None
+            start = time.monotonic()
+            self.route()
+            if self.category:
+                services.record(self.category, time.monotonic() - start)
+
+        do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
+    return Handler
+
+
+def serve(port_queue, tts_latency: float, upload_latency: float, db_latency: float):
+    """Runs the stand-in services until the process is terminated, sending the bound port to port_queue."""
+    services = FakeServices(tts_latency=tts_latency, upload_latency=upload_latency, db_latency=db_latency)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(services))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
@@ -0,0 +1,105 @@
+from threading import Lock
+from dotenv import load_dotenv
+from internetarchive import ArchiveSession, get_session
+from requests.adapters import HTTPAdapter
+import requests
+import os
+load_dotenv()
+
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+
+# The archive hosts internetarchive (and the client) send requests to. Overriding IA_BASE_URL or
+# IA_S3_URL sends those requests to a local stand-in instead, e.g. for benchmarks
+ARCHIVE_URL = 'https://archive.org'
+ARCHIVE_S3_URL = 'https://s3.us.archive.org'
+IA_BASE_URL = os.environ.get('IA_BASE_URL', ARCHIVE_URL).rstrip('/')
+IA_S3_URL = os.environ.get('IA_S3_URL', ARCHIVE_S3_URL).rstrip('/')
+_ARCHIVE_REDIRECTS = {
+    prefix + '/': target + '/'
+    for prefix, target in ((ARCHIVE_URL, IA_BASE_URL), (ARCHIVE_S3_URL, IA_S3_URL))
+    if prefix != target
+}
+
+_lock = Lock()
+_http_session = None
+_archive_session = None
+_pool_size = POOL_SIZE
+
+
+def timeout() -> tuple:
+    """Returns the (connect, read) timeout to pass with every outbound request."""
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+class _RedirectAdapter(HTTPAdapter):
+    """Sends requests for the archive hosts to their IA_BASE_URL or IA_S3_URL override."""
+
+    def send(self, request, **kwargs):
+        for prefix, target in _ARCHIVE_REDIRECTS.items():
+            if request.url.startswith(prefix):
+                request = request.copy()
+                request.url = target + request.url[len(prefix):]
+                break
+        return super().send(request, **kwargs)
+
+
+def _mount(session: requests.Session):
+    # Connections are kept alive and reused per host, up to _pool_size at once
+    pool = {'pool_connections': 4, 'pool_maxsize': _pool_size}
+    adapter = HTTPAdapter(**pool)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if isinstance(session, ArchiveSession):
+        # internetarchive mounts its own retrying adapter on archive.org. Every archive call
+        # goes through the archive scheduler, which owns the retries, so remount it without
+        # retries (they would multiply with the scheduler's) and with the larger pool.
+        session.http_adapter_kwargs.update(pool, max_retries=0)
+        session.mount_http_adapter()
+    if _ARCHIVE_REDIRECTS:
+        # Mounted with a trailing slash, so it outranks internetarchive's adapter however often
+        # that is remounted
+        redirect = _RedirectAdapter(**pool)
+        for prefix in _ARCHIVE_REDIRECTS:
+            session.mount(prefix, redirect)
+
+
+def get_http_session() -> requests.Session:
+    """
+    Returns the shared keep-alive session used for all plain HTTP calls (ElevenLabs,
+    Internet Archive metadata and S3 endpoints).
+    """
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            _mount(_http_session)
+        return _http_session
+
+
+def get_archive_session(access_key: str = None, secret_key: str = None) -> ArchiveSession:
+    """
+    Returns the shared internetarchive session used for get_item, upload and search calls.
+    The keys are only used the first time the session is created.
+    """
+    global _archive_session
+    with _lock:
+        if _archive_session is None:
+            config = {'s3': {'access': access_key, 'secret': secret_key}} if access_key else None
+            _archive_session = get_session(config=config)
+            _mount(_archive_session)
+        return _archive_session
+
+
+def configure_pool(pool_size: int):
+    """
+    Sets how many connections per host the shared sessions keep open. Call it with the number
+    of concurrent workers before a pipeline run so no worker waits for a connection.
+    """
+    global _pool_size
+    with _lock:
+        _pool_size = pool_size
+        for session in (_http_session, _archive_session):
+            if session is not None:
+                _mount(session)
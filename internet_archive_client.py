@@ -4,6 +4,13 @@ from urllib.parse import quote
 import requests
 import os
 from io import BytesIO
+from http_session import ARCHIVE_S3_URL, ARCHIVE_URL, get_archive_session, get_http_session, timeout
+from scheduler import RetryableError, get_scheduler, is_retryable_status, parse_retry_after, raise_for_retryable
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
+from metrics import instrumented, metrics
+from threading import Lock
 load_dotenv()
 
 iaEmail = os.environ.get('IA_EMAIL')
@@ -11,6 +18,60 @@ iaPassword = os.environ.get('IA_PASSWORD')
 s3AccessKey = os.environ.get('S3_ACCESS_KEY')
 s3Secret = os.environ.get('S3_SECRET')
 
+# Item handles are only needed for their identifier and session when uploading, so each one is
+# fetched once per run instead of re-reading the item's (growing) metadata on every upload
+_item_cache = {}
+_item_cache_lock = Lock()
+
+class _KeepOpen:
+    """
+    Wraps a file passed to item.upload, which closes it when done, so that the caller can
+    still rewind it for a retry and count the bytes sent. The caller closes the file.
+    """
+    def __init__(self, file: BinaryIO):
+        self._file = file
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        pass
+
+def download_url(identifier: str, file_name: str) -> str:
+    """Returns the download URL of a file in an item."""
+    return '{}/download/{}/{}'.format(ARCHIVE_URL, identifier, quote(file_name))
+
+def _retryable(func):
+    """Calls func, turning archive throttling, 5xx and connection errors into RetryableError."""
+    try:
+        return func()
+    except requests.exceptions.HTTPError as error:
+        response = error.response
+        if response is not None and is_retryable_status(response.status_code):
+            raise RetryableError(str(error), parse_retry_after(response.headers.get('Retry-After'))) from error
+        raise
+    except (requests.ConnectionError, requests.Timeout) as error:
+        raise RetryableError(str(error)) from error
+
+def get_cached_item(identifier: str):
+    """
+    Returns the Item for the identifier, fetching its metadata only the first time.
+
+    Args:
+        identifier (str): The identifier of the item.
+
+    Returns:
+        Item: The internetarchive Item.
+    """
+    with _item_cache_lock:
+        item = _item_cache.get(identifier)
+    if item is None:
+        item = get_scheduler('archive').call(_retryable, lambda: get_archive_session(s3AccessKey, s3Secret).get_item(identifier))
+        with _item_cache_lock:
+            item = _item_cache.setdefault(identifier, item)
+    return item
+
+@instrumented('archive', falsy_is_error=True)
 def create_item(collection: str, title: str, description: str) -> str:
     """
     Creates a new item in the Internet Archive with the specified metadata.
@@ -39,31 +100,46 @@ def create_item(collection: str, title: str, description: str) -> str:
         'contributor': iaEmail
     }
 
-    try:
-        response = requests.post(
-            'https://archive.org/metadata/items',
-            headers={'authorization': 'LOW {}:{}'.format(iaEmail, iaPassword)},
-            json=metadata
-        )
+    def send():
+        # A repeated request would create a second item, so only requests that were throttled
+        # or never sent are retried
+        try:
+            response = get_http_session().post(
+                '{}/metadata/items'.format(ARCHIVE_URL),
+                headers={'authorization': 'LOW {}:{}'.format(iaEmail, iaPassword)},
+                json=metadata,
+                timeout=timeout()
+            )
+        except requests.exceptions.ConnectTimeout as error:
+            raise RetryableError(str(error)) from error
+        if response.status_code == 429:
+            raise RetryableError('429 {}'.format(response.reason), parse_retry_after(response.headers.get('Retry-After')))
         response.raise_for_status()
+        return response
+
+    try:
+        response = get_scheduler('archive').call(send)
         identifier = response.json()['uniq']
-        print('Item created with identifier: {}'.format(identifier))
+        metrics.log('item_created', identifier=identifier, collection=collection)
         return identifier
-    except requests.exceptions.HTTPError as error:
-        print('HTTP error occurred: {}'.format(error))
+    except (requests.exceptions.HTTPError, RetryableError) as error:
+        metrics.log('item_create_failed', collection=collection, error=str(error))
         return None
     except KeyError as error:
-        print('Identifier not found in response: {}'.format(error))
+        metrics.log('item_create_failed', collection=collection, error='identifier not found in response: {}'.format(error))
         return None
 
 
-def upload_file(identifier: str, file_bytes: BytesIO) -> str:
+@instrumented('archive', stage='upload', falsy_is_error=True)
+def upload_file(identifier: str, file_bytes: BinaryIO, file_name: str = None) -> str:
     """
     Uploads a file to an existing item on the Internet Archive.
 
     Args:
         identifier (str): The identifier of the item to upload the file to.
-        file_bytes (BytesIO): The BytesIO object of the file to be uploaded.
+        file_bytes (BinaryIO): The file to be uploaded, e.g. a BytesIO or a spooled temporary file.
+            It is read in chunks, so it doesn't have to fit in memory.
+        file_name (str): The name of the file in the item. Defaults to file_bytes.name.
 
     Returns:
         str: A URL to the uploaded file on the Internet Archive.
@@ -77,20 +153,60 @@ def upload_file(identifier: str, file_bytes: BytesIO) -> str:
 
     """
     try:
-        item = get_item(identifier)
-        item.upload(file_bytes, access_key=s3AccessKey, secret_key=s3Secret)
-        file_name = file_bytes.name
-        result_url = 'https://archive.org/download/{}/{}'.format(identifier, quote(file_name))
-        print('File uploaded with URL: {}'.format(result_url))
+        file_name = file_name or file_bytes.name
+        # Fetched before taking an archive slot for the upload: get_cached_item takes one of its
+        # own, and waiting for it while holding the last one would never return
+        item = get_cached_item(identifier)
+
+        def send():
+            # Rewind in case a previous attempt read part of the file
+            file_bytes.seek(0)
+            item.upload({file_name: _KeepOpen(file_bytes)}, access_key=s3AccessKey, secret_key=s3Secret, request_kwargs={'timeout': timeout()})
+
+        get_scheduler('archive').call(_retryable, send)
+        metrics.inc('bytes_total', file_bytes.tell(), stage='upload', provider='archive')
+        result_url = download_url(identifier, file_name)
+        metrics.log('file_uploaded', identifier=identifier, file_name=file_name, url=result_url)
         return result_url
     except Exception as e:
-        print('Error uploading item: {}'.format(e))
+        metrics.log('file_upload_failed', identifier=identifier, file_name=file_name, error=str(e))
         return None
 
 
+def upload_files(identifier: str, files: Iterable[Tuple[str, BinaryIO]], threads: int = 4) -> Dict[str, str]:
+    """
+    Uploads many files to one existing item on the Internet Archive in parallel.
+
+    Args:
+        identifier (str): The identifier of the item to upload the files to.
+        files (Iterable[Tuple[str, BinaryIO]]): (file name, file) pairs to upload.
+        threads (int): The number of files uploaded at once.
+
+    Returns:
+        Dict[str, str]: A map from each file name to its URL on the Internet Archive, or None
+        if that file failed to upload.
+
+    Example:
+        >>> upload_files('my-item', [('a.mp3', a_bytes), ('b.mp3', b_bytes)])
+        {'a.mp3': 'https://archive.org/download/my-item/a.mp3', 'b.mp3': 'https://archive.org/download/my-item/b.mp3'}
+
+    """
+    files = list(files)
+    try:
+        # Fetch the item once up front rather than racing for it in every thread
+        get_cached_item(identifier)
+    except Exception as e:
+        metrics.log('item_fetch_failed', identifier=identifier, error=str(e))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        urls = executor.map(lambda file: upload_file(identifier, file[1], file[0]), files)
+        return {name: url for (name, _), url in zip(files, urls)}
+
+
 import requests
 from urllib.parse import quote
 
+@instrumented('archive', stage='delete', falsy_is_error=True)
 def delete_file(identifier: str, file_name: str) -> bool:
     """
     Deletes a file from an existing item on the Internet Archive.
@@ -111,26 +227,139 @@ def delete_file(identifier: str, file_name: str) -> bool:
 
     """
     try:
-        base_url = f'https://s3.us.archive.org/{identifier}/{quote(file_name)}'
+        base_url = f'{ARCHIVE_S3_URL}/{identifier}/{quote(file_name)}'
 
         headers = {
             'Authorization': f'LOW {s3AccessKey}:{s3Secret}',
         }
 
-        response = requests.delete(base_url, headers=headers)
+        def send():
+            response = get_http_session().delete(base_url, headers=headers, timeout=timeout())
+            raise_for_retryable(response)
+            return response
+
+        response = get_scheduler('archive').call(_retryable, send)
 
         if response.status_code == 204:
-            print(f'File {file_name} deleted successfully.')
+            metrics.log('file_deleted', identifier=identifier, file_name=file_name)
             return True
         else:
-            print(f'Error deleting file: {response.text}')
+            metrics.log('file_delete_failed', identifier=identifier, file_name=file_name, status=response.status_code, error=response.text)
             return False
     except Exception as e:
-        print(f'Error deleting file: {e}')
+        metrics.log('file_delete_failed', identifier=identifier, file_name=file_name, error=str(e))
         return False
 
 
 
+def _item_updated_at(result: dict) -> Optional[datetime]:
+    dates = result.get('oai_updatedate')
+    if not dates:
+        return None
+    if isinstance(dates, str):
+        dates = [dates]
+    try:
+        return max(datetime.fromisoformat(date.replace('Z', '+00:00')) for date in dates)
+    except ValueError:
+        return None
+
+def get_item_files(identifier: str) -> list:
+    """
+    Fetches only the file list of an item, rather than its full metadata.
+
+    Returns:
+        list: The item's file records, each with at least a 'name'. Empty if the item doesn't exist.
+    """
+    def send():
+        response = get_http_session().get('{}/metadata/{}/files'.format(ARCHIVE_URL, identifier), timeout=timeout())
+        raise_for_retryable(response)
+        response.raise_for_status()
+        return response.json().get('result', [])
+
+    return get_scheduler('archive').call(_retryable, send)
+
+def _search(query: str, fields: list) -> Iterator[dict]:
+    """
+    Yields the results of an archive search from the scrape API. Each page of results is one
+    request through the archive scheduler, so searches are rate limited and retried like the
+    other archive calls.
+    """
+    params = {'q': query, 'fields': ','.join(fields), 'count': 10000}
+    headers = {'authorization': 'LOW {}:{}'.format(s3AccessKey, s3Secret)} if s3AccessKey else {}
+
+    def send():
+        response = get_http_session().post('{}/services/search/v1/scrape'.format(ARCHIVE_URL), params=params, headers=headers, timeout=timeout())
+        raise_for_retryable(response)
+        response.raise_for_status()
+        return response.json()
+
+    while True:
+        page = get_scheduler('archive').call(_retryable, send)
+        if page.get('error'):
+            raise Exception('Archive search failed: {}'.format(page['error']))
+        yield from page.get('items', [])
+        if 'cursor' not in page:
+            return
+        params['cursor'] = page['cursor']
+
+def iter_mp3_files(identifier_prefix: str = None, modified_since: datetime = None, max_workers: int = 8) -> Iterator[dict]:
+    """
+    Yields the mp3 files of all items associated with the user's email.
+
+    The search only returns the fields needed to pick items, and item file lists are fetched
+    concurrently, at most max_workers at a time. Results are yielded as each item's file list
+    arrives, so the order of items is not fixed.
+
+    Args:
+        identifier_prefix (str): Only list items whose identifier starts with this prefix.
+        modified_since (datetime): Only list items updated at or after this time (timezone aware).
+            Items without an update date are always listed.
+        max_workers (int): The maximum number of file lists fetched at once.
+
+    Yields:
+        dict: The filename, item identifier, URL and modification time (unix seconds, as a string) of each mp3 file.
+
+    Example:
+        >>> next(iter_mp3_files(identifier_prefix='piece-mp3s'))
+        {'filename': 'My File.mp3', 'identifier': 'piece-mp3s-0', 'url': 'https://archive.org/download/piece-mp3s-0/My%20File.mp3', 'mtime': '1681767296'}
+    """
+    # Search for items associated with the user's email
+    query = 'uploader:"{}"'.format(iaEmail)
+    if identifier_prefix:
+        query += ' AND identifier:{}*'.format(identifier_prefix)
+    search_results = _search(query, ['identifier', 'oai_updatedate'])
+
+    def identifiers():
+        for result in search_results:
+            identifier = result.get('identifier')
+            if identifier_prefix and not identifier.startswith(identifier_prefix):
+                continue
+            if modified_since:
+                updated_at = _item_updated_at(result)
+                if updated_at and updated_at < modified_since:
+                    continue
+            yield identifier
+
+    def list_mp3s(identifier: str) -> list:
+        return [{
+            'filename': file['name'],
+            'identifier': identifier,
+            'url': download_url(identifier, file['name']),
+            'mtime': file.get('mtime')
+        } for file in get_item_files(identifier) if file['name'].endswith('.mp3')]
+
+    # Keep at most max_workers fetches in flight so the search results are consumed lazily
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for identifier in identifiers():
+            pending.add(executor.submit(list_mp3s, identifier))
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        for future in as_completed(pending):
+            yield from future.result()
+
 def get_all_mp3_files() -> list:
     """
     Retrieves all items associated with the user's email and filters the files to only include those with an '.mp3' extension.
@@ -141,30 +370,11 @@ def get_all_mp3_files() -> list:
     Example:
         >>> get_all_mp3_files()
         [
-            {'filename': 'my-file-name', 'identifier': 'my-item', 'url': 'https://archive.org/download/my-item/My%20File.mp3'},
-            {'filename': 'another-file-name', 'identifier': 'another-item', 'url': 'https://archive.org/download/another-item/Another%20File.mp3'}
+            {'filename': 'my-file-name', 'identifier': 'my-item', 'url': 'https://archive.org/download/my-item/My%20File.mp3', 'mtime': '1681767296'},
+            {'filename': 'another-file-name', 'identifier': 'another-item', 'url': 'https://archive.org/download/another-item/Another%20File.mp3', 'mtime': '1681767310'}
         ]
     """
-    mp3_files = []
-
-    # Search for items associated with the user's email
-    query = 'uploader:"{}"'.format(iaEmail)
-    search_results = search_items(query)
-
-    # Iterate through the items and filter the files with '.mp3' extension
-    for item in search_results:
-        item_object = get_item(identifier=item.get('identifier'))
-       
-        item_files = item_object.get_files()
-        for file in item_files:
-            if file.name.endswith('.mp3'):
-                mp3_files.append({
-                    'filename': file.name,
-                    'identifier': file.identifier,
-                    'url': 'https://archive.org/download/{}/{}'.format(file.identifier, quote(file.name))
-                })
-
-    return mp3_files
+    return list(iter_mp3_files())
 
 
 def main():
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Optional, Tuple
+import os
+import sqlite3
+
+JOURNAL_PATH = os.environ.get('JOB_JOURNAL', 'jobs.sqlite3')
+
+SYNTHESIZED = 'synthesized'
+UPLOADED = 'uploaded'
+RECORDED = 'recorded'
+
+
+class JobJournal:
+    def __init__(self, path: str = JOURNAL_PATH):
+        """
+        A local SQLite record of how far each piece or artist got through the synthesize,
+        upload and record stages, so an interrupted run can resume where it left off.
+
+        Args:
+            path (str): The SQLite database file. Created if missing.
+        """
+        self.path = path
+        self._lock = Lock()
+        # Shared by the pipeline's worker threads; every access holds the lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                entity_type TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                url TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (entity_type, entity_id)
+            )
+        ''')
+        self._connection.commit()
+
+    def get(self, entity_type: str, entity_id: int) -> Optional[Tuple[str, Optional[str]]]:
+        """Returns the last completed (stage, url) for the entity, or None if it was never started."""
+        with self._lock:
+            return self._connection.execute(
+                'SELECT stage, url FROM jobs WHERE entity_type = ? AND entity_id = ?',
+                (entity_type, entity_id)
+            ).fetchone()
+
+    def mark(self, entity_type: str, entity_id: int, stage: str, url: Optional[str] = None):
+        """
+        Records that the entity completed a stage. The URL is kept from an earlier stage when
+        none is given.
+        """
+        with self._lock:
+            self._connection.execute('''
+                INSERT INTO jobs (entity_type, entity_id, stage, url, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+                    stage = excluded.stage,
+                    url = COALESCE(excluded.url, jobs.url),
+                    updated_at = excluded.updated_at
+            ''', (entity_type, entity_id, stage, url, datetime.now(timezone.utc).isoformat()))
+            self._connection.commit()
+
+    def forget(self, entity_type: str, entity_id: int):
+        """Removes the entity from the journal, so the next run starts it from scratch."""
+        with self._lock:
+            self._connection.execute('DELETE FROM jobs WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id))
+            self._connection.commit()
+
+    def counts(self) -> dict:
+        """Returns the number of entities at each stage."""
+        with self._lock:
+            return dict(self._connection.execute('SELECT stage, COUNT(*) FROM jobs GROUP BY stage').fetchall())
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
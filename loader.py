@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+from metrics import metrics
+import os
+import time
+
+# How long a batch is held open for other threads' lookups to join it
+LOADER_WINDOW_SECONDS = float(os.environ.get('LOADER_WINDOW_MS', 5)) / 1000
+# How long a loaded value, or the fact that there is none, is reused
+LOADER_TTL_SECONDS = float(os.environ.get('LOADER_TTL_SECONDS', 300))
+LOADER_CACHE_SIZE = int(os.environ.get('LOADER_CACHE_SIZE', 10000))
+LOADER_MAX_BATCH = 100
+
+
+class _Batch:
+    def __init__(self):
+        self.keys: List[Hashable] = []
+        self.full = Event()
+        self.done = Event()
+        self.results: Dict[Hashable, Any] = {}
+        self.error: Optional[Exception] = None
+
+
+class Loader:
+    def __init__(self,
+            name: str,
+            batch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]],
+            window: float = LOADER_WINDOW_SECONDS,
+            max_batch: int = LOADER_MAX_BATCH,
+            ttl: float = LOADER_TTL_SECONDS,
+            cache_size: int = LOADER_CACHE_SIZE):
+        """
+        Coalesces point lookups into batch queries, like a DataLoader.
+
+        Lookups that other threads make while a batch is open, or while an earlier batch is
+        in flight, are sent together as one batch_fn call, e.g. one `in` query. A lookup for a
+        key that is already in flight waits for that batch instead. Results, including misses,
+        are kept in an LRU cache for `ttl` seconds.
+
+        A lookup made with no other lookup in flight is sent at once, so sequential callers
+        never wait for the window. They can prefetch with load_many instead.
+
+        Args:
+            name (str): A short name for the loader, used in metrics.
+            batch_fn (Callable): Called with a list of distinct keys. Returns a dict from each
+                key found to its value. Keys left out are cached as None.
+            window (float): The longest a batch is held open for more keys, in seconds.
+            max_batch (int): A batch is sent as soon as it has this many keys.
+            ttl (float): How long cached values are reused, in seconds.
+            cache_size (int): The most keys cached; the least recently used are dropped first.
+        """
+        self.name = name
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max_batch
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._lock = Lock()
+        self._cache: OrderedDict = OrderedDict()
+        self._pending: Optional[_Batch] = None
+        # The open or in-flight batch each key is in
+        self._inflight: Dict[Hashable, _Batch] = {}
+        self._active = 0
+
+    def _cached(self, key: Hashable):
+        """Returns (True, value) for a fresh cache entry, or (False, None). The caller holds the lock."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return False, None
+        self._cache.move_to_end(key)
+        return True, value
+
+    def _store(self, results: Dict[Hashable, Any], keys: Iterable[Hashable]):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._cache[key] = (results.get(key), expires_at)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _fetch(self, keys: List[Hashable]) -> Dict[Hashable, Any]:
+        metrics.inc('batched_keys_total', len(keys), stage=self.name, provider='loader')
+        with metrics.timer(self.name, 'loader'):
+            results = self.batch_fn(keys)
+        self._store(results, keys)
+        return results
+
+    def load(self, key: Hashable):
+        """
+        Returns the value for the key, or None if there is none.
+
+        Raises:
+            Exception: Whatever batch_fn raised for the batch the key was in.
+        """
+        with self._lock:
+            hit, value = self._cached(key)
+            if hit:
+                metrics.inc('cache_hits_total', stage=self.name, provider='loader')
+                return value
+
+            batch = self._inflight.get(key)
+            leader = False
+            if batch is None:
+                batch = self._pending
+                leader = batch is None
+                if leader:
+                    batch = self._pending = _Batch()
+                batch.keys.append(key)
+                self._inflight[key] = batch
+                if len(batch.keys) >= self.max_batch:
+                    self._pending = None
+                    batch.full.set()
+            # Only hold the batch open if other lookups are under way that could join it
+            wait = self.window if self._active > 0 else 0
+            self._active += 1
+
+        try:
+            if leader:
+                if wait:
+                    batch.full.wait(wait)
+                with self._lock:
+                    if self._pending is batch:
+                        self._pending = None
+                try:
+                    batch.results = self._fetch(batch.keys)
+                except Exception as error:
+                    batch.error = error
+                finally:
+                    # The results are cached by now; after an error the next lookup tries again
+                    with self._lock:
+                        for batch_key in batch.keys:
+                            if self._inflight.get(batch_key) is batch:
+                                del self._inflight[batch_key]
+                    batch.done.set()
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._active -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(key)
+
+    def load_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Returns the value for each key, or None where there is none, fetching the keys that
+        aren't cached in batches of max_batch. Also useful for priming the cache before a loop
+        of single lookups.
+        """
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                hit, value = self._cached(key)
+                if hit:
+                    values[key] = value
+                else:
+                    missing.append(key)
+
+        for i in range(0, len(missing), self.max_batch):
+            chunk = missing[i:i + self.max_batch]
+            results = self._fetch(chunk)
+            for key in chunk:
+                values[key] = results.get(key)
+        return {key: values[key] for key in keys}
+
+    def prime(self, key: Hashable, value: Any):
+        """Caches a value that is already known, e.g. one just written."""
+        self._store({key: value}, [key])
+
+    def clear(self, key: Optional[Hashable] = None):
+        """Drops a key from the cache, or every key if none is given."""
+        with self._lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
@@ -6,116 +6,347 @@ from internet_archive_client import *
 from elevenlabs_client import *
 from timon_supabase_client import *
 from urllib.parse import unquote
-from bad_file_list import bad_file_list
+import os
+from typing import Iterable, List, Optional
+from pipeline import Pipeline, Stage
+from http_session import configure_pool
+from archive_shards import ArchiveShards
+from journal import JobJournal, RECORDED, SYNTHESIZED, UPLOADED
+from tts_providers import ElevenLabsProvider, TTSDispatcher
+from metrics import instrumented, metrics
+from snapshot import SNAPSHOT_DIR, iter_snapshot
+try:
+    from microsoft_tts_client import AzureProvider, batch_text_to_speech
+except ImportError:
+    AzureProvider = None
+    batch_text_to_speech = None
 
-client = SupabaseClient()
+journal = JobJournal()
+client = SupabaseClient(journal=journal)
+archive_shards = ArchiveShards()
 
+# Azure is used alongside ElevenLabs when its SDK is installed and a key is configured
+tts_providers = [ElevenLabsProvider()]
+if AzureProvider and os.environ.get('AZURE_SUBSCRIPTION_KEY'):
+    tts_providers.append(AzureProvider())
+tts_dispatcher = TTSDispatcher(tts_providers)
+
+# The single items every mp3 was uploaded to before sharding. Existing audio links still point here.
 PIECE_COLLECTION_IDENTIFIER = '1885564100'
 ARTIST_COLLECTION_IDENTIFIER = '39215337'
 
-def create_audio_for_piece(piece: Piece):
-    # root_path = '/Users/kaseym/Downloads/MP3s'
-    existing_audio = client.get_audio_by_piece(piece)
-    if existing_audio: 
-        print('Audio already exists for piece: ', piece)
-        return
+class AudioJob:
+    def __init__(self, entity_type: str, entity, text: str, file_name: str, identifier: str = None):
+        """Tracks one piece or artist on its way from text to a recorded audio link."""
+        self.entity_type = entity_type
+        self.entity = entity
+        self.text = text
+        self.file_name = file_name
+        self.identifier = identifier
+        self.mp3 = None
+        self.url = None
+
+    def __str__(self) -> str:
+        return f'AudioJob(entity_type={self.entity_type}, entity_id={self.entity.id}, file_name={self.file_name}, url={self.url})'
+
+def piece_job(piece: Piece) -> AudioJob:
+    return AudioJob(
+        entity_type="piece",
+        entity=piece,
+        text=piece.overview,
+        file_name='{}.mp3'.format(piece.title)
+    )
+
+def artist_job(artist: Artist) -> AudioJob:
+    return AudioJob(
+        entity_type="artist",
+        entity=artist,
+        text=artist.biography,
+        file_name='{}.mp3'.format(artist.artist_name)
+    )
+
+def check_stage(job: AudioJob) -> Optional[AudioJob]:
+    """Returns None if the entity needs no audio, and sets job.url if only recording is left."""
+    # Entities finished by an earlier run are skipped without any network call
+    progress = journal.get(job.entity_type, job.entity.id)
+    if progress and progress[0] == RECORDED:
+        return None
+
+    if job.entity_type == "piece":
+        existing_audio = client.get_audio_by_piece(job.entity)
+    else:
+        existing_audio = client.get_audio_by_artist(job.entity)
+    if existing_audio:
+        metrics.log('audio_exists', entity_type=job.entity_type, entity_id=job.entity.id)
+        journal.mark(job.entity_type, job.entity.id, RECORDED)
+        return None
+
+    if progress and progress[0] == UPLOADED:
+        # Uploaded by an earlier run but never recorded; only the record stage is left
+        job.url = progress[1]
+        metrics.log('upload_resumed', entity_type=job.entity_type, entity_id=job.entity.id, url=job.url)
+        return job
+
+    if not job.text:
+        return None
+    return job
+
+def synthesize_stage(job: AudioJob) -> Optional[AudioJob]:
+    job = check_stage(job)
+    if job is None or job.url:
+        return job
+
+    metrics.log('synthesizing', entity_type=job.entity_type, entity_id=job.entity.id, characters=len(job.text))
 
-    if not piece.overview:
-        return
+    mp3_file = tts_dispatcher.synthesize(job.text)
+    if not mp3_file:
+        return None
 
-    print('Generating audio for piece: ', piece)
+    job.mp3 = mp3_file
+    journal.mark(job.entity_type, job.entity.id, SYNTHESIZED)
+    return job
 
-    file_name = '{}.mp3'.format(piece.title)
-    # file_path = os.path.join(root_path, file_name)
+def upload_stage(job: AudioJob) -> Optional[AudioJob]:
+    if job.url:
+        return job
 
-    mp3_bytesIO = text_to_speech(piece.overview)
-    mp3_bytesIO.name = file_name
-    url = upload_file(PIECE_COLLECTION_IDENTIFIER, mp3_bytesIO)
+    try:
+        if job.identifier is None:
+            job.identifier = archive_shards.identifier_for(job.entity_type, job.entity.id)
+        url = upload_file(job.identifier, job.mp3, job.file_name)
+    finally:
+        job.mp3.close()
+        job.mp3 = None
+    if not url:
+        return None
 
+    job.url = url
+    journal.mark(job.entity_type, job.entity.id, UPLOADED, url)
+    return job
+
+def record_stage(job: AudioJob) -> AudioJob:
     new_audio = Audio(
         id=None,
         created_at=None,
-        entity_type="piece",
-        entity_id=piece.id,
-        link=url
+        entity_type=job.entity_type,
+        entity_id=job.entity.id,
+        link=job.url
     )
 
     client.add_audio(new_audio)
+    journal.mark(job.entity_type, job.entity.id, RECORDED)
+    return job
 
+def run_job(job: AudioJob):
+    for stage in (synthesize_stage, upload_stage, record_stage):
+        job = stage(job)
+        if job is None:
+            return
+
+@instrumented('workflow')
+def create_audio_for_piece(piece: Piece):
+    run_job(piece_job(piece))
+
+@instrumented('workflow')
 def create_audio_for_artist(artist: Artist):
-    # root_path = '/Users/kaseym/Downloads/MP3s'
-    existing_audio = client.get_audio_by_artist(artist)
-    if existing_audio: 
-        print('Audio already exists for artist: ', artist)
-        return
-
-    if not artist.biography:
-        return
-    
-    print('Generating audio for artist: ', artist)
+    run_job(artist_job(artist))
 
-    file_name = '{}.mp3'.format(artist.artist_name)
-    # file_path = os.path.join(root_path, file_name)
+@instrumented('workflow')
+def run_audio_pipeline(jobs: Iterable[AudioJob], synthesize_workers: int = 4, upload_workers: int = 2, record_workers: int = 1, queue_size: int = 8) -> List[AudioJob]:
+    """
+    Runs audio jobs through the synthesize, upload and record stages concurrently, so that
+    text-to-speech for one entity overlaps the upload of the previous one.
 
-    mp3_bytesIO = text_to_speech(artist.biography)
-    if not mp3_bytesIO:
-        return
-    
-    mp3_bytesIO.name = file_name
-    url = upload_file(ARTIST_COLLECTION_IDENTIFIER, mp3_bytesIO)
+    Args:
+        jobs (Iterable[AudioJob]): The jobs to run, e.g. from piece_job or artist_job.
+        synthesize_workers (int): Number of concurrent text-to-speech requests.
+        upload_workers (int): Number of concurrent Internet Archive uploads.
+        record_workers (int): Number of concurrent Supabase inserts.
+        queue_size (int): Maximum number of jobs waiting in front of each stage. This bounds
+            how many mp3 buffers can be held in memory at once.
 
-    new_audio = Audio(
-        id=None,
-        created_at=None,
-        entity_type="artist",
-        entity_id=artist.id,
-        link=url
-    )
+    Returns:
+        List[AudioJob]: The jobs that were recorded.
+    """
+    # Every synthesize worker may have CHUNK_WORKERS requests in flight for long texts
+    configure_pool(synthesize_workers * CHUNK_WORKERS + upload_workers + record_workers)
+    pipeline = Pipeline([
+        Stage('synthesize', synthesize_stage, synthesize_workers),
+        Stage('upload', upload_stage, upload_workers),
+        Stage('record', record_stage, record_workers),
+    ], queue_size=queue_size)
+    return pipeline.run(jobs)
 
-    client.add_audio(new_audio)
+@instrumented('workflow')
+def run_azure_batch(jobs: Iterable[AudioJob], batch_size: int = 100, upload_workers: int = 2, record_workers: int = 1) -> List[AudioJob]:
+    """
+    Synthesizes audio for many jobs with Azure batch synthesis instead of one real-time
+    request each, then uploads and records the results like run_audio_pipeline.
+
+    Args:
+        jobs (Iterable[AudioJob]): The jobs to run, e.g. from piece_job or artist_job.
+        batch_size (int): The number of texts per Azure batch job. Each batch's mp3s are
+            held in memory until they are uploaded.
+        upload_workers (int): Number of concurrent Internet Archive uploads.
+        record_workers (int): Number of concurrent Supabase inserts.
+
+    Returns:
+        List[AudioJob]: The jobs that were recorded.
+    """
+    if batch_text_to_speech is None:
+        raise Exception('Azure batch synthesis needs the Azure Speech SDK installed')
+
+    jobs = [job for job in map(check_stage, jobs) if job is not None]
+    resumed = [job for job in jobs if job.url]
+    to_synthesize = [job for job in jobs if not job.url]
+    metrics.log('azure_batch_planned', to_synthesize=len(to_synthesize), to_record=len(resumed))
+
+    configure_pool(upload_workers + record_workers)
+    pipeline = Pipeline([
+        Stage('upload', upload_stage, upload_workers),
+        Stage('record', record_stage, record_workers),
+    ])
+    recorded = pipeline.run(resumed)
 
-def select_pieces() -> List[Piece]:
-    pieces = client.get_all_pieces()
+    # Batches may be smaller than batch_size (it is capped at BATCH_MAX_INPUTS), so jobs are
+    # matched to each batch's mp3s by a running offset
+    start = 0
+    for mp3s in batch_text_to_speech([job.text for job in to_synthesize], batch_size=batch_size):
+        batch_jobs = to_synthesize[start:start + len(mp3s)]
+        start += len(mp3s)
+        synthesized = []
+        for job, mp3 in zip(batch_jobs, mp3s):
+            if mp3 is None:
+                continue
+            job.mp3 = mp3
+            journal.mark(job.entity_type, job.entity.id, SYNTHESIZED)
+            synthesized.append(job)
+        recorded.extend(pipeline.run(synthesized))
+    return recorded
+
+@instrumented('workflow')
+def select_pieces(snapshot_dir: Optional[str] = None) -> List[Piece]:
+    """
+    Returns the pieces with an overview to synthesize.
+
+    Args:
+        snapshot_dir (str): If given, the pieces are read from the snapshot in this directory
+            (see snapshot.py) instead of Supabase.
+    """
+    if snapshot_dir:
+        pieces = iter_snapshot('pieces', snapshot_dir)
+    else:
+        # Only the fields the audio workflows read are fetched
+        pieces = client.iter_pieces(columns=('id', 'title', 'artist', 'overview'))
     selected_pieces = []
 
     for piece in pieces:
         if piece.overview != 'Not found':
             selected_pieces.append(piece)
             # print(piece, '\n\n')
-    print(f'{len(selected_pieces)} pieces found')
+    metrics.log('pieces_selected', count=len(selected_pieces))
     return selected_pieces
 
-def select_artists() -> List[Artist]:
-    selected_pieces = select_pieces()
+@instrumented('workflow')
+def select_artists(snapshot_dir: Optional[str] = None) -> List[Artist]:
+    """
+    Returns the artists of the selected pieces that have a biography to synthesize.
+
+    Args:
+        snapshot_dir (str): If given, the pieces and artists are read from the snapshot in
+            this directory instead of Supabase.
+    """
+    selected_pieces = select_pieces(snapshot_dir)
+    if snapshot_dir:
+        names = {piece.artist for piece in selected_pieces if piece.artist}
+        artists_by_name = {}
+        for artist in iter_snapshot('artists', snapshot_dir):
+            # Keep the first match per name, like get_artist_by_name
+            if artist.artist_name in names and artist.artist_name not in artists_by_name:
+                artists_by_name[artist.artist_name] = artist
+    else:
+        # Also fills the artist loader's cache for later get_artist_by_name calls
+        artists_by_name = client.artist_loader.load_many(piece.artist for piece in selected_pieces if piece.artist)
     selected_artists = []
 
-    for piece in selected_pieces:
-        artist = client.get_artist_by_name(piece.artist)
+    for artist in artists_by_name.values():
         if artist and artist.biography != 'Not found':
             selected_artists.append(artist)
-    print(f'{len(selected_artists)} artists found')
+    metrics.log('artists_selected', count=len(selected_artists))
     return selected_artists
 
-def map_audits():
-    audits = get_all_audits()
+@instrumented('workflow')
+def map_audits(snapshot_dir: Optional[str] = None):
+    """
+    Copies audit content into the overview of audited pieces that have none.
+
+    Args:
+        snapshot_dir (str): If given, the audits and pieces are read from the snapshot in this
+            directory instead of Supabase, so only the updates go over the network. Updates
+            write whole rows, so the snapshot should be fresher than any other edits to them.
+    """
+    if snapshot_dir:
+        audits = list(iter_snapshot('auditing', snapshot_dir))
+        audited_ids = {audit.art_id for audit in audits if audit.content}
+        pieces_by_id = {piece.id: piece for piece in iter_snapshot('pieces', snapshot_dir) if piece.id in audited_ids}
+        get_piece = pieces_by_id.get
+    else:
+        audits = get_all_audits()
+        # Fetches the audited pieces in `in` queries up front, so the lookups below hit the loader's cache
+        client.piece_loader.load_many(audit.art_id for audit in audits if audit.content and audit.art_id is not None)
+        get_piece = client.get_piece_by_id
+
     for audit in audits:
         if audit.content:
-            piece = client.get_piece_by_id(audit.art_id)
+            piece = get_piece(audit.art_id)
             # print("piece_title:", piece.title, "audit_content:", audit.content)
             if piece.overview == 'Not found':
                 piece.overview = audit.content
                 client.update_piece(piece)
 
+@instrumented('workflow')
+def map_audits_bulk(snapshot_dir: Optional[str] = None) -> int:
+    """
+    Same as map_audits, but fetches the audited pieces in chunked queries and writes the
+    new overviews back in bulk upserts instead of two round trips per audit.
+
+    Args:
+        snapshot_dir (str): Same as for map_audits.
+
+    Returns:
+        int: The number of pieces whose overview was changed.
+    """
+    if snapshot_dir:
+        audits = [audit for audit in iter_snapshot('auditing', snapshot_dir) if audit.content]
+        audited_ids = {audit.art_id for audit in audits}
+        pieces = {piece.id: piece for piece in iter_snapshot('pieces', snapshot_dir) if piece.id in audited_ids}
+    else:
+        audits = [audit for audit in get_all_audits() if audit.content]
+        pieces = client.get_pieces_by_ids(audit.art_id for audit in audits if audit.art_id)
+
+    changed = {}
+    for audit in audits:
+        piece = pieces.get(audit.art_id)
+        if piece and piece.overview == 'Not found':
+            piece.overview = audit.content
+            changed[piece.id] = piece
+
+    # Only the text columns are sent, so edits made to the other columns meanwhile are kept
+    client.upsert_pieces(list(changed.values()), columns=('overview', 'description'))
+    metrics.log('overviews_mapped', changed=len(changed), audits=len(audits))
+    return len(changed)
+
+@instrumented('workflow')
 def remove_tainted_audios():
-    pieces = client.get_all_pieces()
+    pieces = client.iter_pieces(columns=('id',), where=lambda query: query.eq('overview', 'Not found'))
+    client.load_audio_index()
     deleted_audio_log = ""
 
     for piece in pieces:
-        if piece.overview == 'Not found':
-            audio = client.get_audio_by_piece(piece)
-            if audio:
-                client.delete_audio(audio.id)
-                deleted_audio_log += str(audio) + '\n'
+        audio = client.get_audio_by_piece(piece)
+        if audio:
+            client.delete_audio(audio.id)
+            deleted_audio_log += str(audio) + '\n'
     
     with open('deleted_audios.txt', 'w') as file:
         file.write(deleted_audio_log)
@@ -129,17 +360,33 @@ def main():
     # full_pipeline(piece)
 
     # map_audits()
+    # map_audits_bulk()
+
+    # Plan from a local snapshot (python snapshot.py) instead of paging through Supabase
+    # map_audits_bulk(snapshot_dir=SNAPSHOT_DIR)
+    # selected_pieces = select_pieces(snapshot_dir=SNAPSHOT_DIR)
+    # client.load_audio_index(iter_snapshot('audios', SNAPSHOT_DIR))
+
+    # Load existing audios once so the create paths below skip without a query per entity.
+    # client.load_audio_index()
+    # Or keep pieces, audios and artists in a local cache that only fetches what changed since the last run.
+    # client.load_table_cache()
 
     # selected_pieces = select_pieces()
     # for piece in selected_pieces:
     #     create_audio_for_piece(piece)
+    # run_audio_pipeline(piece_job(piece) for piece in selected_pieces)
+    # run_azure_batch(piece_job(piece) for piece in selected_pieces)
 
     # selected_artists = select_artists()
     # for artist in selected_artists:
     #     create_audio_for_artist(artist)
+    # run_audio_pipeline(artist_job(artist) for artist in selected_artists)
 
     # remove_tainted_audios()
 
+    # Logs the per-stage summary and writes metrics.prom for the run
+    metrics.report()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,217 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+import bisect
+import json
+import os
+import sys
+import time
+
+# Where structured log lines go. Unset means stdout, alongside the rest of the output.
+METRICS_LOG = os.environ.get('METRICS_LOG')
+# Where the Prometheus text-format file is written at the end of a run
+METRICS_PROM = os.environ.get('METRICS_PROM', 'metrics.prom')
+METRIC_PREFIX = 'audio_uploader_'
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """Counts observations into fixed buckets, like a Prometheus histogram."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Returns the upper bound of the bucket holding the q-th quantile, or None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    parts = ['{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Metrics:
+    def __init__(self, log_path: Optional[str] = METRICS_LOG):
+        """
+        Collects counters and latency histograms for a run, labelled by stage and provider,
+        and writes them out as structured JSON log lines and a Prometheus text-format file.
+
+        Args:
+            log_path (str): The file JSON log lines are appended to, or None for stdout.
+        """
+        self.log_path = log_path
+        self._lock = Lock()
+        self._log_lock = Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Adds value to a counter, e.g. inc('bytes_total', 1024, stage='upload', provider='archive')."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Records one latency observation in a histogram."""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str, provider: str):
+        """
+        Times the block into latency_seconds and counts it in calls_total. An exception
+        raised from the block is counted in errors_total and re-raised.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.inc('errors_total', stage=stage, provider=provider)
+            raise
+        finally:
+            self.observe('latency_seconds', time.monotonic() - start, stage=stage, provider=provider)
+            self.inc('calls_total', stage=stage, provider=provider)
+
+    def log(self, event: str, **fields):
+        """Writes one structured log line: a JSON object with a timestamp, the event name and the fields."""
+        line = json.dumps({'ts': datetime.now(timezone.utc).isoformat(), 'event': event, **fields}, default=str)
+        with self._log_lock:
+            if self.log_path:
+                with open(self.log_path, 'a') as f:
+                    f.write(line + '\n')
+            else:
+                sys.stdout.write(line + '\n')
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Returns the calls, errors, retries, bytes and latency quantiles of each stage, keyed
+        by 'provider/stage'. Quantiles are histogram bucket upper bounds, in seconds.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+
+        stages: Dict[str, dict] = {}
+        for (name, labels), histogram in histograms.items():
+            label_map = dict(labels)
+            entry = stages.setdefault('{}/{}'.format(label_map.get('provider'), label_map.get('stage')), {})
+            entry.update({
+                'p50_s': histogram.quantile(0.5),
+                'p95_s': histogram.quantile(0.95),
+                'p99_s': histogram.quantile(0.99),
+                'total_s': round(histogram.sum, 3),
+            })
+        for (name, labels), value in counters.items():
+            label_map = dict(labels)
+            # Counters kept per provider only, such as retries_total, are listed under 'provider/*'
+            entry = stages.setdefault('{}/{}'.format(label_map.get('provider'), label_map.get('stage', '*')), {})
+            key = name if 'outcome' not in label_map else '{}_{}'.format(name, label_map['outcome'])
+            entry[key] = entry.get(key, 0) + value
+        return stages
+
+    def to_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append('# TYPE {} counter'.format(metric))
+                typed.add(metric)
+            lines.append('{}{} {}'.format(metric, _format_labels(labels), value))
+
+        for (name, labels), histogram in histograms:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append('# TYPE {} histogram'.format(metric))
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(metric, _format_labels(labels, 'le="{}"'.format(bound)), cumulative))
+            lines.append('{}_bucket{} {}'.format(metric, _format_labels(labels, 'le="+Inf"'), histogram.count))
+            lines.append('{}_sum{} {}'.format(metric, _format_labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(metric, _format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str = METRICS_PROM):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def report(self, path: str = METRICS_PROM):
+        """Ends a run: logs the per-stage summary and writes the Prometheus file."""
+        self.log('run_summary', stages=self.summary())
+        self.write_prometheus(path)
+
+
+metrics = Metrics()
+
+
+def instrumented(provider: str, stage: Optional[str] = None, falsy_is_error: bool = False) -> Callable:
+    """
+    Decorates a function so every call is timed and counted under the provider and stage
+    (the function name by default).
+
+    Args:
+        provider (str): e.g. 'supabase', 'archive', 'elevenlabs' or 'workflow'.
+        stage (str): The stage label. Defaults to the function's name.
+        falsy_is_error (bool): Whether a None or False result counts as an error, for
+            functions that report failure by returning it rather than raising.
+    """
+    def decorate(func: Callable) -> Callable:
+        name = stage or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(name, provider):
+                result = func(*args, **kwargs)
+            if falsy_is_error and (result is None or result is False):
+                metrics.inc('errors_total', stage=name, provider=provider)
+            return result
+        return wrapper
+    return decorate
@@ -3,29 +3,222 @@
 '''
 
 import azure.cognitiveservices.speech as speechsdk
+from dotenv import load_dotenv
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Iterator, List, Optional
+from http_session import get_http_session, timeout
+from scheduler import RetryableError, get_scheduler, raise_for_retryable
+from tts_providers import TTSProvider
+from metrics import instrumented, metrics
+import os
+import time
+import uuid
+import zipfile
+load_dotenv()
 
-# Creates an instance of a speech config with specified subscription key and service region.
-speech_key = "e2483d798f4145498e2817172c5ee9c4"
-service_region = "eastus"
+speech_key = os.environ.get('AZURE_SUBSCRIPTION_KEY')
+service_region = os.environ.get('AZURE_REGION', 'eastus')
+voice_name = "en-GB-OliverNeural"
 
-speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
-# Note: the voice setting will not overwrite the voice element in input SSML.
-speech_config.speech_synthesis_voice_name = "en-GB-OliverNeural"
+# Batch synthesis is a REST API. The endpoint can point at a local stand-in server for testing.
+speech_endpoint = os.environ.get('AZURE_SPEECH_ENDPOINT', 'https://{}.api.cognitive.microsoft.com'.format(service_region))
+BATCH_API_VERSION = '2024-04-01'
+BATCH_OUTPUT_FORMAT = 'audio-24khz-48kbitrate-mono-mp3'
+BATCH_MAX_INPUTS = 1000
+BATCH_POLL_SECONDS = float(os.environ.get('AZURE_BATCH_POLL_SECONDS', 10))
+BATCH_TIMEOUT_SECONDS = 6 * 60 * 60
 
-# text = "Louis Le Nain lived in a region to the north of Paris known for its open fields that produced cereals and grain. Although he settled in Paris with his two brothers, who were also painters, he produced a series of rural images that recall the landscape of his youth. In the Landscape with Peasants, an old woman regards three children: a little girl dressed in white collar and cap, a small boy who plays the pipe, and a boy dressed in a cloak and hat who plays a hurdy-gurdy."
+def create_speech_config() -> speechsdk.SpeechConfig:
+    # Creates an instance of a speech config with specified subscription key and service region.
+    speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
+    # Note: the voice setting will not overwrite the voice element in input SSML.
+    speech_config.speech_synthesis_voice_name = voice_name
+    speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Audio24Khz48KBitRateMonoMp3)
+    return speech_config
 
-text = "\"Two Girls under an Umbrella,\" a 1910 painting by the German Expressionist artist Ernst Ludwig Kirchner, captures a moment of companionship between two women sharing an umbrella in a rural setting. This work is emblematic of Kirchner's style, characterized by bold colors, energetic brushstrokes, and a focus on capturing the emotional essence of a scene."
+@instrumented('azure', stage='tts', falsy_is_error=True)
+def text_to_speech(text: str) -> Optional[BytesIO]:
+    """
+    Converts text to mp3 audio with Azure Speech, keeping the audio in memory instead of
+    playing it on the default speaker.
 
-# use the default speaker as audio output.
-speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config)
+    Returns:
+        BytesIO: The mp3 audio, or None if synthesis failed.
 
-result = speech_synthesizer.speak_text_async(text).get()
-# Check result
-if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-    print("Speech synthesized for text [{}]".format(text))
-elif result.reason == speechsdk.ResultReason.Canceled:
-    cancellation_details = result.cancellation_details
-    print("Speech synthesis canceled: {}".format(cancellation_details.reason))
-    if cancellation_details.reason == speechsdk.CancellationReason.Error:
-        print("Error details: {}".format(cancellation_details.error_details))
+    Raises:
+        RetryableError: If Azure is still throttling after every retry.
+    """
+    if not text or not text.strip():
+        raise Exception('Error: cannot convert empty text to speech')
 
+    def send():
+        # audio_config=None keeps the result in memory
+        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=create_speech_config(), audio_config=None)
+        result = speech_synthesizer.speak_text_async(text).get()
+        if result.reason == speechsdk.ResultReason.Canceled:
+            cancellation_details = result.cancellation_details
+            if cancellation_details.error_code in (speechsdk.CancellationErrorCode.TooManyRequests, speechsdk.CancellationErrorCode.ServiceUnavailable):
+                raise RetryableError(cancellation_details.error_details)
+        return result
+
+    metrics.inc('characters_total', len(text), stage='tts', provider='azure')
+    result = get_scheduler('azure').call(send)
+    # Check result
+    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+        metrics.inc('bytes_total', len(result.audio_data), stage='tts', provider='azure')
+        return BytesIO(result.audio_data)
+    elif result.reason == speechsdk.ResultReason.Canceled:
+        cancellation_details = result.cancellation_details
+        details = cancellation_details.error_details if cancellation_details.reason == speechsdk.CancellationReason.Error else None
+        metrics.log('tts_failed', provider='azure', reason=str(cancellation_details.reason), error=details)
+    return None
+
+class AzureProvider(TTSProvider):
+    name = 'azure'
+
+    def synthesize(self, text: str) -> Optional[BinaryIO]:
+        return text_to_speech(text)
+
+def _batch_request(method: str, url: str, **kwargs):
+    def send():
+        response = get_http_session().request(method, url, timeout=timeout(), **kwargs)
+        raise_for_retryable(response)
+        response.raise_for_status()
+        return response
+
+    return get_scheduler('azure').call(send)
+
+def _batch_url(synthesis_id: str) -> str:
+    return '{}/texttospeech/batchsyntheses/{}?api-version={}'.format(speech_endpoint.rstrip('/'), synthesis_id, BATCH_API_VERSION)
+
+def submit_batch_synthesis(texts: List[str]) -> str:
+    """
+    Submits texts as one Azure batch synthesis job. Each text becomes its own mp3.
+
+    Args:
+        texts (List[str]): Up to BATCH_MAX_INPUTS texts.
+
+    Returns:
+        str: The id of the batch synthesis job.
+    """
+    if len(texts) > BATCH_MAX_INPUTS:
+        raise ValueError('A batch synthesis takes at most {} texts'.format(BATCH_MAX_INPUTS))
+
+    synthesis_id = 'audio-uploader-{}'.format(uuid.uuid4())
+    body = {
+        'inputKind': 'PlainText',
+        'inputs': [{'content': text} for text in texts],
+        'synthesisConfig': {'voice': voice_name},
+        'properties': {
+            'outputFormat': BATCH_OUTPUT_FORMAT,
+            'concatenateResult': False,
+            'timeToLiveInHours': 24,
+        },
+    }
+    _batch_request('PUT', _batch_url(synthesis_id), headers={'Ocp-Apim-Subscription-Key': speech_key}, json=body)
+    metrics.inc('characters_total', sum(len(text) for text in texts), stage='batch_tts', provider='azure')
+    metrics.log('batch_submitted', provider='azure', synthesis_id=synthesis_id, texts=len(texts))
+    return synthesis_id
+
+def wait_for_batch_synthesis(synthesis_id: str, poll_seconds: float = BATCH_POLL_SECONDS, timeout_seconds: float = BATCH_TIMEOUT_SECONDS) -> dict:
+    """
+    Polls a batch synthesis job until it finishes.
+
+    Returns:
+        dict: The finished job, including the result zip URL under outputs.result.
+
+    Raises:
+        Exception: If the job fails or doesn't finish within timeout_seconds.
+    """
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        synthesis = _batch_request('GET', _batch_url(synthesis_id), headers={'Ocp-Apim-Subscription-Key': speech_key}).json()
+        status = synthesis.get('status')
+        if status == 'Succeeded':
+            return synthesis
+        if status == 'Failed':
+            raise Exception('Batch synthesis {} failed: {}'.format(synthesis_id, synthesis.get('properties', {}).get('error')))
+        if time.monotonic() > deadline:
+            raise Exception('Batch synthesis {} did not finish in time (status {})'.format(synthesis_id, status))
+        time.sleep(poll_seconds)
+
+def download_batch_results(synthesis: dict, count: int) -> List[Optional[BytesIO]]:
+    """
+    Downloads the result zip of a finished batch synthesis.
+
+    Args:
+        synthesis (dict): The finished job from wait_for_batch_synthesis.
+        count (int): The number of texts that were submitted.
+
+    Returns:
+        List[Optional[BytesIO]]: The mp3 for each submitted text, in submission order, or None
+        for texts that failed to synthesize.
+    """
+    # The result URL is pre-signed, so the subscription key isn't sent with it
+    response = _batch_request('GET', synthesis['outputs']['result'], stream=True)
+    with response, SpooledTemporaryFile(max_size=16 * 1024 * 1024) as archive:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            archive.write(chunk)
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as results:
+            names = set(results.namelist())
+            # Results are numbered from 0001 in submission order
+            return [
+                BytesIO(results.read('{:04d}.mp3'.format(i + 1))) if '{:04d}.mp3'.format(i + 1) in names else None
+                for i in range(count)
+            ]
+
+def delete_batch_synthesis(synthesis_id: str):
+    """Deletes a batch synthesis job and its results from Azure."""
+    try:
+        _batch_request('DELETE', _batch_url(synthesis_id), headers={'Ocp-Apim-Subscription-Key': speech_key})
+    except Exception as e:
+        metrics.log('batch_delete_failed', provider='azure', synthesis_id=synthesis_id, error=str(e))
+
+def batch_text_to_speech(texts: List[str], batch_size: int = BATCH_MAX_INPUTS, poll_seconds: float = BATCH_POLL_SECONDS) -> Iterator[List[Optional[BytesIO]]]:
+    """
+    Converts many texts to mp3 audio with one Azure batch synthesis job per batch_size texts.
+    All jobs are submitted before waiting on any of them, so Azure works on them together,
+    but results are downloaded one batch at a time to bound memory.
+
+    Args:
+        texts (List[str]): The texts to convert.
+        batch_size (int): The number of texts per job, at most BATCH_MAX_INPUTS.
+        poll_seconds (float): How often to check whether a job has finished.
+
+    Yields:
+        List[Optional[BytesIO]]: The mp3 for each text of a batch, in order, or None for texts
+        that failed. Batches are yielded in order.
+    """
+    batch_size = min(batch_size, BATCH_MAX_INPUTS)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    synthesis_ids = [submit_batch_synthesis(batch) for batch in batches]
+
+    for synthesis_id, batch in zip(synthesis_ids, batches):
+        try:
+            with metrics.timer('batch_tts', 'azure'):
+                synthesis = wait_for_batch_synthesis(synthesis_id, poll_seconds=poll_seconds)
+                mp3s = download_batch_results(synthesis, len(batch))
+        except Exception as e:
+            metrics.log('batch_tts_failed', provider='azure', synthesis_id=synthesis_id, error=str(e))
+            mp3s = [None] * len(batch)
+        metrics.inc('bytes_total', sum(mp3.getbuffer().nbytes for mp3 in mp3s if mp3 is not None), stage='batch_tts', provider='azure')
+        delete_batch_synthesis(synthesis_id)
+        yield mp3s
+
+def main():
+    """
+    The main function of the program.
+    """
+    # text = "Louis Le Nain lived in a region to the north of Paris known for its open fields that produced cereals and grain. Although he settled in Paris with his two brothers, who were also painters, he produced a series of rural images that recall the landscape of his youth. In the Landscape with Peasants, an old woman regards three children: a little girl dressed in white collar and cap, a small boy who plays the pipe, and a boy dressed in a cloak and hat who plays a hurdy-gurdy."
+
+    text = "\"Two Girls under an Umbrella,\" a 1910 painting by the German Expressionist artist Ernst Ludwig Kirchner, captures a moment of companionship between two women sharing an umbrella in a rural setting. This work is emblematic of Kirchner's style, characterized by bold colors, energetic brushstrokes, and a focus on capturing the emotional essence of a scene."
+
+    mp3 = text_to_speech(text)
+    if mp3:
+        with open("output.mp3", "wb") as f:
+            f.write(mp3.getvalue())
+
+if __name__ == '__main__':
+    main()
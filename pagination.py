@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, List
+from metrics import metrics
+
+PAGE_SIZE = 1000
+MAX_WORKERS = 4
+
+
+def fetch_all_pages(build_query: Callable, total_count: int, page_size: int = PAGE_SIZE, max_workers: int = MAX_WORKERS, label: str = 'rows') -> List[dict]:
+    """
+    Fetches every row of a table by computing all page ranges from an exact count up front
+    and fetching the pages concurrently.
+
+    Args:
+        build_query (Callable): Returns a fresh select query. It should be ordered on a unique
+            column so that the pages don't overlap.
+        total_count (int): The exact number of rows, e.g. from a count="exact" query.
+        page_size (int): The number of rows per page. Should not exceed the PostgREST max rows setting.
+        max_workers (int): The maximum number of pages fetched at once.
+        label (str): What the rows are, for progress logs and metrics.
+
+    Returns:
+        List[dict]: All rows, in query order.
+    """
+    offsets = list(range(0, total_count, page_size))
+    fetched = [0]
+    lock = Lock()
+
+    def fetch_page(offset: int) -> List[dict]:
+        with metrics.timer(label, 'supabase'):
+            data = build_query().range(offset, offset + page_size - 1).execute().data or []
+        with lock:
+            fetched[0] += len(data)
+            done = fetched[0]
+        metrics.inc('rows_total', len(data), stage=label, provider='supabase')
+        metrics.log('page_fetched', label=label, fetched=done, total=total_count)
+        return data
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map() yields in submission order, so pages are reassembled in order
+        for page in executor.map(fetch_page, offsets):
+            rows.extend(page)
+    return rows
@@ -1,4 +1,6 @@
 class Piece:
+    __slots__ = ('id', 'title', 'displaydate', 'artist', 'location', 'overview', 'description')
+
     def __init__(self, id: int, title: str, displaydate: str, artist: str, location: str, overview: str, description: str):
         """Represents a piece of artwork from the database."""
         self.id = id
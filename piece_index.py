@@ -0,0 +1,177 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from piece import Piece
+import re
+import unicodedata
+
+# How much the artist counts towards a match when one is given; the rest is the title
+ARTIST_WEIGHT = 0.3
+# The least score match and match_many accept
+MATCH_MIN_SCORE = 0.5
+# Candidates come from the rarest query trigrams, since common ones touch most of the catalog
+CANDIDATE_TRIGRAMS = 8
+# Tokens in more than this share of the titles (e.g. 'the', 'of') don't select candidates
+COMMON_TOKEN_SHARE = 0.05
+# How many of the best candidates are scored exactly
+MAX_CANDIDATES = 24
+
+# Anything but letters and digits in any script, so titles like 'Café' or '睡蓮' keep their words
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text: Optional[str]) -> str:
+    """Casefolds, strips accents and punctuation, and collapses whitespace."""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(' ', text.casefold()).strip()
+
+
+def trigrams(normalized: str) -> set:
+    """Returns the character trigrams of a normalized string, padded so word edges count."""
+    if not normalized:
+        return set()
+    padded = ' {} '.format(normalized)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: set, b: set) -> float:
+    """The Dice coefficient of two trigram sets, from 0 (nothing shared) to 1 (the same)."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class PieceIndex:
+    def __init__(self, pieces: Iterable[Piece] = ()):
+        """
+        An in-memory token and trigram index over piece titles and artists, for fuzzy
+        lookups without a server round trip per query.
+
+        Only each piece's id, title and artist are needed, so it can be built from
+        iter_pieces(columns=('id', 'title', 'artist')) or a snapshot.
+
+        Args:
+            pieces (Iterable[Piece]): The pieces to index. Consumed lazily.
+        """
+        self._pieces: List[Piece] = []
+        self._titles: List[str] = []
+        self._artists: List[str] = []
+        self._trigrams: Dict[str, List[int]] = {}
+        self._tokens: Dict[str, List[int]] = {}
+        self._artist_tokens: Dict[str, List[int]] = {}
+        # Many pieces share an artist, so each distinct artist's trigrams are computed once
+        self._artist_trigrams: Dict[str, frozenset] = {}
+        for piece in pieces:
+            self.add(piece)
+
+    def __len__(self) -> int:
+        return len(self._pieces)
+
+    def add(self, piece: Piece):
+        """Adds a piece to the index."""
+        position = len(self._pieces)
+        title = normalize(piece.title)
+        artist = normalize(piece.artist)
+        self._pieces.append(piece)
+        self._titles.append(title)
+        self._artists.append(artist)
+
+        for gram in trigrams(title):
+            self._trigrams.setdefault(gram, []).append(position)
+        for token in set(title.split()):
+            self._tokens.setdefault(token, []).append(position)
+        for token in set(artist.split()):
+            self._artist_tokens.setdefault(token, []).append(position)
+
+    def _artist_grams(self, artist: str) -> frozenset:
+        grams = self._artist_trigrams.get(artist)
+        if grams is None:
+            grams = self._artist_trigrams[artist] = frozenset(trigrams(artist))
+        return grams
+
+    def _candidates(self, title: str, title_grams: set, artist: Optional[str] = None) -> List[int]:
+        counts = Counter()
+        grams = sorted((gram for gram in title_grams if gram in self._trigrams), key=lambda gram: len(self._trigrams[gram]))
+        for gram in grams[:CANDIDATE_TRIGRAMS]:
+            counts.update(self._trigrams[gram])
+
+        max_postings = max(1, int(len(self._pieces) * COMMON_TOKEN_SHARE))
+        for token in set(title.split()):
+            postings = self._tokens.get(token)
+            if postings and len(postings) <= max_postings:
+                # A whole word in common counts for more than a shared trigram
+                for position in postings:
+                    counts[position] += 2
+
+        if artist:
+            # More pieces can share a title (e.g. 'Untitled') than are scored, so the artist's
+            # pieces among them go first. Its rarest token stands for the artist.
+            postings = [self._artist_tokens[token] for token in set(artist.split()) if token in self._artist_tokens]
+            if postings:
+                for position in min(postings, key=len):
+                    if position in counts:
+                        counts[position] += 2
+        return [position for position, _ in counts.most_common(MAX_CANDIDATES)]
+
+    def search(self, title: str, artist: Optional[str] = None, limit: int = 10, min_score: float = 0.0) -> List[Tuple[Piece, float]]:
+        """
+        Finds the pieces whose title best matches, tolerating typos, accents, punctuation and
+        word order.
+
+        Args:
+            title (str): The title to look for.
+            artist (str): If given, the artist counts for ARTIST_WEIGHT of the score, and the
+                artist's pieces are scored first when many pieces share the title.
+            limit (int): The maximum number of results.
+            min_score (float): Results scoring lower are left out.
+
+        Returns:
+            List[Tuple[Piece, float]]: (piece, score) pairs, best first. Scores range from 0 to 1.
+        """
+        title = normalize(title)
+        title_grams = trigrams(title)
+        if not title_grams:
+            return []
+        artist = normalize(artist)
+        artist_grams = trigrams(artist)
+
+        scored = []
+        for position in self._candidates(title, title_grams, artist):
+            score = similarity(title_grams, trigrams(self._titles[position]))
+            if artist_grams:
+                artist_score = similarity(artist_grams, self._artist_grams(self._artists[position]))
+                score = (1 - ARTIST_WEIGHT) * score + ARTIST_WEIGHT * artist_score
+            if score >= min_score:
+                scored.append((score, position))
+
+        scored.sort(key=lambda result: (-result[0], self._pieces[result[1]].id))
+        return [(self._pieces[position], round(score, 4)) for score, position in scored[:limit]]
+
+    def match(self, title: str, artist: Optional[str] = None, min_score: float = MATCH_MIN_SCORE) -> Optional[Piece]:
+        """Returns the best matching piece, or None if nothing scores at least min_score."""
+        results = self.search(title, artist, limit=1, min_score=min_score)
+        return results[0][0] if results else None
+
+    def match_many(self, queries: Iterable[Tuple[str, Optional[str]]], min_score: float = MATCH_MIN_SCORE) -> List[Optional[Piece]]:
+        """
+        Matches a batch of (title, artist) pairs, e.g. to reconcile an export against the
+        catalog. Repeated pairs are only searched once.
+
+        Args:
+            queries (Iterable[Tuple[str, Optional[str]]]): (title, artist) pairs; artist may be None.
+            min_score (float): The least score a match needs.
+
+        Returns:
+            List[Optional[Piece]]: The best match for each pair, in order, or None where
+            nothing scored high enough.
+        """
+        matches: Dict[Tuple[str, Optional[str]], Optional[Piece]] = {}
+        results = []
+        for title, artist in queries:
+            key = (title, artist)
+            if key not in matches:
+                matches[key] = self.match(title, artist, min_score=min_score)
+            results.append(matches[key])
+        return results
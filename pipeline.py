@@ -0,0 +1,121 @@
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Iterable, List, Optional
+from metrics import metrics
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[Any], Optional[Any]], workers: int = 1):
+        """
+        Represents one step of a pipeline.
+
+        Args:
+            name (str): A short name for the stage, used in logs, stats and metrics.
+            func (Callable): Called with each item. Returns the item to hand to the next stage,
+                or None to drop it.
+            workers (int): The number of threads running this stage.
+        """
+        if workers < 1:
+            raise ValueError('Stage {} needs at least one worker'.format(name))
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+    def __str__(self) -> str:
+        return f'Stage(name={self.name}, workers={self.workers})'
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], queue_size: int = 8):
+        """
+        Runs items through a sequence of stages. Each stage has its own worker threads and
+        stages are connected by bounded queues, so a slow stage applies back-pressure
+        instead of letting finished work pile up in memory.
+
+        Args:
+            stages (List[Stage]): The stages to run, in order.
+            queue_size (int): The maximum number of items waiting in front of each stage.
+        """
+        if not stages:
+            raise ValueError('Pipeline needs at least one stage')
+        self.stages = stages
+        self.queue_size = queue_size
+        self._lock = Lock()
+        self.stats = {}
+
+    def _count(self, stage: Stage, key: str):
+        with self._lock:
+            self.stats[stage.name][key] += 1
+        metrics.inc('items_total', stage=stage.name, provider='pipeline', outcome=key)
+
+    def _work(self, stage: Stage, inbox: Queue, outbox: Optional[Queue], results: list):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            try:
+                with metrics.timer(stage.name, 'pipeline'):
+                    result = stage.func(item)
+            except Exception as e:
+                metrics.log('stage_error', stage=stage.name, error=str(e))
+                self._count(stage, 'failed')
+                continue
+
+            if result is None:
+                self._count(stage, 'dropped')
+                continue
+
+            self._count(stage, 'passed')
+            if outbox is not None:
+                outbox.put(result)
+            else:
+                with self._lock:
+                    results.append(result)
+
+    def run(self, items: Iterable[Any]) -> List[Any]:
+        """
+        Feeds the items through every stage and blocks until all of them are done.
+
+        Args:
+            items (Iterable): The items to process. Consumed lazily, so a generator keeps
+                memory bounded by the queue sizes.
+
+        Returns:
+            List: The items that made it out of the last stage, in completion order.
+
+        Raises:
+            Exception: Whatever iterating over `items` raised, once the items already fed in
+                have finished.
+        """
+        self.stats = {stage.name: {'passed': 0, 'dropped': 0, 'failed': 0} for stage in self.stages}
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+        threads = []
+
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            stage_threads = [
+                Thread(target=self._work, args=(stage, queues[i], outbox, results), daemon=True)
+                for _ in range(stage.workers)
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            # Shut the stages down in order, also if `items` raised: once every worker of a
+            # stage has exited, nothing more can reach the next queue.
+            for i, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    queues[i].put(_DONE)
+                for thread in threads[i]:
+                    thread.join()
+
+        for stage in self.stages:
+            metrics.log('pipeline_stage', stage=stage.name, workers=stage.workers, **self.stats[stage.name])
+        return results
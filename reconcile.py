@@ -0,0 +1,259 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+from audio import Audio
+from internet_archive_client import delete_file, get_item_files, iter_mp3_files
+from journal import JobJournal
+from supabase_client import SupabaseClient
+from metrics import metrics
+import argparse
+import json
+import os
+
+STATE_PATH = os.environ.get('RECONCILE_STATE', 'reconcile_state.json')
+# Repair won't delete audios for missing files if the archive listing lost more than this share of
+# the files the last run saw, since that is more likely a failed search than deleted files
+MAX_LISTING_SHRINK = float(os.environ.get('RECONCILE_MAX_LISTING_SHRINK', 0.1))
+
+
+def archive_key(url: str) -> Optional[Tuple[str, str]]:
+    """
+    Returns the (identifier, filename) an archive download URL points to, or None if the
+    URL isn't an archive download URL. Comparing keys rather than URLs ignores quoting differences.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    parts = parsed.path.split('/', 3)
+    if not parsed.netloc.endswith('archive.org') or len(parts) < 4 or parts[1] != 'download':
+        return None
+    return parts[2], unquote(parts[3])
+
+
+class ReconcileState:
+    def __init__(self, scanned_at: Optional[str] = None, max_audio_id: Optional[int] = None, items: Dict[str, List[str]] = None, audios: Dict[int, Audio] = None):
+        """
+        What the last reconcile run saw, so the next run only has to fetch what changed since.
+
+        Args:
+            scanned_at (str): When the last archive scan started, as an ISO timestamp. This is the watermark
+                for the next archive scan.
+            max_audio_id (int): The highest audio id seen. This is the watermark for the next audios scan.
+            items (Dict[str, List[str]]): The mp3 file names in each archive item.
+            audios (Dict[int, Audio]): The audio records, by id.
+        """
+        self.scanned_at = scanned_at
+        self.max_audio_id = max_audio_id
+        self.items = items or {}
+        self.audios = audios or {}
+
+    def file_count(self) -> int:
+        """Returns the number of archive files in the state."""
+        return sum(len(names) for names in self.items.values())
+
+    @classmethod
+    def load(cls, path: str) -> 'ReconcileState':
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        return cls(
+            scanned_at=data['scanned_at'],
+            max_audio_id=data['max_audio_id'],
+            items=data['items'],
+            audios={row[0]: Audio(*row) for row in data['audios']}
+        )
+
+    def save(self, path: str):
+        data = {
+            'scanned_at': self.scanned_at,
+            'max_audio_id': self.max_audio_id,
+            'items': self.items,
+            'audios': [[a.id, a.created_at, a.entity_type, a.entity_id, a.link] for a in self.audios.values()],
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+class ReconcileReport:
+    def __init__(self):
+        """The differences found between the archive and the `audios` table."""
+        self.missing: List[Audio] = [] # audios whose link points to no archive file
+        self.orphaned: List[Tuple[str, str]] = [] # archive files no audio links to
+        self.duplicate_links: Dict[Tuple[str, str], List[Audio]] = {} # files more than one audio links to
+        self.duplicate_entities: Dict[Tuple[str, int], List[Audio]] = {} # entities with more than one audio
+
+    def __str__(self) -> str:
+        return f'ReconcileReport(missing={len(self.missing)}, orphaned={len(self.orphaned)}, duplicate_links={len(self.duplicate_links)}, duplicate_entities={len(self.duplicate_entities)})'
+
+
+def refresh_state(client: SupabaseClient, state: ReconcileState, full: bool = False) -> ReconcileState:
+    """
+    Brings the state up to date. Only archive items updated since the last scan and audios
+    added since the last scan are fetched, unless full is True.
+
+    Audios deleted outside of reconcile aren't noticed by an incremental run; use full=True
+    after bulk deletes such as remove_tainted_audios.
+    """
+    if full:
+        state = ReconcileState()
+
+    scanned_at = datetime.now(timezone.utc)
+    modified_since = datetime.fromisoformat(state.scanned_at) if state.scanned_at else None
+
+    # Items that changed are re-listed in full, replacing what was known about them
+    listed: Dict[str, List[str]] = {}
+    for file in iter_mp3_files(modified_since=modified_since):
+        listed.setdefault(file['identifier'], []).append(file['filename'])
+    state.items.update(listed)
+    metrics.log('archive_listed', files=sum(len(files) for files in listed.values()), items=len(listed))
+
+    new_audios = 0
+    for audio in client.iter_audios(after_id=state.max_audio_id):
+        state.audios[audio.id] = audio
+        state.max_audio_id = audio.id
+        new_audios += 1
+    metrics.log('audios_loaded', count=new_audios)
+
+    state.scanned_at = scanned_at.isoformat()
+    return state
+
+
+def diff(state: ReconcileState) -> ReconcileReport:
+    """Compares the archive files and audio records in the state."""
+    report = ReconcileReport()
+    files = {(identifier, name) for identifier, names in state.items.items() for name in names}
+
+    by_file: Dict[Tuple[str, str], List[Audio]] = {}
+    by_entity: Dict[Tuple[str, int], List[Audio]] = {}
+    for audio in state.audios.values():
+        by_entity.setdefault((audio.entity_type, audio.entity_id), []).append(audio)
+        key = archive_key(audio.link)
+        if key in files:
+            by_file.setdefault(key, []).append(audio)
+        else:
+            report.missing.append(audio)
+
+    report.orphaned = sorted(files - by_file.keys())
+    report.duplicate_links = {key: audios for key, audios in by_file.items() if len(audios) > 1}
+    report.duplicate_entities = {key: audios for key, audios in by_entity.items() if len(audios) > 1}
+    return report
+
+
+def confirm_missing(state: ReconcileState, audios: List[Audio]) -> List[Audio]:
+    """
+    Re-fetches the file list of each item the audios link to and returns the audios whose file
+    is really gone. The fresh file lists replace those in the state.
+
+    Audios whose link isn't an archive download URL, or whose item's file list can't be
+    fetched, can't be confirmed and are left out.
+    """
+    by_identifier: Dict[str, List[Audio]] = {}
+    for audio in audios:
+        key = archive_key(audio.link)
+        if key is None:
+            print('Not deleting audio {}: not an archive link: {}'.format(audio.id, audio.link))
+            continue
+        by_identifier.setdefault(key[0], []).append(audio)
+
+    confirmed = []
+    for identifier, item_audios in by_identifier.items():
+        try:
+            names = [file['name'] for file in get_item_files(identifier) if file['name'].endswith('.mp3')]
+        except Exception as error:
+            print('Not deleting {} audios in {}: could not list the item: {}'.format(len(item_audios), identifier, error))
+            continue
+        state.items[identifier] = names
+        present = set(names)
+        confirmed.extend(audio for audio in item_audios if archive_key(audio.link)[1] not in present)
+    return confirmed
+
+
+def repair(client: SupabaseClient, state: ReconcileState, report: ReconcileReport, delete_orphans: bool = False, previous_file_count: int = 0):
+    """
+    Deletes audios that point to missing files and all but the oldest audio of each entity
+    whose file is present.
+    If delete_orphans is True, archive files no audio links to are deleted as well.
+
+    Audios for missing files are only deleted once their item's file list has been fetched
+    again and confirms the file is gone, and not at all if the archive listing is empty or
+    shrank by more than MAX_LISTING_SHRINK since the last run.
+
+    Args:
+        previous_file_count (int): How many archive files the last run's state had.
+    """
+    missing = report.missing
+    file_count = state.file_count()
+    if missing and (file_count == 0 or file_count < previous_file_count * (1 - MAX_LISTING_SHRINK)):
+        print('Not deleting {} audios for missing files: the archive listing has {} files, down from {}'.format(len(missing), file_count, previous_file_count))
+        missing = []
+    elif missing:
+        missing = confirm_missing(state, missing)
+
+    to_delete = {audio.id for audio in missing}
+    files = {(identifier, name) for identifier, names in state.items.items() for name in names}
+    for audios in report.duplicate_entities.values():
+        # The oldest audio whose file is there survives; without one, the duplicates are kept
+        present = [audio for audio in sorted(audios, key=lambda a: a.id) if audio.id not in to_delete and archive_key(audio.link) in files]
+        if present:
+            to_delete.update(audio.id for audio in audios if audio is not present[0])
+
+    if to_delete:
+        client.delete_audios(to_delete)
+        for audio_id in to_delete:
+            state.audios.pop(audio_id, None)
+
+    if delete_orphans:
+        for identifier, name in report.orphaned:
+            if delete_file(identifier, name) and name in state.items.get(identifier, []):
+                state.items[identifier].remove(name)
+
+
+def reconcile(client: SupabaseClient, fix: bool = False, delete_orphans: bool = False, full: bool = False, state_path: str = STATE_PATH) -> ReconcileReport:
+    """
+    Checks that every audio links to an archive file and every archive mp3 has an audio,
+    and optionally repairs the differences.
+
+    Args:
+        client (SupabaseClient): The client to read and delete audios with.
+        fix (bool): Whether to delete broken and duplicate audio records.
+        delete_orphans (bool): Whether to also delete archive files that no audio links to.
+        full (bool): Whether to ignore the saved watermark and rescan everything.
+        state_path (str): Where the watermark and last seen state are stored.
+
+    Returns:
+        ReconcileReport: The differences found, before any repair.
+    """
+    state = ReconcileState.load(state_path)
+    previous_file_count = state.file_count()
+    state = refresh_state(client, state, full=full)
+    report = diff(state)
+    print(report)
+
+    if fix:
+        repair(client, state, report, delete_orphans=delete_orphans, previous_file_count=previous_file_count)
+    state.save(state_path)
+    return report
+
+
+def main():
+    """
+    The main function of the program.
+    """
+    parser = argparse.ArgumentParser(description='Reconcile Internet Archive mp3s with the audios table.')
+    parser.add_argument('--repair', action='store_true', help='delete audios that point to missing files and duplicate audios')
+    parser.add_argument('--delete-orphans', action='store_true', help='with --repair, also delete archive files no audio links to')
+    parser.add_argument('--full', action='store_true', help='ignore the saved watermark and rescan everything')
+    args = parser.parse_args()
+
+    report = reconcile(SupabaseClient(journal=JobJournal()), fix=args.repair, delete_orphans=args.delete_orphans, full=args.full)
+    for audio in report.missing:
+        print('Missing file:', audio)
+    for identifier, name in report.orphaned:
+        print('Orphaned file:', identifier, name)
+    metrics.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+from typing import Type, TypeVar
+
+Model = TypeVar('Model')
+
+
+def from_row(model: Type[Model], row: dict) -> Model:
+    """
+    Builds a model object from a database row.
+
+    The model's `__slots__` are its schema: they list the columns it holds, in the same order
+    as its constructor arguments. Extra columns in the row are ignored and columns missing from
+    the row (e.g. not selected) are set to None.
+
+    Args:
+        model (Type): The model class, e.g. Piece or Audio.
+        row (dict): A row as returned by Supabase.
+
+    Returns:
+        An instance of the model.
+    """
+    return model(*map(row.get, model.__slots__))
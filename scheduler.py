@@ -0,0 +1,148 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import BoundedSemaphore, Lock
+from typing import Callable, Dict, Optional
+from metrics import metrics
+import os
+import random
+import time
+
+
+class RetryableError(Exception):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        """Raised for a throttled or transiently failed request that is safe to send again."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """
+        Allows `rate` requests per second on average, with bursts of up to `capacity`.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ProviderScheduler:
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Schedules calls to one provider: at most `rate` calls per second and `max_concurrency`
+        in flight, with retries for calls that raise RetryableError.
+
+        Args:
+            name (str): The provider's name, for progress output.
+            rate (float): The sustained number of calls per second.
+            burst (float): The number of calls that may be made at once after an idle period.
+            max_concurrency (int): The maximum number of calls in flight.
+            max_retries (int): How many times a call is retried before its error is raised.
+            base_delay (float): The backoff before the first retry, in seconds. It doubles every retry.
+            max_delay (float): The upper bound on the backoff, in seconds.
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Returns how long to wait before retry number `attempt` (starting at 0)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            # Never retry earlier than the provider asked; the jitter keeps workers from retrying in lockstep
+            delay = retry_after + delay / 4
+        return delay
+
+    def call(self, func: Callable, *args, **kwargs):
+        """
+        Calls func within the provider's rate and concurrency limits, retrying with jittered
+        exponential backoff while it raises RetryableError.
+
+        Raises:
+            RetryableError: If the call still fails after max_retries retries.
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self.semaphore:
+                try:
+                    return func(*args, **kwargs)
+                except RetryableError as error:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.backoff(attempt, error.retry_after)
+                    metrics.log('retry', provider=self.name, attempt=attempt + 1, delay_s=round(delay, 2), error=str(error))
+            self.retries += 1
+            metrics.inc('retries_total', provider=self.name)
+            attempt += 1
+            time.sleep(delay)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def raise_for_retryable(response):
+    """Raises RetryableError if the response is a 429 or 5xx, honoring its Retry-After header."""
+    if is_retryable_status(response.status_code):
+        raise RetryableError(
+            '{} {}'.format(response.status_code, response.reason),
+            parse_retry_after(response.headers.get('Retry-After'))
+        )
+
+
+def _env(provider: str, setting: str, default: float) -> float:
+    return float(os.environ.get('{}_{}'.format(provider.upper(), setting), default))
+
+# Defaults can be overridden per provider, e.g. ELEVENLABS_RATE=2 or ARCHIVE_CONCURRENCY=2
+schedulers: Dict[str, ProviderScheduler] = {
+    provider: ProviderScheduler(
+        provider,
+        rate=_env(provider, 'RATE', rate),
+        burst=_env(provider, 'BURST', burst),
+        max_concurrency=int(_env(provider, 'CONCURRENCY', concurrency))
+    )
+    for provider, rate, burst, concurrency in [
+        ('elevenlabs', 5, 5, 4),
+        ('archive', 2, 4, 4),
+        ('supabase', 20, 20, 8),
+        ('azure', 3, 5, 4),
+    ]
+}
+
+
+def get_scheduler(provider: str) -> ProviderScheduler:
+    """Returns the scheduler for 'elevenlabs', 'archive', 'supabase' or 'azure'."""
+    return schedulers[provider]
@@ -0,0 +1,202 @@
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Type, get_type_hints
+from piece import Piece
+from artist import Artist
+from audio import Audio
+from audit import Audit
+from supabase_client import SupabaseClient
+from timon_supabase_client import get_all_audits
+from metrics import metrics
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+MANIFEST_NAME = 'manifest.json'
+
+# The tables a snapshot holds and the model each row is loaded into
+TABLE_MODELS: Dict[str, Type] = {
+    'pieces': Piece,
+    'artists': Artist,
+    'audios': Audio,
+    'auditing': Audit,
+}
+
+# Overviews and biographies can be longer than the csv module's default field limit
+csv.field_size_limit(sys.maxsize)
+
+
+def snapshot_path(table: str, directory: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(directory, '{}.csv.gz'.format(table))
+
+
+def _open(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', newline='', encoding='utf-8')
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def _format(value) -> str:
+    # Same conventions as a Supabase CSV export: empty for null, true/false for booleans
+    if value is None:
+        return ''
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    return str(value)
+
+
+def _to_int(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        # Some columns typed int hold free text, e.g. an artist's lifespan
+        return value
+
+
+def _converters(model: Type) -> Dict[str, Callable[[str], object]]:
+    """Returns a parser for each of the model's columns, from its constructor's type annotations."""
+    hints = get_type_hints(model.__init__)
+    converters = {}
+    for column in model.__slots__:
+        hint = hints.get(column)
+        if hint is int:
+            converters[column] = _to_int
+        elif hint is bool:
+            converters[column] = lambda value: value == 'true'
+        else:
+            converters[column] = str
+    return converters
+
+
+def write_snapshot(table: str, records: Iterable, directory: str = SNAPSHOT_DIR) -> int:
+    """
+    Writes model objects to a gzipped CSV snapshot, one column per slot of the table's model.
+    The file is replaced atomically, so a failed dump leaves the previous snapshot in place.
+
+    Args:
+        table (str): One of TABLE_MODELS.
+        records (Iterable): The model objects to write. Consumed lazily.
+        directory (str): The snapshot directory. Created if missing.
+
+    Returns:
+        int: The number of rows written.
+    """
+    columns = TABLE_MODELS[table].__slots__
+    path = snapshot_path(table, directory)
+    tmp_path = path + '.tmp'
+    os.makedirs(directory, exist_ok=True)
+
+    count = 0
+    with gzip.open(tmp_path, 'wt', newline='', encoding='utf-8', compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for record in records:
+            writer.writerow([_format(getattr(record, column)) for column in columns])
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def iter_snapshot(table: str, directory: str = SNAPSHOT_DIR, path: Optional[str] = None) -> Iterator:
+    """
+    Streams the rows of a snapshot into model objects, one row at a time.
+
+    Also reads plain Supabase CSV exports such as auditing_rows.csv, since they use the
+    same conventions. Columns the model doesn't have are ignored and columns missing from
+    the file are None, like from_row.
+
+    Args:
+        table (str): One of TABLE_MODELS.
+        directory (str): The snapshot directory.
+        path (str): Read this file instead of the table's snapshot, e.g. 'auditing_rows.csv'.
+
+    Yields:
+        Model objects, in file order.
+
+    Raises:
+        FileNotFoundError: If there is no snapshot of the table.
+    """
+    model = TABLE_MODELS[table]
+    converters = _converters(model)
+    with _open(path or snapshot_path(table, directory), 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        # For each slot, the position of its column in the file (or None) and its parser
+        positions = {column: i for i, column in enumerate(header)}
+        plan = [(positions.get(column), converters[column]) for column in model.__slots__]
+
+        for row in reader:
+            yield model(*[
+                convert(row[i]) if i is not None and row[i] != '' else None
+                for i, convert in plan
+            ])
+
+
+def load_snapshot(table: str, directory: str = SNAPSHOT_DIR, path: Optional[str] = None) -> List:
+    """Same as iter_snapshot, but returns every row as a list."""
+    return list(iter_snapshot(table, directory, path))
+
+
+def read_manifest(directory: str = SNAPSHOT_DIR) -> Dict[str, dict]:
+    """Returns when each table was dumped and how many rows it has, or an empty dict if nothing was."""
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def dump_snapshots(client: SupabaseClient, directory: str = SNAPSHOT_DIR, tables: Iterable[str] = TABLE_MODELS) -> Dict[str, int]:
+    """
+    Dumps tables to local snapshot files so that runs can be planned without paging through
+    Supabase. Each table is streamed to disk page by page, except auditing, which is small.
+
+    Args:
+        client (SupabaseClient): The client to read pieces, artists and audios with.
+        directory (str): The snapshot directory.
+        tables (Iterable[str]): Which of TABLE_MODELS to dump.
+
+    Returns:
+        Dict[str, int]: The number of rows written per table.
+    """
+    sources = {
+        'pieces': lambda: client.iter_pieces(columns=Piece.__slots__),
+        'artists': client.iter_artists,
+        'audios': client.iter_audios,
+        'auditing': get_all_audits,
+    }
+    manifest = read_manifest(directory)
+    counts = {}
+    for table in tables:
+        taken_at = datetime.now(timezone.utc).isoformat()
+        counts[table] = write_snapshot(table, sources[table](), directory)
+        manifest[table] = {'taken_at': taken_at, 'rows': counts[table]}
+        metrics.log('snapshot_written', table=table, rows=counts[table], path=snapshot_path(table, directory))
+
+    tmp_path = os.path.join(directory, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+    return counts
+
+
+def main():
+    """
+    The main function of the program.
+    """
+    parser = argparse.ArgumentParser(description='Dump Supabase tables to local snapshot files.')
+    parser.add_argument('--dir', default=SNAPSHOT_DIR, help='the snapshot directory')
+    parser.add_argument('--tables', default=','.join(TABLE_MODELS), help='comma separated tables to dump')
+    args = parser.parse_args()
+
+    dump_snapshots(SupabaseClient(), directory=args.dir, tables=args.tables.split(','))
+
+if __name__ == '__main__':
+    main()
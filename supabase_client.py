@@ -1,20 +1,173 @@
-from typing import List, Optional, Union
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
 from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from scheduler import RetryableError, get_scheduler, parse_retry_after
+from threading import local
+import httpx
 from supabase import create_client
 import os
 from piece import Piece
 from artist import Artist
 from audio import Audio
+from audio_index import AudioIndex
+from pagination import fetch_all_pages
+from rows import from_row
+from metrics import instrumented, metrics
+from piece_index import PieceIndex, normalize
+from loader import Loader
+from journal import JobJournal
+from table_cache import TABLE_CACHE_PATH, TABLE_MODELS, TableCache, audio_key
 
 load_dotenv()
 
+IN_QUERY_CHUNK_SIZE = 100
+# What get_all_audios raises when the table is empty
+NO_AUDIOS_FOUND = 'No audio records found'
+
+# The status and Retry-After of the last Supabase response on each thread. APIError only
+# carries the PostgREST or SQLSTATE error code, so retries are decided on these instead.
+_last_response = local()
+
+def _remember_response(response: httpx.Response):
+    _last_response.status_code = response.status_code
+    _last_response.retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+def execute_write(query, idempotent: bool = True):
+    """
+    Executes a Supabase write within the Supabase rate limits, retrying throttled (429) and
+    5xx responses and connection failures.
+
+    Args:
+        query: The write query, e.g. from insert, update, upsert or delete.
+        idempotent: Whether sending the write twice is harmless. Inserts are not: one that
+            failed after it was sent (a read timeout, a 502) may have been committed anyway,
+            so it is only retried if it never reached the server or was throttled.
+    """
+    def send():
+        _last_response.status_code = None
+        try:
+            return query.execute()
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as error:
+            # The request was never sent
+            raise RetryableError(str(error)) from error
+        except httpx.TransportError as error:
+            if idempotent:
+                raise RetryableError(str(error)) from error
+            raise
+        except APIError as error:
+            status_code = _last_response.status_code
+            if status_code == 429 or (idempotent and status_code is not None and status_code >= 500):
+                raise RetryableError(str(error), _last_response.retry_after) from error
+            raise
+
+    return get_scheduler('supabase').call(send)
+
+def chunked(values: list, size: int = IN_QUERY_CHUNK_SIZE) -> Iterable[list]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
 class SupabaseClient:
-    def __init__(self):
+    def __init__(self, journal: Optional[JobJournal] = None):
+        """
+        Args:
+            journal: The job journal to drop entities from when their audio is deleted, so the
+                next run regenerates it rather than skipping it as already recorded.
+        """
         supabase_url = os.environ.get('SUPABASE_URL')
         supabase_anon_key = os.environ.get('SUPABASE_ANON_KEY')
 
         self.client = create_client(supabase_url, supabase_anon_key)
+        # Lets execute_write see the HTTP status behind an APIError
+        self.client.postgrest.session.event_hooks['response'].append(_remember_response)
+        self.journal = journal
+        self.audio_index: Optional[AudioIndex] = None
+        self.table_cache: Optional[TableCache] = None
+        self.piece_index: Optional[PieceIndex] = None
+        # Point lookups from concurrent workers are coalesced into `in` queries and cached briefly
+        self.piece_loader = Loader('pieces_by_id', self.get_pieces_by_ids, max_batch=IN_QUERY_CHUNK_SIZE)
+        self.artist_loader = Loader('artists_by_name', self.get_artists_by_names, max_batch=IN_QUERY_CHUNK_SIZE)
+        self.audio_loader = Loader('audios_by_entity', self.get_audios_by_entities, max_batch=IN_QUERY_CHUNK_SIZE)
+        self.cached_tables = set()
+
+    def load_audio_index(self, audios: Optional[Iterable[Audio]] = None) -> AudioIndex:
+        """
+        Loads the whole `audios` table into an in-memory index. While the index is loaded,
+        get_audio_by_piece and get_audio_by_artist answer from it instead of querying Supabase,
+        and add_audio and delete_audio keep it up to date.
 
+        Args:
+            audios: The audio records to index, e.g. from a snapshot. Fetched from Supabase if not given.
+
+        Returns:
+            The loaded AudioIndex.
+
+        Raises:
+            Exception: If the audios could not be fetched. A failed fetch is never taken for an
+                empty table, since that would regenerate audio for every entity.
+        """
+        if audios is None:
+            try:
+                audios = self.get_all_audios()
+            except Exception as error:
+                if str(error) != NO_AUDIOS_FOUND:
+                    raise
+                audios = []
+        self.audio_index = AudioIndex(audios)
+        metrics.log('audio_index_loaded', audios=len(self.audio_index))
+        return self.audio_index
+
+    def load_piece_index(self, pieces: Optional[Iterable[Piece]] = None) -> PieceIndex:
+        """
+        Builds an in-memory fuzzy index over piece titles and artists. While it is loaded,
+        search_pieces answers from it instead of calling the `search_pieces` RPC, and
+        piece_index.match_many can match whole batches of titles locally.
+
+        Args:
+            pieces: The pieces to index, e.g. from a snapshot. Streamed from Supabase if not given.
+
+        Returns:
+            The loaded PieceIndex.
+        """
+        if pieces is None:
+            pieces = self.iter_pieces(columns=('id', 'title', 'artist'))
+        self.piece_index = PieceIndex(pieces)
+        metrics.log('piece_index_loaded', pieces=len(self.piece_index))
+        return self.piece_index
+
+    def load_table_cache(self, path: str = TABLE_CACHE_PATH, tables: Iterable[str] = TABLE_MODELS, full: bool = False) -> TableCache:
+        """
+        Opens the persistent table cache and refreshes it, fetching only rows added since the
+        last refresh and rows this client changed. Afterwards get_piece_by_id, get_artist_by_name,
+        get_audio_by_piece and get_audio_by_artist answer from the cache first. Rows other
+        clients add after the refresh are only seen by the next one.
+
+        Args:
+            path: The SQLite file the cache is kept in between runs.
+            tables: Which of 'pieces', 'audios' and 'artists' to cache.
+            full: Whether to drop the cached rows and fetch everything again, e.g. after the
+                tables were edited outside this client.
+
+        Returns:
+            The refreshed TableCache.
+        """
+        if self.table_cache is None or self.table_cache.path != path:
+            self.table_cache = TableCache(path)
+        sources = {
+            'pieces': (lambda after_id: self.iter_pieces(columns=Piece.__slots__, after_id=after_id), lambda ids: self.get_pieces_by_ids(ids).values()),
+            'audios': (lambda after_id: self.iter_audios(after_id=after_id), self.get_audios_by_ids),
+            'artists': (lambda after_id: self.iter_artists(after_id=after_id), self.get_artists_by_ids),
+        }
+        for table in tables:
+            fetch_after, fetch_by_ids = sources[table]
+            fetched = self.table_cache.refresh(table, fetch_after, fetch_by_ids, full=full)
+            self.cached_tables.add(table)
+            metrics.log('table_cache_refreshed', table=table, fetched=fetched, max_id=self.table_cache.max_id(table))
+        return self.table_cache
+
+    def _cached(self, table: str) -> bool:
+        return self.table_cache is not None and table in self.cached_tables
+
+    @instrumented('supabase')
     def add_audio(self, audio: Audio):
         """
         Adds a new audio record to the `audios` table in Supabase.
@@ -33,9 +186,16 @@ class SupabaseClient:
             "entity_id": audio.entity_id,
             "link": audio.link
         }
-        self.client.from_("audios").insert(insert_dict).execute()
-        print("Audio added: ", audio)
-
+        response = execute_write(self.client.from_("audios").insert(insert_dict), idempotent=False)
+        metrics.log('audio_added', entity_type=audio.entity_type, entity_id=audio.entity_id, link=audio.link)
+        added = from_row(Audio, response.data[0] if response.data else insert_dict)
+        self.audio_loader.prime((added.entity_type, added.entity_id), added)
+        if self.audio_index is not None:
+            self.audio_index.add(added)
+        if self._cached('audios') and added.id is not None:
+            self.table_cache.put('audios', [added])
+
+    @instrumented('supabase')
     def update_audio(self, audio: Audio):
         """
         Updates an existing audio record in the `audios` table in Supabase based on the `entity_id`.
@@ -53,11 +213,23 @@ class SupabaseClient:
             "entity_type": audio.entity_type,
             "link": audio.link
         }
-        result = self.client.from_("audios").update(update_dict).eq("entity_id", audio.entity_id).execute()
-        if result['affected_rows'] == 0:
+        result = execute_write(self.client.from_("audios").update(update_dict).eq("entity_id", audio.entity_id))
+        if not result.data:
             raise Exception('No audio found with entity_id: {}'.format(audio.entity_id))
-        print("Audio updated: ", audio)
 
+        # The updated rows are returned; they may have changed entity type, so neither old key is kept
+        updated = [from_row(Audio, row) for row in result.data]
+        for entity_type in {'piece', 'artist', audio.entity_type}:
+            self.audio_loader.clear((entity_type, audio.entity_id))
+        if self.audio_index is not None:
+            for updated_audio in updated:
+                self.audio_index.remove(updated_audio.id)
+                self.audio_index.add(updated_audio)
+        if self._cached('audios'):
+            self.table_cache.put('audios', updated)
+        metrics.log('audio_updated', entity_type=audio.entity_type, entity_id=audio.entity_id, link=audio.link)
+
+    @instrumented('supabase')
     def delete_audio(self, audio_id: int):
         """
         Deletes an audio record from the `audios` table in Supabase.
@@ -70,12 +242,48 @@ class SupabaseClient:
         """
         try:
             audio = self.get_audio_by_id(audio_id)
-            self.client.from_("audios").delete().match({"id": audio_id}).execute()
-            print("Audio deleted:", audio)
+            execute_write(self.client.from_("audios").delete().match({"id": audio_id}))
+            if audio:
+                self.audio_loader.clear((audio.entity_type, audio.entity_id))
+                if self.journal is not None:
+                    self.journal.forget(audio.entity_type, audio.entity_id)
+            metrics.log('audio_deleted', audio_id=audio_id, link=audio.link if audio else None)
+            if self.audio_index is not None:
+                self.audio_index.remove(audio_id)
+            if self._cached('audios'):
+                self.table_cache.delete('audios', [audio_id])
         except Exception as e:
-            print(f"An error occurred while deleting the audio record for audio_id={audio_id}: {e}")
+            metrics.log('audio_delete_failed', audio_id=audio_id, error=str(e))
 
-        
+
+    @instrumented('supabase')
+    def delete_audios(self, audio_ids: Iterable[int]) -> int:
+        """
+        Deletes many audio records from the `audios` table in chunked `in` queries.
+
+        Args:
+            audio_ids: The ids of the audio records to delete.
+
+        Returns:
+            The number of ids deleted.
+        """
+        audio_ids = list(dict.fromkeys(audio_ids))
+        for chunk in chunked(audio_ids):
+            # The deleted rows are returned, so their entities can be forgotten as well
+            response = execute_write(self.client.from_("audios").delete().in_("id", chunk))
+            for row in response.data or []:
+                self.audio_loader.clear((row['entity_type'], row['entity_id']))
+                if self.journal is not None:
+                    self.journal.forget(row['entity_type'], row['entity_id'])
+            if self.audio_index is not None:
+                for audio_id in chunk:
+                    self.audio_index.remove(audio_id)
+            if self._cached('audios'):
+                self.table_cache.delete('audios', chunk)
+        metrics.log('audios_deleted', count=len(audio_ids))
+        return len(audio_ids)
+
+    @instrumented('supabase')
     def get_total_pieces_count(self) -> int:
         """Gets the total number of pieces of artwork in the database.
 
@@ -85,9 +293,10 @@ class SupabaseClient:
         response = self.client.from_('pieces').select("id", count="exact").execute() # We only need the 'id' column for counting purposes
 
         count = response.count
-        print('Total count: ', count)
+        metrics.log('pieces_counted', count=count)
         return int(count)
 
+    @instrumented('supabase')
     def get_all_pieces(self) -> List[Piece]:
         """Gets all pieces of artwork from the database.
 
@@ -98,35 +307,117 @@ class SupabaseClient:
         """
         
         total_pieces_count = self.get_total_pieces_count()
-        LIMIT = 1000
-        offset = 0
-        all_data = []
+        all_data = fetch_all_pages(
+            lambda: self.client.from_('pieces').select('*').order('id'),
+            total_pieces_count,
+            label='pieces'
+        )
+
+        if not all_data:
+            raise Exception('No pieces found')
+
+        # Map each piece to a new Piece object
+        return [from_row(Piece, piece) for piece in all_data]
+
+    def iter_pieces(self,
+            columns: Sequence[str] = ('id', 'title', 'displaydate', 'artist', 'location', 'overview', 'description'),
+            where: Optional[Callable] = None,
+            page_size: int = 1000,
+            after_id: Optional[int] = None) -> Iterator[Piece]:
+        """Streams pieces of artwork from the database one page at a time.
+
+        Pages by `id > last_id` rather than by offset, so deep pages cost the same as the
+        first, and only one page is held in memory at a time.
+
+        Args:
+            columns: The columns to fetch. `id` is always fetched. Fields that aren't
+                fetched are None on the yielded pieces.
+            where: Optional function that takes the query and returns it with extra
+                filters applied, e.g. `lambda q: q.eq('overview', 'Not found')`.
+            page_size: The number of rows fetched per request.
+            after_id: Only yield pieces with an id greater than this.
+
+        Yields:
+            Piece objects in ascending id order.
+        """
+        select = ','.join(dict.fromkeys(('id',) + tuple(columns)))
+        last_id = after_id
 
         while True:
-            response = self.client.from_('pieces').select('*').range(offset, offset + LIMIT - 1).execute()
-        
-            data = response.data
+            query = self.client.from_('pieces').select(select)
+            if where is not None:
+                query = where(query)
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            with metrics.timer('iter_pieces', 'supabase'):
+                data = query.order('id').limit(page_size).execute().data
             if not data:
-                break
+                return
 
-            all_data.extend(data)
-            offset += LIMIT
-            print(f'get_all_pieces(): {offset} / {total_pieces_count} pieces retrieved ({round((offset/total_pieces_count) * 100)}%)')
+            for piece in data:
+                yield from_row(Piece, piece)
 
-        if not all_data:
-            raise Exception('No pieces found')
+            if len(data) < page_size:
+                return
+            last_id = data[-1]['id']
 
-        # Map each piece to a new Piece object
-        return [Piece(
-            id=piece['id'],
-            title=piece['title'],
-            displaydate=piece['displaydate'],
-            artist=piece['artist'],
-            location=piece['location'],
-            overview=piece['overview'],
-            description=piece['description'],
-        ) for piece in all_data]
+    def iter_audios(self, after_id: Optional[int] = None, page_size: int = 1000) -> Iterator[Audio]:
+        """Streams audio records from the database one page at a time, paging by id.
+
+        Args:
+            after_id: Only yield audio records with an id greater than this.
+            page_size: The number of rows fetched per request.
+
+        Yields:
+            Audio objects in ascending id order.
+        """
+        last_id = after_id
+
+        while True:
+            query = self.client.from_('audios').select('*')
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            with metrics.timer('iter_audios', 'supabase'):
+                data = query.order('id').limit(page_size).execute().data
+            if not data:
+                return
+
+            for audio in data:
+                yield from_row(Audio, audio)
 
+            if len(data) < page_size:
+                return
+            last_id = data[-1]['id']
+
+    def iter_artists(self, after_id: Optional[int] = None, page_size: int = 1000) -> Iterator[Artist]:
+        """Streams artists from the database one page at a time, paging by id.
+
+        Args:
+            after_id: Only yield artists with an id greater than this.
+            page_size: The number of rows fetched per request.
+
+        Yields:
+            Artist objects in ascending id order.
+        """
+        last_id = after_id
+
+        while True:
+            query = self.client.from_('artists').select('*')
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            with metrics.timer('iter_artists', 'supabase'):
+                data = query.order('id').limit(page_size).execute().data
+            if not data:
+                return
+
+            for artist in data:
+                yield from_row(Artist, artist)
+
+            if len(data) < page_size:
+                return
+            last_id = data[-1]['id']
+
+    @instrumented('supabase')
     def get_all_audios(self) -> List[Audio]:
         """Gets all audio records from the database.
 
@@ -135,64 +426,85 @@ class SupabaseClient:
         Raises:
             Exception: If no audio records are found.
         """
-        response = self.client.from_("audios").select("*").execute()
-        audio_list = response.data
+        LIMIT = 1000
+        offset = 0
+        audio_list = []
+
+        while True:
+            response = self.client.from_("audios").select("*").order('id').range(offset, offset + LIMIT - 1).execute()
+
+            data = response.data
+            if not data:
+                break
+
+            audio_list.extend(data)
+            if len(data) < LIMIT:
+                break
+            offset += LIMIT
+
         if not audio_list:
-            raise Exception('No audio records found')
+            raise Exception(NO_AUDIOS_FOUND)
 
         # Map each audio to a new Audio object
-        return [Audio(
-            id=audio['id'],
-            created_at=audio['created_at'],
-            entity_type=audio['entity_type'],
-            entity_id=audio['entity_id'],
-            link=audio['link']
-        ) for audio in audio_list]
+        return [from_row(Audio, audio) for audio in audio_list]
 
+    @instrumented('supabase')
     def get_audio_by_id(self, audio_id: str) -> Audio:
         response = self.client.from_("audios").select("*").eq('id', audio_id).limit(1).execute()
         audio = response.data[0] if response.data else None
         if not audio:
             return None
 
-        return Audio(
-            id=audio['id'],
-            created_at=audio['created_at'],
-            entity_type=audio['entity_type'],
-            entity_id=audio['entity_id'],
-            link=audio['link']
-        )
+        return from_row(Audio, audio)
     
     def get_audio_by_piece(self, piece: Piece) -> Audio:
         entity_id = piece.id
-        response = self.client.from_("audios").select("*").eq('entity_type', 'piece').eq('entity_id', entity_id).limit(1).execute()
-        audio = response.data[0] if response.data else None
-        if not audio:
-            return None
-
-        return Audio(
-            id=audio['id'],
-            created_at=audio['created_at'],
-            entity_type=audio['entity_type'],
-            entity_id=audio['entity_id'],
-            link=audio['link']
-        )
+        # Only lookups that reach the loader are timed, so index and cache hits don't skew the latency
+        if self.audio_index is not None:
+            metrics.inc('cache_hits_total', stage='get_audio_by_piece', provider='supabase')
+            return self.audio_index.get('piece', entity_id)
+        if self._cached('audios'):
+            metrics.inc('cache_hits_total', stage='get_audio_by_piece', provider='supabase')
+            return self.table_cache.lookup('audios', audio_key('piece', entity_id))
+        with metrics.timer('get_audio_by_piece', 'supabase'):
+            return self.audio_loader.load(('piece', entity_id))
     
     def get_audio_by_artist(self, artist: Artist) -> Audio:
         entity_id = artist.id
-        response = self.client.from_("audios").select("*").eq('entity_type', 'artist').eq('entity_id', entity_id).limit(1).execute()
-        audio = response.data[0] if response.data else None
-        if not audio:
-            return None
+        # Only lookups that reach the loader are timed, so index and cache hits don't skew the latency
+        if self.audio_index is not None:
+            metrics.inc('cache_hits_total', stage='get_audio_by_artist', provider='supabase')
+            return self.audio_index.get('artist', entity_id)
+        if self._cached('audios'):
+            metrics.inc('cache_hits_total', stage='get_audio_by_artist', provider='supabase')
+            return self.table_cache.lookup('audios', audio_key('artist', entity_id))
+        with metrics.timer('get_audio_by_artist', 'supabase'):
+            return self.audio_loader.load(('artist', entity_id))
+
+    @instrumented('supabase')
+    def get_audios_by_entities(self, entities: Iterable[tuple]) -> Dict[tuple, Audio]:
+        """Gets the audio records of many entities using chunked `in` queries.
 
-        return Audio(
-            id=audio['id'],
-            created_at=audio['created_at'],
-            entity_type=audio['entity_type'],
-            entity_id=audio['entity_id'],
-            link=audio['link']
-        )
+        Args:
+            entities: (entity_type, entity_id) pairs. Duplicates are ignored.
 
+        Returns:
+            A dict mapping each pair that has audio to its oldest audio record.
+        """
+        ids_by_type: Dict[str, List[int]] = {}
+        for entity_type, entity_id in dict.fromkeys(entities):
+            ids_by_type.setdefault(entity_type, []).append(entity_id)
+
+        audios = {}
+        for entity_type, entity_ids in ids_by_type.items():
+            for chunk in chunked(entity_ids):
+                response = self.client.from_("audios").select("*").eq('entity_type', entity_type).in_('entity_id', chunk).order('id').execute()
+                for audio in response.data or []:
+                    # Keep the first match per entity, like a limit(1) lookup
+                    audios.setdefault((entity_type, audio['entity_id']), from_row(Audio, audio))
+        return audios
+
+    @instrumented('supabase')
     def search_pieces(self, title: str, artist: str) -> Piece:
         """Searches for pieces of artwork by title and artist.
 
@@ -203,6 +515,15 @@ class SupabaseClient:
         Returns:
             A Piece object representing the artwork, if it is found. Otherwise, None.
         """
+        # A title with nothing left to index after normalizing (e.g. only symbols) can't match
+        # locally, so it is left to the database search
+        if self.piece_index is not None and normalize(title):
+            match = self.piece_index.match(title, artist)
+            if not match:
+                raise Exception('Piece not found')
+            # The index only holds ids, titles and artists
+            return self.get_piece_by_id(match.id)
+
         search_term = f'{title} {artist}'
         response = self.client.rpc('search_pieces', {'search_term': search_term}).limit(1).execute()
         piece = response.data[0] if response.data else None
@@ -210,15 +531,7 @@ class SupabaseClient:
             raise Exception('Piece not found')
 
         # Create a new Piece object from the response data
-        return Piece(
-            id=piece['id'],
-            title=piece['title'],
-            displaydate=piece['displaydate'],
-            artist=piece['artist'],
-            location=piece['location'],
-            overview=piece['overview'],
-            description=piece['description']
-        )
+        return from_row(Piece, piece)
 
     def get_piece_by_id(self, piece_id: int) -> Optional[Piece]:
         """Gets a piece of artwork by ID.
@@ -229,22 +542,51 @@ class SupabaseClient:
         Returns:
             A Piece object representing the artwork, if it is found. Otherwise, None.
         """
-        response = self.client.from_('pieces').select('*').eq('id', piece_id).limit(1).execute()
-        piece = response.data[0] if response.data else None
-        if not piece:
-            return None
+        if self._cached('pieces'):
+            piece = self.table_cache.get('pieces', piece_id)
+            if piece is not None or self.table_cache.covers('pieces', piece_id):
+                metrics.inc('cache_hits_total', stage='get_piece_by_id', provider='supabase')
+                return piece
 
-        # Create a new Piece object from the response data
-        return Piece(
-            id=piece['id'],
-            title=piece['title'],
-            displaydate=piece['displaydate'],
-            artist=piece['artist'],
-            location=piece['location'],
-            overview=piece['overview'],
-            description=piece['description']
-        )
+        with metrics.timer('get_piece_by_id', 'supabase'):
+            return self.piece_loader.load(piece_id)
+
+    @instrumented('supabase')
+    def get_pieces_by_ids(self, piece_ids: Iterable[int]) -> Dict[int, Piece]:
+        """Gets many pieces of artwork by ID using chunked `in` queries.
 
+        Args:
+            piece_ids: The IDs of the artwork to retrieve. Duplicates are ignored.
+
+        Returns:
+            A dict mapping each found ID to its Piece object. IDs that don't exist are left out.
+        """
+        pieces = {}
+        for chunk in chunked(list(dict.fromkeys(piece_ids))):
+            response = self.client.from_('pieces').select('*').in_('id', chunk).execute()
+            for piece in response.data or []:
+                pieces[piece['id']] = from_row(Piece, piece)
+        return pieces
+
+    @instrumented('supabase')
+    def get_audios_by_ids(self, audio_ids: Iterable[int]) -> List[Audio]:
+        """Gets many audio records by ID using chunked `in` queries. IDs that don't exist are left out."""
+        audios = []
+        for chunk in chunked(list(dict.fromkeys(audio_ids))):
+            response = self.client.from_('audios').select('*').in_('id', chunk).execute()
+            audios.extend(from_row(Audio, audio) for audio in response.data or [])
+        return audios
+
+    @instrumented('supabase')
+    def get_artists_by_ids(self, artist_ids: Iterable[int]) -> List[Artist]:
+        """Gets many artists by ID using chunked `in` queries. IDs that don't exist are left out."""
+        artists = []
+        for chunk in chunked(list(dict.fromkeys(artist_ids))):
+            response = self.client.from_('artists').select('*').in_('id', chunk).execute()
+            artists.extend(from_row(Artist, artist) for artist in response.data or [])
+        return artists
+
+    @instrumented('supabase')
     def get_piece_by_title(self, title: str) -> Optional[Piece]:
         """Gets a piece of artwork by title.
 
@@ -260,15 +602,7 @@ class SupabaseClient:
             raise Exception('Piece not found')
 
         # Create a new Piece object from the response data
-        return Piece(
-            id=piece['id'],
-            title=piece['title'],
-            displaydate=piece['displaydate'],
-            artist=piece['artist'],
-            location=piece['location'],
-            overview=piece['overview'],
-            description=piece['description']
-        )
+        return from_row(Piece, piece)
 
     def get_artist_by_name(self, name: str) -> Optional[Artist]:
         """Gets an artist by name.
@@ -279,20 +613,40 @@ class SupabaseClient:
         Returns:
             An Artist object representing the artist, if found. Otherwise, None.
         """
-        response = self.client.from_('artists').select('*').eq('artist_name', name).limit(1).execute()
-        artist_data = response.data[0] if response.data else None
-        if not artist_data:
-            return None
+        if self._cached('artists'):
+            artist = self.table_cache.lookup('artists', name)
+            if artist is not None:
+                metrics.inc('cache_hits_total', stage='get_artist_by_name', provider='supabase')
+                return artist
+            # Names have no watermark, so a miss may be an artist added or renamed since the last refresh
 
-        # Create a new Artist object from the response data
-        return Artist(
-            id=artist_data['id'],
-            artist_name=artist_data['artist_name'],
-            nationality=artist_data['nationality'],
-            lifespan=artist_data['lifespan'],
-            biography=artist_data['biography']
-        )
+        with metrics.timer('get_artist_by_name', 'supabase'):
+            return self.artist_loader.load(name)
+
+    @instrumented('supabase')
+    def get_artists_by_names(self, names: Iterable[str]) -> Dict[str, Optional[Artist]]:
+        """Gets many artists by name using chunked `in` queries.
+
+        This always queries; use artist_loader.load_many to reuse and fill the loader's cache.
+
+        Args:
+            names: The names of the artists to retrieve. Duplicates and empty names are ignored.
+
+        Returns:
+            A dict mapping each requested name to its Artist object, or None if not found.
+        """
+        wanted = list(dict.fromkeys(name for name in names if name))
+        artists: Dict[str, Optional[Artist]] = {}
+
+        for chunk in chunked(wanted):
+            response = self.client.from_('artists').select('*').in_('artist_name', chunk).order('id').execute()
+            for artist_data in response.data or []:
+                # Keep the first match per name, like a limit(1) lookup
+                artists.setdefault(artist_data['artist_name'], from_row(Artist, artist_data))
+
+        return {name: artists.get(name) for name in wanted}
     
+    @instrumented('supabase')
     def get_piece(self,
             id: Union[int, None] = None, 
             title: Union[str, None] = None, 
@@ -340,16 +694,9 @@ class SupabaseClient:
             raise Exception('Piece not found')
 
         # Map each piece to a new Piece object
-        return Piece(
-            id=piece['id'],
-            title=piece['title'],
-            displaydate=piece['displaydate'],
-            artist=piece['artist'],
-            location=piece['location'],
-            overview=piece['overview'],
-            description=piece['description'],
-        )
+        return from_row(Piece, piece)
 
+    @instrumented('supabase')
     def get_pieces(self,
             id: Union[int, None] = None, 
             title: Union[str, None] = None, 
@@ -398,16 +745,9 @@ class SupabaseClient:
             raise Exception('Piece not found')
 
         # Map each piece to a new Piece object
-        return [Piece(
-            id=piece['id'],
-            title=piece['title'],
-            displaydate=piece['displaydate'],
-            artist=piece['artist'],
-            location=piece['location'],
-            overview=piece['overview'],
-            description=piece['description'],
-        ) for piece in pieces]
+        return [from_row(Piece, piece) for piece in pieces]
 
+    @instrumented('supabase')
     def update_piece(self, piece: Piece):
         """
         Updates an existing artwork record in the `pieces` table in Supabase based on the `id`.
@@ -429,10 +769,47 @@ class SupabaseClient:
             "overview": piece.overview,
             "description": piece.description
         }
-        result = self.client.from_("pieces").update(update_dict).eq("id", piece.id).execute()
-        if result.count == 0:
+        try:
+            result = execute_write(self.client.from_("pieces").update(update_dict).eq("id", piece.id))
+        finally:
+            # Callers edit the loader's cached instance before writing it, so it is dropped even
+            # if the write failed, rather than serving changes that were never saved
+            self.piece_loader.clear(piece.id)
+        if self.table_cache is not None:
+            self.table_cache.invalidate('pieces', [piece.id])
+        if not result.data:
             raise Exception('No piece found with id: {}'.format(piece.id))
-        print("Piece updated: ", piece)
+        metrics.log('piece_updated', piece_id=piece.id)
+
+    @instrumented('supabase')
+    def upsert_pieces(self, pieces: List[Piece], chunk_size: int = 500, columns: Iterable[str] = Piece.__slots__) -> int:
+        """
+        Writes many existing artwork records back to the `pieces` table in chunked bulk upserts.
+
+        Args:
+            pieces: The Piece objects to write.
+            chunk_size: The number of rows sent per request.
+            columns: The columns to write besides `id`. Columns left out keep their value in
+                Supabase. Defaults to every column, so the pieces should then be complete rows.
+
+        Returns:
+            The number of rows written.
+        """
+        columns = ['id'] + [column for column in columns if column != 'id']
+        written = 0
+        try:
+            for chunk in chunked(pieces, chunk_size):
+                rows = [{column: getattr(piece, column) for column in columns} for piece in chunk]
+                execute_write(self.client.from_("pieces").upsert(rows))
+                if self.table_cache is not None:
+                    self.table_cache.invalidate('pieces', [piece.id for piece in chunk])
+                written += len(rows)
+                metrics.log('pieces_upserted', written=written, total=len(pieces))
+        finally:
+            # As in update_piece, edited instances aren't left in the loader, written or not
+            for piece in pieces:
+                self.piece_loader.clear(piece.id)
+        return written
 
 def main():
     """
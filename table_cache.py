@@ -0,0 +1,210 @@
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Type
+from piece import Piece
+from artist import Artist
+from audio import Audio
+import json
+import os
+import sqlite3
+
+TABLE_CACHE_PATH = os.environ.get('TABLE_CACHE', 'table_cache.sqlite3')
+
+# The tables that can be cached and the model their rows are stored as
+TABLE_MODELS: Dict[str, Type] = {
+    'pieces': Piece,
+    'audios': Audio,
+    'artists': Artist,
+}
+
+# The secondary key each table is looked up by, besides its id
+LOOKUP_KEYS: Dict[str, Callable] = {
+    'audios': lambda audio: audio_key(audio.entity_type, audio.entity_id),
+    'artists': lambda artist: artist.artist_name,
+}
+
+PUT_BATCH_SIZE = 1000
+
+
+def audio_key(entity_type: str, entity_id: int) -> str:
+    return '{}:{}'.format(entity_type, entity_id)
+
+
+class TableCache:
+    def __init__(self, path: str = TABLE_CACHE_PATH):
+        """
+        A local SQLite copy of Supabase tables that survives between runs. A refresh only
+        fetches rows with an id above the table's watermark plus any ids that were invalidated,
+        so a repeat run costs one small delta query per table instead of a full scan.
+
+        Only changes made through SupabaseClient are invalidated. Rows edited or deleted by
+        anything else stay stale until a full refresh.
+
+        Args:
+            path (str): The SQLite database file. Created if missing.
+        """
+        self.path = path
+        self._lock = Lock()
+        # Shared by the pipeline's worker threads; every access holds the lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS rows (
+                tbl TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                lookup TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (tbl, id)
+            );
+            CREATE INDEX IF NOT EXISTS rows_lookup ON rows (tbl, lookup);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                tbl TEXT PRIMARY KEY,
+                max_id INTEGER,
+                refreshed_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS invalidated (
+                tbl TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (tbl, id)
+            );
+        ''')
+        self._connection.commit()
+
+    def _load(self, table: str, data: Optional[tuple]):
+        if data is None:
+            return None
+        return TABLE_MODELS[table](*json.loads(data[0]))
+
+    def max_id(self, table: str) -> Optional[int]:
+        """Returns the highest id fetched by a refresh, or None if the table was never refreshed."""
+        with self._lock:
+            row = self._connection.execute('SELECT max_id FROM watermarks WHERE tbl = ?', (table,)).fetchone()
+        return row[0] if row else None
+
+    def is_loaded(self, table: str) -> bool:
+        """Whether the table has been refreshed at least once, so its lookups can be trusted."""
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM watermarks WHERE tbl = ?', (table,)).fetchone() is not None
+
+    def covers(self, table: str, record_id: int) -> bool:
+        """
+        Whether a miss for the id means the row doesn't exist: the table was refreshed, the id
+        is at or below its watermark and the id wasn't invalidated since.
+        """
+        with self._lock:
+            watermark = self._connection.execute('SELECT max_id FROM watermarks WHERE tbl = ?', (table,)).fetchone()
+            if watermark is None or watermark[0] is None or record_id is None or record_id > watermark[0]:
+                return False
+            return self._connection.execute('SELECT 1 FROM invalidated WHERE tbl = ? AND id = ?', (table, record_id)).fetchone() is None
+
+    def get(self, table: str, record_id: int):
+        """Returns the cached row with the id as a model object, or None."""
+        with self._lock:
+            data = self._connection.execute('SELECT data FROM rows WHERE tbl = ? AND id = ?', (table, record_id)).fetchone()
+        return self._load(table, data)
+
+    def lookup(self, table: str, key: str):
+        """Returns the cached row with the lowest id for a LOOKUP_KEYS key, or None."""
+        with self._lock:
+            data = self._connection.execute(
+                'SELECT data FROM rows WHERE tbl = ? AND lookup = ? ORDER BY id LIMIT 1', (table, key)
+            ).fetchone()
+        return self._load(table, data)
+
+    def put(self, table: str, records: Iterable) -> int:
+        """
+        Stores model objects, replacing cached rows with the same id. Records are written in
+        batches, so a generator is consumed without holding every record in memory.
+
+        Returns:
+            int: The highest id stored, or None if there were no records.
+        """
+        columns = TABLE_MODELS[table].__slots__
+        key = LOOKUP_KEYS.get(table)
+        batch = []
+        max_id = None
+
+        def flush():
+            with self._lock:
+                self._connection.executemany('INSERT OR REPLACE INTO rows (tbl, id, lookup, data) VALUES (?, ?, ?, ?)', batch)
+                self._connection.commit()
+            batch.clear()
+
+        for record in records:
+            batch.append((table, record.id, key(record) if key else None, json.dumps([getattr(record, column) for column in columns])))
+            max_id = record.id if max_id is None else max(max_id, record.id)
+            if len(batch) >= PUT_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        return max_id
+
+    def delete(self, table: str, record_ids: Iterable[int]):
+        with self._lock:
+            self._connection.executemany('DELETE FROM rows WHERE tbl = ? AND id = ?', [(table, record_id) for record_id in record_ids])
+            self._connection.commit()
+
+    def invalidate(self, table: str, record_ids: Iterable[int]):
+        """Marks rows as changed, so the next refresh fetches them again. Until then they are not served."""
+        record_ids = list(record_ids)
+        with self._lock:
+            self._connection.executemany('INSERT OR IGNORE INTO invalidated (tbl, id) VALUES (?, ?)', [(table, record_id) for record_id in record_ids])
+            self._connection.executemany('DELETE FROM rows WHERE tbl = ? AND id = ?', [(table, record_id) for record_id in record_ids])
+            self._connection.commit()
+
+    def refresh(self, table: str, fetch_after: Callable[[Optional[int]], Iterable], fetch_by_ids: Callable[[List[int]], Iterable], full: bool = False) -> int:
+        """
+        Brings a table up to date: fetches the rows added since the watermark and re-fetches
+        the invalidated ones.
+
+        Args:
+            table (str): One of TABLE_MODELS.
+            fetch_after (Callable): Called with the watermark id (None for everything). Returns
+                the rows with a greater id, as model objects in ascending id order.
+            fetch_by_ids (Callable): Called with a list of ids. Returns the rows that still exist.
+            full (bool): Whether to drop the cached rows and fetch everything again.
+
+        Returns:
+            int: The number of rows fetched.
+        """
+        if full:
+            with self._lock:
+                for statement in ('DELETE FROM rows WHERE tbl = ?', 'DELETE FROM watermarks WHERE tbl = ?', 'DELETE FROM invalidated WHERE tbl = ?'):
+                    self._connection.execute(statement, (table,))
+                self._connection.commit()
+
+        fetched = [0]
+
+        def counted(records):
+            for record in records:
+                fetched[0] += 1
+                yield record
+
+        with self._lock:
+            invalidated = [row[0] for row in self._connection.execute('SELECT id FROM invalidated WHERE tbl = ?', (table,))]
+        if invalidated:
+            # Invalidated rows are already gone from the cache; rows that no longer exist stay gone
+            self.put(table, counted(fetch_by_ids(invalidated)))
+
+        watermark = self.max_id(table)
+        new_max_id = self.put(table, counted(fetch_after(watermark)))
+        if new_max_id is None or (watermark is not None and watermark > new_max_id):
+            new_max_id = watermark
+
+        with self._lock:
+            self._connection.executemany('DELETE FROM invalidated WHERE tbl = ? AND id = ?', [(table, record_id) for record_id in invalidated])
+            self._connection.execute('''
+                INSERT INTO watermarks (tbl, max_id, refreshed_at) VALUES (?, ?, ?)
+                ON CONFLICT (tbl) DO UPDATE SET max_id = excluded.max_id, refreshed_at = excluded.refreshed_at
+            ''', (table, new_max_id, datetime.now(timezone.utc).isoformat()))
+            self._connection.commit()
+        return fetched[0]
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of cached rows per table."""
+        with self._lock:
+            return dict(self._connection.execute('SELECT tbl, COUNT(*) FROM rows GROUP BY tbl').fetchall())
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,41 @@
+from threading import Lock, Thread
+import time
+import pytest
+import archive_shards
+from archive_shards import ArchiveShards
+
+
+def test_each_shard_is_created_once_and_remembered(tmp_path, monkeypatch):
+    created = []
+    lock = Lock()
+
+    def create_item(collection, title, description):
+        time.sleep(0.05)
+        with lock:
+            created.append(title)
+            return '{}-{}'.format(collection, len(created))
+
+    monkeypatch.setattr(archive_shards, 'create_item', create_item)
+    path = str(tmp_path / 'shards.json')
+    shards = ArchiveShards(path, shard_size=10)
+    results = {}
+    threads = [Thread(target=lambda n=n: results.__setitem__(n, shards.identifier_for('piece', n))) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert sorted(created) == ['Piece MP3s 0-9', 'Piece MP3s 10-19']
+    assert len({results[n] for n in range(10)}) == 1
+    assert results[0] != results[10]
+    assert ArchiveShards(path, shard_size=10).identifier_for('piece', 5, create=False) == results[0]
+    assert shards.identifier_for('artist', 5, create=False) is None
+
+
+def test_a_failed_creation_is_tried_again(tmp_path, monkeypatch):
+    answers = [None, 'piece_mp3s-1']
+    monkeypatch.setattr(archive_shards, 'create_item', lambda *args: answers.pop(0))
+    shards = ArchiveShards(str(tmp_path / 'shards.json'), shard_size=10)
+    with pytest.raises(Exception, match='Could not create shard'):
+        shards.identifier_for('piece', 1)
+    assert shards.identifier_for('piece', 1) == 'piece_mp3s-1'
@@ -0,0 +1,110 @@
+from io import BytesIO
+from threading import Thread
+import pytest
+import requests
+import internet_archive_client
+import scheduler
+from scheduler import ProviderScheduler
+
+
+class Response:
+    def __init__(self, status_code: int, data: dict = None, headers: dict = None):
+        self.status_code = status_code
+        self.reason = 'Status {}'.format(status_code)
+        self.headers = headers or {}
+        self._data = data or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.reason, response=self)
+
+
+class Session:
+    """Answers each request with the next of the given responses or exceptions."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def _next(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def post(self, url, **kwargs):
+        return self._next('POST', url, **kwargs)
+
+
+@pytest.fixture
+def archive_scheduler(monkeypatch):
+    archive = ProviderScheduler('archive', rate=1000, burst=100, max_concurrency=1, max_retries=3, base_delay=0.001)
+    monkeypatch.setitem(scheduler.schedulers, 'archive', archive)
+    return archive
+
+
+def test_create_item_retries_throttled_and_unsent_requests(monkeypatch, archive_scheduler):
+    session = Session(
+        requests.exceptions.ConnectTimeout('connect timed out'),
+        Response(429, headers={'Retry-After': '0'}),
+        Response(200, {'uniq': 'piece-mp3s-1'}),
+    )
+    monkeypatch.setattr(internet_archive_client, 'get_http_session', lambda: session)
+    assert internet_archive_client.create_item('piece_mp3s', 'Piece MP3s', 'The mp3 files.') == 'piece-mp3s-1'
+    assert len(session.requests) == 3
+    assert archive_scheduler.retries == 2
+
+
+def test_create_item_does_not_repeat_requests_that_may_have_created_an_item(monkeypatch, archive_scheduler):
+    session = Session(Response(503))
+    monkeypatch.setattr(internet_archive_client, 'get_http_session', lambda: session)
+    assert internet_archive_client.create_item('piece_mp3s', 'Piece MP3s', 'The mp3 files.') is None
+    assert len(session.requests) == 1
+
+
+def test_search_follows_the_cursor_through_the_scheduler(monkeypatch, archive_scheduler):
+    session = Session(
+        Response(502),
+        Response(200, {'items': [{'identifier': 'a'}], 'cursor': 'next', 'total': 2}),
+        Response(200, {'items': [{'identifier': 'b'}], 'total': 2}),
+    )
+    monkeypatch.setattr(internet_archive_client, 'get_http_session', lambda: session)
+    assert [result['identifier'] for result in internet_archive_client._search('uploader:"me"', ['identifier'])] == ['a', 'b']
+    assert session.requests[-1][2]['params']['cursor'] == 'next'
+    assert archive_scheduler.retries == 1
+
+
+class Item:
+    def __init__(self):
+        self.uploaded = {}
+
+    def upload(self, files, **kwargs):
+        for name, body in files.items():
+            self.uploaded[name] = body.read()
+            body.close()
+
+
+class ArchiveSession:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, identifier):
+        return self.items.setdefault(identifier, Item())
+
+
+def test_upload_file_with_one_archive_slot(monkeypatch, archive_scheduler):
+    session = ArchiveSession()
+    monkeypatch.setattr(internet_archive_client, 'get_archive_session', lambda *keys: session)
+    monkeypatch.setattr(internet_archive_client, '_item_cache', {})
+    results = []
+    upload = Thread(target=lambda: results.append(internet_archive_client.upload_file('piece-mp3s-1', BytesIO(b'mp3'), 'a.mp3')))
+    upload.daemon = True
+    upload.start()
+    upload.join(5)
+    assert not upload.is_alive(), 'upload_file deadlocked on the archive scheduler'
+    assert results == ['https://archive.org/download/piece-mp3s-1/a.mp3']
+    assert session.items['piece-mp3s-1'].uploaded == {'a.mp3': b'mp3'}
@@ -0,0 +1,43 @@
+from journal import RECORDED, SYNTHESIZED, UPLOADED, JobJournal
+
+
+def test_stages_advance_and_keep_the_upload_url(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.sqlite3'))
+    assert journal.get('piece', 1) is None
+    journal.mark('piece', 1, SYNTHESIZED)
+    assert journal.get('piece', 1) == (SYNTHESIZED, None)
+    journal.mark('piece', 1, UPLOADED, 'https://archive.org/download/item/1.mp3')
+    journal.mark('piece', 1, RECORDED)
+    assert journal.get('piece', 1) == (RECORDED, 'https://archive.org/download/item/1.mp3')
+    journal.close()
+
+
+def test_entity_types_are_tracked_apart(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.sqlite3'))
+    journal.mark('piece', 1, RECORDED, 'https://archive.org/download/item/p1.mp3')
+    journal.mark('artist', 1, SYNTHESIZED)
+    journal.mark('artist', 2, SYNTHESIZED)
+    assert journal.get('artist', 1) == (SYNTHESIZED, None)
+    assert journal.counts() == {RECORDED: 1, SYNTHESIZED: 2}
+    journal.close()
+
+
+def test_forget_starts_the_entity_over(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.sqlite3'))
+    journal.mark('piece', 1, UPLOADED, 'https://archive.org/download/item/1.mp3')
+    journal.forget('piece', 1)
+    journal.forget('piece', 2)
+    assert journal.get('piece', 1) is None
+    journal.mark('piece', 1, SYNTHESIZED)
+    assert journal.get('piece', 1) == (SYNTHESIZED, None)
+    journal.close()
+
+
+def test_progress_survives_reopening(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    journal = JobJournal(path)
+    journal.mark('piece', 7, UPLOADED, 'https://archive.org/download/item/7.mp3')
+    journal.close()
+    reopened = JobJournal(path)
+    assert reopened.get('piece', 7) == (UPLOADED, 'https://archive.org/download/item/7.mp3')
+    reopened.close()
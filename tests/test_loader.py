@@ -0,0 +1,122 @@
+from threading import Barrier, Lock, Thread
+import time
+import pytest
+from loader import Loader
+
+
+class BatchFn:
+    """Looks keys up in a dict, recording each batch it is called with."""
+
+    def __init__(self, values, delay=0.0, error=None):
+        self.values = values
+        self.delay = delay
+        self.error = error
+        self.batches = []
+        self._lock = Lock()
+
+    def __call__(self, keys):
+        with self._lock:
+            self.batches.append(sorted(keys))
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {key: self.values[key] for key in keys if key in self.values}
+
+
+def load_concurrently(loader, keys):
+    results = {}
+    errors = {}
+    barrier = Barrier(len(keys))
+
+    def run(key):
+        barrier.wait()
+        try:
+            results[key] = loader.load(key)
+        except Exception as error:
+            errors[key] = error
+
+    threads = [Thread(target=run, args=(key,)) for key in keys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_a_lone_lookup_is_sent_at_once_and_cached():
+    batch_fn = BatchFn({1: 'one'})
+    loader = Loader('test', batch_fn, window=1)
+    start = time.monotonic()
+    assert loader.load(1) == 'one'
+    assert time.monotonic() - start < 0.5
+    assert loader.load(1) == 'one'
+    # Misses are cached too
+    assert loader.load(2) is None
+    assert loader.load(2) is None
+    assert batch_fn.batches == [[1], [2]]
+
+
+def test_concurrent_lookups_are_coalesced():
+    batch_fn = BatchFn({key: key * 10 for key in range(20)}, delay=0.05)
+    loader = Loader('test', batch_fn, window=0.05)
+    keys = list(range(20)) + [3, 3]
+    results, errors = load_concurrently(loader, keys)
+    assert not errors
+    assert results == {key: key * 10 for key in range(20)}
+    assert len(batch_fn.batches) < 10
+    assert sorted(key for batch in batch_fn.batches for key in batch) == list(range(20))
+
+
+def test_batches_are_capped_at_max_batch():
+    batch_fn = BatchFn({}, delay=0.05)
+    loader = Loader('test', batch_fn, window=0.2, max_batch=3)
+    load_concurrently(loader, list(range(10)))
+    assert all(len(batch) <= 3 for batch in batch_fn.batches)
+
+
+def test_a_failed_batch_raises_for_every_waiter_and_is_not_cached():
+    batch_fn = BatchFn({1: 'one'}, delay=0.05, error=IOError('connection reset'))
+    loader = Loader('test', batch_fn, window=0.05)
+    results, errors = load_concurrently(loader, [1, 2, 3])
+    assert not results
+    assert sorted(errors) == [1, 2, 3]
+    assert all(isinstance(error, IOError) for error in errors.values())
+
+    batch_fn.error = None
+    assert loader.load(1) == 'one'
+
+
+def test_load_many_fetches_only_missing_keys_in_chunks():
+    batch_fn = BatchFn({key: str(key) for key in range(7)})
+    loader = Loader('test', batch_fn, max_batch=2)
+    loader.prime(0, 'zero')
+    assert loader.load_many([3, 0, 1, 2, 3, 4, 9]) == {3: '3', 0: 'zero', 1: '1', 2: '2', 4: '4', 9: None}
+    assert batch_fn.batches == [[1, 3], [2, 4], [9]]
+    assert loader.load_many([1, 9]) == {1: '1', 9: None}
+    assert len(batch_fn.batches) == 3
+
+
+def test_clear_ttl_and_cache_size_expire_entries():
+    batch_fn = BatchFn({1: 'one', 2: 'two', 3: 'three'})
+    loader = Loader('test', batch_fn, cache_size=2)
+    loader.load_many([1, 2, 3])
+    loader.load(1)
+    assert batch_fn.batches[-1] == [1]
+
+    loader.clear(1)
+    loader.load(1)
+    loader.clear()
+    loader.load(3)
+    assert batch_fn.batches[-2:] == [[1], [3]]
+
+    expiring = Loader('test', batch_fn, ttl=0.01)
+    expiring.load(2)
+    time.sleep(0.02)
+    expiring.load(2)
+    assert batch_fn.batches[-2:] == [[2], [2]]
+
+
+def test_errors_from_load_many_propagate():
+    loader = Loader('test', BatchFn({}, error=ValueError('bad query')))
+    with pytest.raises(ValueError):
+        loader.load_many([1])
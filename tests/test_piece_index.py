@@ -0,0 +1,66 @@
+from piece import Piece
+from piece_index import PieceIndex, normalize, similarity, trigrams
+
+
+def piece(id: int, title: str, artist: str) -> Piece:
+    return Piece(id, title, '1650', artist, 'Amsterdam', '', '')
+
+
+INDEX = PieceIndex([
+    piece(1, 'The Night Watch', 'Rembrandt van Rijn'),
+    piece(2, 'The Milkmaid', 'Johannes Vermeer'),
+    piece(3, 'View of Delft', 'Johannes Vermeer'),
+    piece(4, 'Self-Portrait', 'Rembrandt van Rijn'),
+    piece(5, 'Self-Portrait', 'Vincent van Gogh'),
+    piece(6, 'Café Terrace at Night', 'Vincent van Gogh'),
+    piece(7, '睡蓮', 'Claude Monet'),
+])
+
+
+def test_normalize_folds_case_accents_and_punctuation():
+    assert normalize('  Café  Terrace, at NIGHT! ') == 'cafe terrace at night'
+    assert normalize('Straße_du_Nord') == 'strasse du nord'
+    assert normalize('睡蓮') == '睡蓮'
+    assert normalize('—?!') == ''
+    assert normalize(None) == ''
+
+
+def test_similarity_is_one_for_equal_titles_and_zero_for_nothing_shared():
+    assert similarity(trigrams('night watch'), trigrams('night watch')) == 1.0
+    assert similarity(trigrams('abc'), trigrams('xyz')) == 0.0
+    assert similarity(set(), trigrams('abc')) == 0.0
+
+
+def test_search_ranks_exact_titles_first_and_tolerates_typos():
+    results = INDEX.search('the nigth watch')
+    assert results[0][0].id == 1
+    assert all(a[1] >= b[1] for a, b in zip(results, results[1:]))
+    assert INDEX.match('cafe terrace at night').id == 6
+    assert INDEX.match('睡蓮').id == 7
+
+
+def test_artist_breaks_ties_between_equal_titles():
+    assert [p.id for p, _ in INDEX.search('Self Portrait', limit=2)] == [4, 5]
+    assert INDEX.match('Self Portrait', 'van Gogh').id == 5
+    assert INDEX.match('self-portrait', 'Rembrandt').id == 4
+
+
+def test_unrelated_or_empty_queries_find_nothing():
+    assert INDEX.match('Sunflowers') is None
+    assert INDEX.search('?!') == []
+    assert INDEX.search('Milkmaid', min_score=1.01) == []
+
+
+def test_match_many_keeps_query_order():
+    matches = INDEX.match_many([('view of delft', None), ('Sunflowers', None), ('The Milkmaid', 'Vermeer'), ('view of delft', None)])
+    assert [m.id if m else None for m in matches] == [3, None, 2, 3]
+    assert len(INDEX) == 7
+
+
+def test_the_artist_picks_among_more_same_titled_pieces_than_are_scored():
+    pieces = [piece(n, 'Untitled', 'Artist {}'.format(n)) for n in range(1, 201)]
+    pieces += [piece(300, 'Untitled', 'Mark Rothko'), piece(301, 'Untitled (Black on Grey)', 'Mark Rothko')]
+    index = PieceIndex(pieces)
+    assert index.match('Untitled', 'Mark Rothko').id == 300
+    assert index.match('untitled', 'rothko').id == 300
+    assert index.match('Untitled').id == 1
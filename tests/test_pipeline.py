@@ -0,0 +1,67 @@
+from threading import Event, Thread, enumerate as threads
+import pytest
+from pipeline import Pipeline, Stage
+
+
+def test_items_pass_through_every_stage():
+    pipeline = Pipeline([Stage('double', lambda x: x * 2, 3), Stage('inc', lambda x: x + 1, 2)])
+    assert sorted(pipeline.run(range(20))) == [x * 2 + 1 for x in range(20)]
+    assert pipeline.stats['double'] == {'passed': 20, 'dropped': 0, 'failed': 0}
+
+
+def test_dropped_and_failed_items_are_counted_and_left_out():
+    def check(x):
+        if x % 3 == 0:
+            raise ValueError(x)
+        return x if x % 3 == 1 else None
+
+    pipeline = Pipeline([Stage('check', check, 2), Stage('keep', lambda x: x)])
+    assert sorted(pipeline.run(range(9))) == [1, 4, 7]
+    assert pipeline.stats['check'] == {'passed': 3, 'dropped': 3, 'failed': 3}
+    assert pipeline.stats['keep']['passed'] == 3
+
+
+def test_workers_shut_down_when_the_items_raise():
+    seen = []
+
+    def items():
+        yield 1
+        yield 2
+        raise RuntimeError('source failed')
+
+    before = len(threads())
+    pipeline = Pipeline([Stage('a', lambda x: x, 2), Stage('b', seen.append, 2)])
+    with pytest.raises(RuntimeError, match='source failed'):
+        pipeline.run(items())
+    # The items fed in before the failure still finished, and no worker was left blocked
+    assert sorted(seen) == [1, 2]
+    assert len(threads()) == before
+
+
+def test_a_full_queue_holds_back_the_source():
+    release = Event()
+    fed = []
+
+    def items():
+        for x in range(10):
+            fed.append(x)
+            yield x
+
+    def slow(x):
+        release.wait(5)
+        return x
+
+    pipeline = Pipeline([Stage('slow', slow)], queue_size=2)
+    runner = Thread(target=pipeline.run, args=(items(),))
+    runner.start()
+    runner.join(0.2)
+    # One item in the worker, two in the queue and one blocked in put
+    assert len(fed) <= 4
+    release.set()
+    runner.join(5)
+    assert len(fed) == 10
+
+
+def test_a_stage_needs_a_worker():
+    with pytest.raises(ValueError):
+        Stage('none', lambda x: x, workers=0)
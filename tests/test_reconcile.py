@@ -0,0 +1,127 @@
+import reconcile
+from audio import Audio
+from reconcile import ReconcileState, archive_key, diff, repair
+
+
+def link(identifier: str, name: str) -> str:
+    return 'https://archive.org/download/{}/{}'.format(identifier, name.replace(' ', '%20'))
+
+
+def audio(id: int, entity_id: int, url: str, entity_type: str = 'piece') -> Audio:
+    return Audio(id, '2024-01-01T00:00:00', entity_type, entity_id, url)
+
+
+class DeletingClient:
+    def __init__(self):
+        self.deleted = set()
+
+    def delete_audios(self, ids):
+        self.deleted.update(ids)
+
+
+def test_archive_key_unquotes_and_rejects_other_urls():
+    assert archive_key(link('item', 'a b.mp3')) == ('item', 'a b.mp3')
+    assert archive_key('https://ia800.us.archive.org/download/item/a.mp3') == ('item', 'a.mp3')
+    assert archive_key('https://example.com/download/item/a.mp3') is None
+    assert archive_key('https://archive.org/details/item') is None
+    assert archive_key(None) is None
+
+
+def test_diff_finds_missing_orphaned_and_duplicates():
+    state = ReconcileState(
+        items={'item': ['1.mp3', '2 two.mp3', 'orphan.mp3']},
+        audios={
+            1: audio(1, 1, link('item', '1.mp3')),
+            2: audio(2, 2, link('item', '2 two.mp3')),
+            3: audio(3, 2, link('item', '2 two.mp3')),
+            4: audio(4, 4, link('item', 'gone.mp3')),
+            5: audio(5, 1, link('item', '1.mp3'), entity_type='artist'),
+        },
+    )
+    report = diff(state)
+    assert [a.id for a in report.missing] == [4]
+    assert report.orphaned == [('item', 'orphan.mp3')]
+    assert {key: [a.id for a in audios] for key, audios in report.duplicate_links.items()} == {
+        ('item', '1.mp3'): [1, 5],
+        ('item', '2 two.mp3'): [2, 3],
+    }
+    assert {key: [a.id for a in audios] for key, audios in report.duplicate_entities.items()} == {('piece', 2): [2, 3]}
+
+
+def test_repair_deletes_confirmed_missing_and_newer_duplicates(monkeypatch):
+    # The refetched listing shows 3.mp3 was uploaded after the scan, so only audio 4 is gone
+    monkeypatch.setattr(reconcile, 'get_item_files', lambda identifier: [{'name': '1.mp3'}, {'name': '3.mp3'}, {'name': '3.mp3_meta.txt'}])
+    state = ReconcileState(
+        items={'item': ['1.mp3']},
+        audios={
+            1: audio(1, 1, link('item', '1.mp3')),
+            2: audio(2, 1, link('item', '1.mp3')),
+            3: audio(3, 3, link('item', '3.mp3')),
+            4: audio(4, 4, link('item', '4.mp3')),
+            5: audio(5, 5, 'https://example.com/5.mp3'),
+        },
+    )
+    client = DeletingClient()
+    repair(client, state, diff(state), previous_file_count=1)
+    assert client.deleted == {2, 4}
+    assert sorted(state.audios) == [1, 3, 5]
+    assert state.items['item'] == ['1.mp3', '3.mp3']
+
+
+def test_repair_keeps_missing_audios_when_the_listing_shrank(monkeypatch):
+    monkeypatch.setattr(reconcile, 'get_item_files', lambda identifier: [])
+    state = ReconcileState(items={'item': ['1.mp3']}, audios={n: audio(n, n, link('item', '{}.mp3'.format(n))) for n in range(1, 4)})
+    client = DeletingClient()
+    repair(client, state, diff(state), previous_file_count=3)
+    assert client.deleted == set()
+
+    empty = ReconcileState(audios={1: audio(1, 1, link('item', '1.mp3'))})
+    repair(client, empty, diff(empty))
+    assert client.deleted == set()
+
+
+def test_repair_keeps_missing_audios_whose_item_cannot_be_listed(monkeypatch):
+    def fail(identifier):
+        raise IOError('timed out')
+
+    monkeypatch.setattr(reconcile, 'get_item_files', fail)
+    state = ReconcileState(items={'item': ['1.mp3']}, audios={2: audio(2, 2, link('item', '2.mp3'))})
+    client = DeletingClient()
+    repair(client, state, diff(state), previous_file_count=1)
+    assert client.deleted == set()
+    assert state.items['item'] == ['1.mp3']
+
+
+def test_state_round_trips(tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = ReconcileState('2024-01-01T00:00:00+00:00', 7, {'item': ['7.mp3']}, {7: audio(7, 7, link('item', '7.mp3'))})
+    state.save(path)
+    loaded = ReconcileState.load(path)
+    assert (loaded.scanned_at, loaded.max_audio_id, loaded.items, loaded.file_count()) == (state.scanned_at, 7, {'item': ['7.mp3']}, 1)
+    assert str(loaded.audios[7]) == str(state.audios[7])
+    assert ReconcileState.load(str(tmp_path / 'none.json')).file_count() == 0
+
+
+def test_repair_keeps_the_newer_duplicate_when_the_oldest_file_is_missing(monkeypatch):
+    monkeypatch.setattr(reconcile, 'get_item_files', lambda identifier: [{'name': '2.mp3'}])
+    state = ReconcileState(
+        items={'item': ['2.mp3']},
+        audios={
+            1: audio(1, 1, link('item', '1.mp3')),
+            2: audio(2, 1, link('item', '2.mp3')),
+            3: audio(3, 1, link('item', '2.mp3')),
+        },
+    )
+    client = DeletingClient()
+    repair(client, state, diff(state), previous_file_count=1)
+    assert client.deleted == {1, 3}
+    assert sorted(state.audios) == [2]
+
+
+def test_repair_keeps_duplicates_when_none_has_its_file(monkeypatch):
+    # The listing shrank, so the missing files aren't confirmed and nothing is deleted
+    monkeypatch.setattr(reconcile, 'get_item_files', lambda identifier: [])
+    state = ReconcileState(items={'item': ['other.mp3']}, audios={1: audio(1, 1, link('item', '1.mp3')), 2: audio(2, 1, link('item', '2.mp3'))})
+    client = DeletingClient()
+    repair(client, state, diff(state), previous_file_count=10)
+    assert client.deleted == set()
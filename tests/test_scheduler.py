@@ -0,0 +1,78 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import time
+import pytest
+from scheduler import ProviderScheduler, RetryableError, TokenBucket, parse_retry_after
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=50, capacity=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.02
+    for _ in range(5):
+        bucket.acquire()
+    # The five tokens past the burst take 0.1 s to refill
+    assert time.monotonic() - start >= 0.09
+
+
+def test_token_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=1000, capacity=2)
+    bucket.acquire()
+    time.sleep(0.05)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket._tokens < 1
+
+
+def test_parse_retry_after_in_seconds():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('1.5') == 1.5
+    assert parse_retry_after('-2') == 0.0
+
+
+def test_parse_retry_after_as_a_date():
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(later, usegmt=True)) <= 30
+    earlier = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(earlier, usegmt=True)) == 0.0
+
+
+@pytest.mark.parametrize('value', [None, '', 'soon'])
+def test_parse_retry_after_without_a_usable_value(value):
+    assert parse_retry_after(value) is None
+
+
+def test_call_retries_retryable_errors_then_returns():
+    scheduler = ProviderScheduler('test', rate=1000, burst=10, max_concurrency=2, base_delay=0.001)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RetryableError('503 Service Unavailable')
+        return 'ok'
+
+    assert scheduler.call(flaky) == 'ok'
+    assert scheduler.retries == 2
+
+
+def test_call_gives_up_after_max_retries():
+    scheduler = ProviderScheduler('test', rate=1000, burst=10, max_concurrency=2, max_retries=2, base_delay=0.001)
+    attempts = []
+
+    def failing():
+        attempts.append(1)
+        raise RetryableError('429 Too Many Requests')
+
+    with pytest.raises(RetryableError):
+        scheduler.call(failing)
+    assert len(attempts) == 3
+
+
+def test_backoff_never_undercuts_retry_after():
+    scheduler = ProviderScheduler('test', rate=1, burst=1, max_concurrency=1, base_delay=1, max_delay=4)
+    for attempt in range(5):
+        assert 0 <= scheduler.backoff(attempt, None) <= 4
+        assert 2 <= scheduler.backoff(attempt, 2) <= 3
@@ -0,0 +1,95 @@
+from artist import Artist
+from audio import Audio
+from table_cache import TableCache, audio_key
+
+
+def artist(id: int, name: str) -> Artist:
+    return Artist(id, name, 'Dutch', 1600, 'Bio {}'.format(id))
+
+
+class Table:
+    """Stands in for a Supabase table, counting what a refresh fetches."""
+
+    def __init__(self, rows):
+        self.rows = {row.id: row for row in rows}
+        self.fetched_after = []
+        self.fetched_ids = []
+
+    def after(self, max_id):
+        self.fetched_after.append(max_id)
+        return [self.rows[id] for id in sorted(self.rows) if max_id is None or id > max_id]
+
+    def by_ids(self, ids):
+        self.fetched_ids.append(sorted(ids))
+        return [self.rows[id] for id in ids if id in self.rows]
+
+
+def test_refresh_fetches_everything_then_only_new_rows(tmp_path):
+    cache = TableCache(str(tmp_path / 'cache.sqlite3'))
+    table = Table([artist(1, 'Rembrandt'), artist(2, 'Vermeer')])
+    assert not cache.is_loaded('artists')
+    assert cache.refresh('artists', table.after, table.by_ids) == 2
+    assert cache.max_id('artists') == 2
+
+    table.rows[3] = artist(3, 'Hals')
+    assert cache.refresh('artists', table.after, table.by_ids) == 1
+    assert table.fetched_after == [None, 2]
+    assert cache.lookup('artists', 'Hals').id == 3
+    assert cache.counts() == {'artists': 3}
+
+    # Nothing new keeps the watermark
+    assert cache.refresh('artists', table.after, table.by_ids) == 0
+    assert cache.max_id('artists') == 3
+    cache.close()
+
+
+def test_invalidated_rows_are_not_served_until_refetched(tmp_path):
+    cache = TableCache(str(tmp_path / 'cache.sqlite3'))
+    table = Table([artist(1, 'Rembrandt'), artist(2, 'Vermeer')])
+    cache.refresh('artists', table.after, table.by_ids)
+    assert cache.covers('artists', 1)
+
+    table.rows[1] = artist(1, 'Rembrandt van Rijn')
+    del table.rows[2]
+    cache.invalidate('artists', [1, 2])
+    assert cache.get('artists', 1) is None
+    assert not cache.covers('artists', 1)
+
+    assert cache.refresh('artists', table.after, table.by_ids) == 1
+    assert table.fetched_ids == [[1, 2]]
+    assert cache.get('artists', 1).artist_name == 'Rembrandt van Rijn'
+    assert cache.lookup('artists', 'Rembrandt') is None
+    # The deleted row stays gone and a miss for it can be trusted again
+    assert cache.get('artists', 2) is None
+    assert cache.covers('artists', 2)
+    assert not cache.covers('artists', 3)
+    cache.close()
+
+
+def test_lookup_returns_the_lowest_id_and_full_refresh_starts_over(tmp_path):
+    cache = TableCache(str(tmp_path / 'cache.sqlite3'))
+    table = Table([
+        Audio(5, '2024-01-02', 'piece', 9, 'https://archive.org/download/item/b.mp3'),
+        Audio(4, '2024-01-01', 'piece', 9, 'https://archive.org/download/item/a.mp3'),
+    ])
+    cache.refresh('audios', table.after, table.by_ids)
+    assert cache.lookup('audios', audio_key('piece', 9)).id == 4
+
+    del table.rows[4]
+    cache.invalidate('audios', [5])
+    assert cache.refresh('audios', table.after, table.by_ids, full=True) == 1
+    assert table.fetched_after[-1] is None
+    assert table.fetched_ids == []
+    assert cache.lookup('audios', audio_key('piece', 9)).id == 5
+    cache.close()
+
+
+def test_rows_survive_reopening(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = TableCache(path)
+    cache.refresh('artists', Table([artist(1, 'Rembrandt')]).after, lambda ids: [])
+    cache.close()
+    reopened = TableCache(path)
+    assert reopened.get('artists', 1).artist_name == 'Rembrandt'
+    assert reopened.covers('artists', 1)
+    reopened.close()
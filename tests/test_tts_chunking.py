@@ -0,0 +1,50 @@
+from io import BytesIO
+from tts_chunking import join_mp3, split_text
+
+# An MPEG 1 Layer III frame header at 128 kbps and 44.1 kHz, whose frames are 417 bytes long
+FRAME_HEADER = b'\xff\xfb\x90\x00'
+FRAME_LENGTH = 417
+
+
+def frame(fill: bytes) -> bytes:
+    return FRAME_HEADER + fill * (FRAME_LENGTH - len(FRAME_HEADER))
+
+
+def id3v2(size: int) -> bytes:
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x04\x00\x00' + syncsafe + b'\x00' * size
+
+
+def test_split_text_keeps_short_text_whole():
+    assert split_text('  One sentence. Two.  ', 100) == ['One sentence. Two.']
+
+
+def test_split_text_breaks_at_sentence_boundaries():
+    text = 'First sentence here. Second one! Third?'
+    chunks = split_text(text, 25)
+    assert chunks == ['First sentence here.', 'Second one! Third?']
+    assert ' '.join(chunks) == text
+
+
+def test_split_text_breaks_long_sentences_at_spaces_and_cuts_long_words():
+    chunks = split_text('aaa bbb ccc. ' + 'x' * 12, 8)
+    assert chunks == ['aaa bbb', 'ccc.', 'xxxxxxxx', 'xxxx']
+    assert all(len(chunk) <= 8 for chunk in chunks)
+
+
+def test_split_text_of_nothing_is_empty():
+    assert split_text('   ', 10) == []
+
+
+def test_join_mp3_concatenates_frames_in_order():
+    parts = [BytesIO(frame(b'a') * 2), BytesIO(frame(b'b'))]
+    assert join_mp3(parts, BytesIO()).read() == frame(b'a') * 2 + frame(b'b')
+
+
+def test_join_mp3_drops_tags_and_info_frames():
+    info = FRAME_HEADER + b'\x00' * 32 + b'Info' + b'\x00' * (FRAME_LENGTH - 40)
+    first = BytesIO(id3v2(20) + info + frame(b'a') + b'TAG' + b'\x00' * 125)
+    second = BytesIO(id3v2(5) + frame(b'b'))
+    out = join_mp3([first, second], BytesIO())
+    assert out.tell() == 0
+    assert out.read() == frame(b'a') + frame(b'b')
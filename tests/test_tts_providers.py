@@ -0,0 +1,39 @@
+from io import BytesIO
+import pytest
+from scheduler import RetryableError
+from tts_providers import TTSDispatcher, TTSProvider
+
+
+class Provider(TTSProvider):
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def synthesize(self, text):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return BytesIO(self.name.encode())
+
+
+def test_a_provider_must_implement_synthesize():
+    with pytest.raises(TypeError):
+        TTSProvider()
+
+
+def test_a_failing_provider_fails_over_and_cools_down():
+    throttled = Provider('throttled', RetryableError('429 Too Many Requests'))
+    working = Provider('working')
+    dispatcher = TTSDispatcher([throttled, working])
+    assert all(dispatcher.synthesize('Hello.').read() == b'working' for _ in range(5))
+    # After its first failure the throttled provider is only tried once the other fails
+    assert throttled.calls <= 1
+    assert dispatcher.counts == {'throttled': 0, 'working': 5}
+
+
+def test_every_provider_failing_returns_none():
+    dispatcher = TTSDispatcher([Provider('a', IOError('down')), Provider('b', IOError('down'))])
+    assert dispatcher.synthesize('Hello.') is None
+    with pytest.raises(Exception):
+        dispatcher.synthesize('  ')
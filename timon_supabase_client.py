@@ -3,6 +3,9 @@ from dotenv import load_dotenv
 from supabase import create_client
 import os
 from audit import Audit
+from pagination import fetch_all_pages
+from rows import from_row
+from metrics import instrumented, metrics
 
 load_dotenv()
 supabase_url = os.environ.get('TIMON_SUPABASE_URL')
@@ -10,6 +13,7 @@ supabase_anon_key = os.environ.get('TIMON_SUPABASE_ANON_KEY')
 
 client = create_client(supabase_url, supabase_anon_key)
 
+@instrumented('supabase')
 def get_total_audits_count() -> int:
     """Gets the total number of audits in the database.
 
@@ -19,30 +23,21 @@ def get_total_audits_count() -> int:
     response = client.from_('auditing').select("audit_id", count="exact").execute() # We only need the 'id' column for counting purposes
 
     count = response.count
-    print('Total count:', count)
+    metrics.log('audits_counted', count=count)
     return int(count)
 
+@instrumented('supabase')
 def get_all_audits() -> List[Audit]:
-    response = client.from_('auditing').select('*').execute()
-
-    data = response.data
+    data = fetch_all_pages(
+        lambda: client.from_('auditing').select('*').order('audit_id'),
+        get_total_audits_count(),
+        label='audits'
+    )
 
     if not data:
         raise Exception('No audits found')
 
-    return [Audit(
-        audit_id = audit['audit_id'],
-        auditor = audit['auditor'],
-        content = audit['content'],
-        start_time = audit['start_time'],
-        publish_time = audit['publish_time'],
-        flagged = audit['flagged'],
-        art_id = audit['art_id'],
-        chatgpt_time = audit['chatgpt_time'],
-        skipped = audit['skipped'],
-        gpt_output = audit['gpt_output'],
-        gpt_model = audit['gpt_model']
-    ) for audit in data]
+    return [from_row(Audit, audit) for audit in data]
 
 def main():
     """
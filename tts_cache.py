@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from threading import Lock
+from typing import BinaryIO, Optional
+
+
+class TTSCache:
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        A content-addressed on-disk cache of synthesized mp3 audio.
+
+        Entries are keyed by a hash of everything that determines the audio (text, voice and
+        model settings). When the cache grows past max_bytes, the least recently used entries
+        are evicted. Files are written atomically, so a crash never leaves a partial mp3 behind.
+
+        Args:
+            directory (str): The directory the mp3 files are stored in. Created if missing.
+            max_bytes (int): The maximum total size of the cached files.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(os.path.getsize(path) for path in self._entries())
+
+    @staticmethod
+    def key(text: str, voice_id: str, voice_settings: dict, model_id: Optional[str]) -> str:
+        """Returns the cache key for a synthesis request."""
+        payload = json.dumps([text, voice_id, voice_settings, model_id], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.mp3')
+
+    def _entries(self) -> list:
+        return [entry.path for entry in os.scandir(self.directory) if entry.name.endswith('.mp3')]
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached mp3 bytes for the key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # The modification time doubles as the last-used time for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """Returns the cached mp3 for the key as an open binary file, or None on a miss."""
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return f
+
+    def put(self, key: str, data: bytes):
+        """Stores mp3 bytes under the key, evicting old entries if the cache is over its size limit."""
+        self._store(key, lambda f: f.write(data))
+
+    def put_file(self, key: str, source: BinaryIO):
+        """Stores the rest of a binary file under the key without reading it into memory at once."""
+        self._store(key, lambda f: shutil.copyfileobj(source, f))
+
+    def _store(self, key: str, write):
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            size = os.path.getsize(tmp_path)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total_bytes += size - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda p: os.stat(p).st_mtime)
+        for entry in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                size = os.path.getsize(entry)
+                os.remove(entry)
+            except FileNotFoundError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """Returns hit, miss and eviction counts and the current cache size."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bytes': self._total_bytes,
+            }
@@ -0,0 +1,117 @@
+import re
+from typing import BinaryIO, Iterable, List, Optional
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# Layer III bitrates in kbps, indexed by the header's bitrate bits
+MPEG1_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MPEG2_BITRATES = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000], # MPEG 1
+    2: [22050, 24000, 16000], # MPEG 2
+    0: [11025, 12000, 8000], # MPEG 2.5
+}
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Splits text into chunks of at most max_chars characters, breaking at sentence boundaries
+    where possible. Sentences longer than max_chars are broken at spaces, and words longer
+    than max_chars are cut.
+
+    Args:
+        text (str): The text to split.
+        max_chars (int): The maximum length of a chunk.
+
+    Returns:
+        List[str]: The chunks, in order.
+    """
+    pieces = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for word in sentence.split():
+            pieces.extend(word[i:i + max_chars] for i in range(0, len(word), max_chars))
+
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = '{} {}'.format(current, piece) if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _frame_length(header: bytes) -> Optional[int]:
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 3
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    padding = (header[2] >> 1) & 1
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrates = MPEG1_BITRATES if version == 3 else MPEG2_BITRATES
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    return (144 if version == 3 else 72) * bitrates[bitrate_index] * 1000 // sample_rate + padding
+
+
+def _audio_range(f: BinaryIO) -> tuple:
+    """Returns the (start, end) offsets of the mp3 frames, skipping ID3 tags and a Xing/Info frame."""
+    end = f.seek(0, 2)
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+
+    start = 0
+    f.seek(0)
+    header = f.read(10)
+    if header[:3] == b'ID3' and len(header) == 10:
+        # The ID3v2 size is a 28-bit syncsafe integer and excludes the 10 byte header
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        start = 10 + size + (10 if header[5] & 0x10 else 0)
+
+    # A leading Xing/Info frame stores the duration of this part only, so it would be wrong
+    # for the joined file
+    f.seek(start)
+    length = _frame_length(f.read(4))
+    if length:
+        f.seek(start)
+        frame = f.read(length)
+        if b'Xing' in frame or b'Info' in frame:
+            start += length
+
+    return start, max(start, end)
+
+
+def join_mp3(parts: Iterable[BinaryIO], out: BinaryIO) -> BinaryIO:
+    """
+    Joins mp3 files into one by concatenating their frame streams in order.
+
+    Args:
+        parts (Iterable[BinaryIO]): Seekable binary files holding mp3 audio.
+        out (BinaryIO): The file to write the joined audio to.
+
+    Returns:
+        BinaryIO: out, positioned at the start.
+    """
+    for part in parts:
+        start, end = _audio_range(part)
+        part.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = part.read(min(remaining, 64 * 1024))
+            if not block:
+                break
+            out.write(block)
+            remaining -= len(block)
+    out.seek(0)
+    return out
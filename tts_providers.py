@@ -0,0 +1,126 @@
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import BinaryIO, List, Optional
+from elevenlabs_client import CHUNK_MAX_CHARS, text_to_speech_stream
+from scheduler import RetryableError
+from metrics import metrics
+import random
+import time
+
+# How long a provider is passed over after it fails or stays throttled through its retries
+COOLDOWN_SECONDS = 30
+# Weight given to the newest latency sample in each provider's moving average
+LATENCY_SMOOTHING = 0.2
+
+
+class TTSProvider(ABC):
+    """A text-to-speech backend. Subclasses implement synthesize."""
+    name = 'provider'
+
+    @abstractmethod
+    def synthesize(self, text: str) -> Optional[BinaryIO]:
+        """
+        Converts text to mp3 audio.
+
+        Returns:
+            BinaryIO: A binary file positioned at the start of the mp3 audio, or None if the
+            request failed. The caller should close it once done.
+
+        Raises:
+            RetryableError: If the provider is throttled.
+        """
+
+
+class ElevenLabsProvider(TTSProvider):
+    name = 'elevenlabs'
+
+    def synthesize(self, text: str) -> Optional[BinaryIO]:
+        return text_to_speech_stream(text, chunk_chars=CHUNK_MAX_CHARS)
+
+
+class TTSDispatcher:
+    def __init__(self, providers: List[TTSProvider]):
+        """
+        Spreads synthesis over several providers so that their quotas add up.
+
+        Each request goes to a provider picked at random, weighted by how fast it has been
+        (seconds per character, as a moving average). A provider that fails is skipped for
+        COOLDOWN_SECONDS and the request fails over to the next one.
+
+        Args:
+            providers (List[TTSProvider]): The providers to use, in order of preference
+                before any latency has been observed.
+        """
+        if not providers:
+            raise ValueError('TTSDispatcher needs at least one provider')
+        self.providers = providers
+        self._lock = Lock()
+        self._latency = {provider.name: None for provider in providers}
+        self._cooldown_until = {provider.name: 0.0 for provider in providers}
+        self.counts = {provider.name: 0 for provider in providers}
+
+    def _weight(self, provider: TTSProvider) -> float:
+        known = [latency for latency in self._latency.values() if latency is not None]
+        latency = self._latency[provider.name]
+        if latency is None:
+            # Unmeasured providers get the average so they are tried early
+            latency = sum(known) / len(known) if known else 1.0
+        return 1.0 / max(latency, 1e-6)
+
+    def _order(self) -> List[TTSProvider]:
+        """Returns the providers to try, in order: available ones by weighted draw, then cooling down ones."""
+        now = time.monotonic()
+        with self._lock:
+            available = [p for p in self.providers if self._cooldown_until[p.name] <= now]
+            cooling = sorted((p for p in self.providers if p not in available), key=lambda p: self._cooldown_until[p.name])
+            weights = {p.name: self._weight(p) for p in available}
+
+        order = []
+        while available:
+            provider = random.choices(available, weights=[weights[p.name] for p in available])[0]
+            available.remove(provider)
+            order.append(provider)
+        # If every provider is cooling down, still try them rather than dropping the work
+        return order + cooling
+
+    def _observe(self, provider: TTSProvider, seconds: float, chars: int):
+        sample = seconds / max(chars, 1)
+        with self._lock:
+            previous = self._latency[provider.name]
+            self._latency[provider.name] = sample if previous is None else (1 - LATENCY_SMOOTHING) * previous + LATENCY_SMOOTHING * sample
+            self.counts[provider.name] += 1
+
+    def _cool_down(self, provider: TTSProvider):
+        with self._lock:
+            self._cooldown_until[provider.name] = time.monotonic() + COOLDOWN_SECONDS
+
+    def synthesize(self, text: str) -> Optional[BinaryIO]:
+        """
+        Converts text to mp3 audio with the best available provider, failing over to the
+        others if it fails.
+
+        Returns:
+            BinaryIO: The mp3 audio, or None if every provider failed.
+        """
+        if not text or not text.strip():
+            raise Exception('Error: cannot convert empty text to speech')
+
+        for provider in self._order():
+            start = time.monotonic()
+            try:
+                mp3 = provider.synthesize(text)
+            except RetryableError as error:
+                metrics.log('tts_provider_throttled', provider=provider.name, error=str(error))
+                mp3 = None
+            except Exception as error:
+                metrics.log('tts_provider_failed', provider=provider.name, error=str(error))
+                mp3 = None
+
+            if mp3 is not None:
+                self._observe(provider, time.monotonic() - start, len(text))
+                return mp3
+            metrics.inc('failovers_total', stage='tts', provider=provider.name)
+            self._cool_down(provider)
+
+        metrics.log('tts_failed', provider='dispatcher', error='every TTS provider failed')
+        return None